@@ -25,5 +25,6 @@ from .colspec import ColumnSpecification
 from .reader import DataFormatError, configure_reader, guess_colspec
 from .converter import otpl_to_brat
 from .settings import Configuration
+from .validator import validate_otpl
 
 __version__ = '1.0'
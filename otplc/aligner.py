@@ -0,0 +1,266 @@
+"""
+Alignment of OTPL tokens to the characters of the annotated text.
+
+The :class:`TextAligner` walks the text with a cursor, expecting each token
+to follow the previous one with nothing but whitespace in between.
+A token not found at the cursor is only searched for in a bounded window
+ahead of it, and escaped or normalized tokens (e.g., PTB's ``-LRB-`` or
+````` for an opening quote) are resynchronized with the text they stand
+for; so alignment takes time linear in the size of the text, no matter how
+messy the tokens are.
+
+The text need not be held in memory as a whole: a :class:`SlidingText`
+reads it from a stream as the cursor advances, keeping only a window of
+the text around the cursor, while all offsets remain character offsets
+into the whole text.
+"""
+import re
+from functools import lru_cache
+from logging import getLogger
+from unicodedata import normalize
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+L = getLogger('otplc.aligner')
+
+PTB_ESCAPES = {
+    '-LRB-': '(', '-RRB-': ')',
+    '-LSB-': '[', '-RSB-': ']',
+    '-LCB-': '{', '-RCB-': '}',
+    '``': '"', "''": '"', '`': "'",
+}
+"The PTB escapes of brackets and quotes and the characters they stand for."
+
+QUOTES = '"\'`\u00ab\u00bb\u2018\u2019\u201a\u201b\u201c\u201d\u201e\u201f' \
+         '\u2032\u2033\u02bc'
+"The characters treated as equivalent quotes when resynchronizing."
+
+DASHES = '-\u2010\u2011\u2012\u2013\u2014\u2015\u2212'
+"The characters treated as equivalent dashes when resynchronizing."
+
+_SPACES = re.compile(r'\s*')
+
+
+@lru_cache(4096)
+def _variants(token):
+    """ Return the forms a (escaped) `token` might take in the text. """
+    forms = []
+    unescaped = PTB_ESCAPES.get(token)
+
+    if unescaped is None:
+        unescaped = re.sub(r'\\([/*])', r'\1', token)  # PTB: "\/" and "\*"
+
+    for form in (unescaped, normalize('NFKC', token),
+                 normalize('NFKC', unescaped)):
+        if form and form != token and form not in forms:
+            forms.append(form)
+
+    return tuple(forms)
+
+
+@lru_cache(4096)
+def _pattern(token):
+    """
+    Return a regex that matches any of the variants of a `token` or the
+    token itself in the text, ignoring the kind of quotes and dashes used
+    and any whitespace between the token's characters.
+    """
+    alternatives = []
+
+    for form in _variants(token) + (token,):
+        chars = []
+
+        for char in form:
+            if char in QUOTES:
+                chars.append('[%s]' % re.escape(QUOTES))
+            elif char in DASHES:
+                chars.append('[%s]' % re.escape(DASHES))
+            elif not char.isspace():
+                chars.append(re.escape(char))
+
+        if chars:
+            alternatives.append(r'\s*'.join(chars))
+
+    return re.compile('|'.join(alternatives)) if alternatives else None
+
+
+class TextAligner(object):
+
+    """
+    Find the character offsets of consecutive tokens in a text.
+
+    Each token is looked up, in order:
+
+    1. at the cursor, after skipping any whitespace,
+    2. in its unescaped or normalized forms (see :data:`PTB_ESCAPES`) at
+       that position, and
+    3. anywhere in the `window` of characters after that position, either
+       as is or as a pattern of any of its forms that ignores the kind of
+       quotes and dashes used and any whitespace inside the token -
+       whichever comes first.
+
+    As the cursor never moves back, and no search looks further ahead than
+    the window, aligning a text takes time linear in its length.
+    """
+
+    WINDOW = 1000
+    "The default number of characters searched beyond the cursor."
+
+    def __init__(self, text, window=WINDOW):
+        """
+        :param text: the text (a string or :class:`SlidingText`) to align
+                     the tokens to
+        :param window: the number of characters to search beyond the cursor
+        """
+        self.text = text
+        self.window = window
+        self.skipped = 0  # non-whitespace characters skipped over
+        self.resynced = 0  # tokens only found in an alternative form
+
+    @property
+    def text(self):
+        """ The text (a string or :class:`SlidingText`) to align tokens to. """
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+
+        if isinstance(text, str):
+            self._view = lambda start, stop: (text, 0)
+        else:
+            self._view = text.view
+
+    def align(self, token, start):
+        """
+        Find the `token` at or after the offset `start` in the text.
+
+        :param token: the token string to find
+        :param start: the offset of the cursor in the text
+        :return: the ``(start, end)`` offsets of the token in the text or
+                 ``None`` if it could not be aligned
+        """
+        text, offset = self._view(start, start + self.window + 3 * len(token))
+        i = start - offset
+
+        if text.startswith(token, i):
+            return start, start + len(token)
+        elif text.startswith(token, i + 1) and text[i].isspace():
+            return start + 1, start + 1 + len(token)  # the usual case
+
+        pos = _SPACES.match(text, i).end()
+
+        if text.startswith(token, pos):
+            return pos + offset, pos + offset + len(token)
+
+        for form in _variants(token):
+            if text.startswith(form, pos):
+                self.resynced += 1
+                return pos + offset, pos + offset + len(form)
+
+        end = min(pos + self.window, len(text))
+        found = text.find(token, pos, end + len(token))
+        pattern = _pattern(token)
+        match = None
+
+        if pattern is not None:
+            # only an alternative form *before* the token itself counts
+            limit = end if found == -1 else found
+            match = pattern.search(text, pos, limit + 2 * len(token) + 2)
+
+            if match is not None and found != -1 and match.start() >= found:
+                match = None
+
+        if match is not None:
+            self._skip(text, token, pos, match.start(), offset)
+            self.resynced += 1
+            return match.start() + offset, match.end() + offset
+        elif found != -1:
+            self._skip(text, token, pos, found, offset)
+            return found + offset, found + offset + len(token)
+
+        return None
+
+    def _skip(self, text, token, pos, found, offset):
+        if found > pos:
+            self.skipped += found - pos
+            L.debug('skipped "%s" before "%s" at %d',
+                    text[pos:found], token, found + offset)
+
+
+class SlidingText(object):
+
+    """
+    A window onto a text read incrementally from a (text-mode) stream or
+    fed to it piecewise, addressed by character offsets into the whole
+    text.
+
+    Text before the offset last passed to :meth:`.discard` is dropped, so
+    the memory used is bounded by the span between that offset and the
+    end of the text accessed since (plus one chunk).
+    """
+
+    CHUNK = 1 << 16
+    "The default number of characters read from the stream at a time."
+
+    def __init__(self, stream=None, chunk=CHUNK):
+        """
+        :param stream: a text stream to read from or ``None`` to only
+                       :meth:`.feed` the text
+        :param chunk: the number of characters to read at a time
+        """
+        self._stream = stream
+        self._chunk = chunk
+        self._buffer = ''
+        self._offset = 0  # the offset of the first character in the buffer
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step is not None:
+            raise TypeError('only slices of a SlidingText are supported')
+
+        start = self._offset if key.start is None else key.start
+        stop = start if key.stop is None else key.stop
+        text, offset = self.view(start, stop)
+        return text[start - offset:max(stop - offset, 0)]
+
+    @property
+    def start(self):
+        """ The offset of the first character still available. """
+        return self._offset
+
+    @property
+    def end(self):
+        """ The offset after the last character read so far. """
+        return self._offset + len(self._buffer)
+
+    def feed(self, text):
+        """ Append the `text` to the end of the window. """
+        self._buffer += text
+
+    def view(self, start, stop):
+        """
+        Return the buffered text, having read the text at least up to the
+        offset `stop` if possible, and the offset of its first character.
+
+        :raises IndexError: if the text at `start` was discarded already
+        """
+        if start < self._offset:
+            raise IndexError('text at %d discarded (window starts at %d)' % (
+                start, self._offset
+            ))
+
+        while self._stream is not None and self.end < stop:
+            data = self._stream.read(self._chunk)
+
+            if data:
+                self._buffer += data
+            else:
+                self._stream = None
+
+        return self._buffer, self._offset
+
+    def discard(self, before):
+        """ Drop the text before the offset `before`. """
+        if before - self._offset >= self._chunk:
+            self._buffer = self._buffer[before - self._offset:]
+            self._offset = before
@@ -5,9 +5,14 @@ string and return the corresponding type object.
 And all types can be transformed to Unicode strings (:func:`str`) or be
 serialized to bytes (:func:`bytes`) in UTF-8 encoding.
 """
+from io import TextIOBase
+from itertools import islice
 from logging import getLogger
 import os
 
+from otplc.streams import aiterate, iter_lines, ASYNC_READ_AHEAD, \
+    ASYNC_BLOCK
+
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
 L = getLogger('otplc.brat')
@@ -316,8 +321,9 @@ def read(file_path, skip=None, strict=False, encoding='utf-8', **open_args):
     Yield annotation instances by parsing a brat annotation file.
 
     Any lines that cannot be parsed are skipped (see `strict`).
+    Compressed files (gzip, bzip2, xz) are decompressed transparently.
 
-    :param file_path: the file to read
+    :param file_path: the file to read or a readable stream
     :param skip: a compiled regex pattern; any input line that matches is
                  filtered
     :param strict: re-raise errors instead of skipping annotations that cannot
@@ -329,18 +335,37 @@ def read(file_path, skip=None, strict=False, encoding='utf-8', **open_args):
     """
     skip = _make_filter_function(skip)
 
-    with open(file_path, encoding=encoding, **open_args) as file:
-        for lno, raw in enumerate(file, 1):
-            line = raw.strip()
+    lines = iter_lines(file_path, encoding=encoding, **open_args)
+
+    for lno, raw in enumerate(lines, 1):
+        line = raw.strip()
+
+        if line and not skip(line):
+            annotation_type = line[0]
+
+            try:
+                # noinspection PyCallingNonCallable
+                yield _PARSE[annotation_type](line)
+            except (ValueError, TypeError, KeyError, Exception) as error:
+                _handle_error(error, file_path, line, lno, strict)
 
-            if line and not skip(line):
-                annotation_type = line[0]
 
-                try:
-                    # noinspection PyCallingNonCallable
-                    yield _PARSE[annotation_type](line)
-                except (ValueError, TypeError, KeyError, Exception) as error:
-                    _handle_error(error, file_path, line, lno, strict)
+def aread(file_path, skip=None, strict=False, encoding='utf-8',
+          depth=ASYNC_READ_AHEAD, block=ASYNC_BLOCK, executor=None,
+          **open_args):
+    """
+    Asynchronously yield annotation instances by parsing a brat annotation
+    file off the :mod:`asyncio` event loop (see :func:`read`).
+
+    :param depth: the number of annotation blocks to read ahead
+    :param block: the number of annotations read per block
+    :param executor: the executor doing the reading (default: the event loop's
+                     default executor)
+    :return: an asynchronous generator for :class:`_Annotation` instances
+    :raises IOError: if there is a "technical" problem opening/reading the file
+    """
+    annotations = read(file_path, skip, strict, encoding, **open_args)
+    return aiterate(annotations, depth, block, executor)
 
 
 def _handle_error(error, file_path, line, lno, strict):
@@ -363,10 +388,80 @@ def _make_filter_function(regex):
     )
 
 
-def write(file_path, annotations, mode='wb', **open_args):
-    """A helper to quickly write a list of annotations to a file."""
+class AnnotationWriter(object):
+
+    """
+    A buffered sink for annotations, writing them line by line to a text
+    or binary stream in large blocks.
+
+    :meth:`.write` formats each annotation into a (reused) buffer of lines
+    and flushes it once it holds `buffer_size` lines (i.e., annotations);
+    the buffered lines are joined and (for binary streams) encoded once per
+    :meth:`.flush`, which also happens when the writer is left as a context
+    manager.
+    Lines end in ``\\n`` on text streams (that translate newlines
+    themselves) and in :data:`os.linesep` on binary streams.
+    The stream itself is never closed by the writer.
+    """
+
+    BUFFER_SIZE = 4096
+    "The default number of annotations buffered before writing them."
+
+    def __init__(self, stream, buffer_size=BUFFER_SIZE, encoding='utf-8'):
+        """
+        :param stream: a (writable) text or binary stream
+        :param buffer_size: the number of annotations (not characters) to
+                            buffer
+        :param encoding: the encoding used for binary streams
+        """
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.encoding = encoding
+        self._binary = not isinstance(stream, TextIOBase)
+        self._linesep = os.linesep if self._binary else '\n'
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def write(self, annotation):
+        """ Write the `annotation` as a line (once the buffer is full). """
+        buffer = self._buffer
+        buffer.append(str(annotation))
+
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, annotations):
+        """ Write each of the `annotations` as a line. """
+        annotations = iter(annotations)
+        chunk = list(islice(annotations, self.buffer_size))
+
+        while chunk:
+            self._buffer.extend(map(str, chunk))
+            self.flush()
+            chunk = list(islice(annotations, self.buffer_size))
+
+    def flush(self):
+        """ Write all buffered lines to the stream. """
+        if self._buffer:
+            self._buffer.append('')  # for the terminal line separator
+            data = self._linesep.join(self._buffer)
+            self._buffer.clear()
+            self.stream.write(data.encode(self.encoding) if self._binary else
+                              data)
+
+
+def write(file_path, annotations, mode='wb',
+          buffer_size=AnnotationWriter.BUFFER_SIZE, **open_args):
+    """
+    A helper to quickly write a list of annotations to a file, in UTF-8 if
+    opened in binary `mode` (see :class:`AnnotationWriter`).
+    """
     if annotations:
-        with open(file_path, mode=mode, **open_args) as file:
-            for ann in annotations:
-                file.write(str(ann))
-                file.write(os.linesep)
+        with open(file_path, mode=mode, **open_args) as file, \
+                AnnotationWriter(file, buffer_size) as writer:
+            writer.write_all(annotations)
@@ -102,6 +102,7 @@ event.
 """
 from functools import partial
 from logging import getLogger
+from types import MappingProxyType
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
 L = getLogger('otplc.colspec')
@@ -158,8 +159,19 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
     The specification of column types and facilities to instantiate a spec
     from a *colspec header* (in the OTPL file) using :py:meth:`.from_string`
     or a list of integers using :py:meth:`.from_integers` .
+
+    Instances are immutable (and hashable): once initialized, the column
+    types and the targets of all references, associations, and properties
+    are frozen into per-column tuples.
     """
 
+    __slots__ = ('_width', '_token', '_global_enum', '_local_enum',
+                 '_pos_tag', '_segment_ids', '_entities', '_events',
+                 '_relations', '_global_refs', '_local_refs',
+                 '_normalizations', '_attributes', '_ref_targets',
+                 '_headers', '_types', '_targets', '_key', '_hash',
+                 '_frozen')
+
     _ANNOTATION = 99
     "*Internal*: A (yet) unspecific *annotation* (for internal use only)."
 
@@ -315,10 +327,12 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
         self._ref_targets = dict()
 
         initialize = {
-            ColumnSpecification.TOKEN: self.set_token,
-            ColumnSpecification.GLOBAL_ENUM: self.set_global_enum,
-            ColumnSpecification.LOCAL_ENUM: self.set_local_enum,
-            ColumnSpecification.POS_TAG: self.set_pos_tag,
+            ColumnSpecification.TOKEN: partial(self._set_column, 'token'),
+            ColumnSpecification.GLOBAL_ENUM:
+                partial(self._set_column, 'global_enum'),
+            ColumnSpecification.LOCAL_ENUM:
+                partial(self._set_column, 'local_enum'),
+            ColumnSpecification.POS_TAG: partial(self._set_column, 'pos_tag'),
             ColumnSpecification.SEGMENT_ID: self._segment_ids.add,
             ColumnSpecification.ENTITY: self._entities.add,
             ColumnSpecification.EVENT:
@@ -352,6 +366,7 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
                 ))
 
         self.__init_events(colspec)
+        self.__freeze(headers)
 
     def __init_events(self, colspec):
         for col in self._events:
@@ -365,18 +380,82 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
                     'EVENT column %d has less than two references' % (col + 1)
                 )
 
+    def __freeze(self, headers):
+        """ Precompute the per-column tables and make the instance immutable. """
+        types = [None] * self._width
+        targets = [None] * self._width
+
+        for col in (self._token, self._global_enum, self._local_enum,
+                    self._pos_tag):
+            if col is not None:
+                types[col] = self._get_scalar_type(col)
+
+        for coltype, columns in (
+                (self.SEGMENT_ID, self._segment_ids),
+                (self.ENTITY, self._entities),
+                (self.EVENT, self._events),
+                (self.RELATION, self._relations),
+                (self.NORMALIZATION, self._normalizations),
+                (self.ATTRIBUTE, self._attributes),
+                (self.GLOBAL_REF, self._global_refs),
+                (self.LOCAL_REF, self._local_refs),
+        ):
+            for col in columns:
+                types[col] = coltype
+
+                if isinstance(columns, dict) and coltype != self.EVENT:
+                    targets[col] = columns[col]
+
+        self._headers = tuple(headers)
+        self._types = tuple(types)
+        self._targets = tuple(targets)
+        self._segment_ids = frozenset(self._segment_ids)
+        self._entities = frozenset(self._entities)
+
+        for name in ('_events', '_relations', '_global_refs', '_local_refs',
+                     '_normalizations', '_attributes', '_ref_targets'):
+            setattr(self, name, MappingProxyType(getattr(self, name)))
+
+        self._key = (self._types, self._targets,
+                     tuple(sorted(self._events.items())))
+        self._hash = hash(self._key)
+        self._frozen = True
+
+    def _get_scalar_type(self, col):
+        if self._token == col:
+            return self.TOKEN
+        elif self._global_enum == col:
+            return self.GLOBAL_ENUM
+        elif self._local_enum == col:
+            return self.LOCAL_ENUM
+        else:
+            return self.POS_TAG
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('ColumnSpecification is immutable')
+
+        super(ColumnSpecification, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError('ColumnSpecification is immutable')
+
+    def __reduce__(self):
+        colspec = [ColumnSpecification._UNKNOWN if t is None else t
+                   for t in self._types]
+        return type(self), (colspec, self._headers)
+
     def __eq__(self, other):
         if not isinstance(other, ColumnSpecification):
             return False
 
-        for attr in ['_width', '_token', '_global_enum', '_local_enum',
-                     '_pos_tag', '_segment_ids', '_entities', '_events',
-                     '_relations', '_global_refs', '_local_refs',
-                     '_normalizations', '_attributes', '_ref_targets', ]:
-            if getattr(self, attr) != getattr(other, attr):
-                return False
+        return self._key == other._key
 
-        return True
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.header)
 
     def __str__(self):
         """ Return the colspec header string for this instance. """
@@ -392,35 +471,32 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
 
         return ' '.join(names)
 
+    @property
+    def header(self):
+        """
+        The colspec header string this instance was created from, including
+        any explicit (``:N``) reference targets.
+        """
+        return ' '.join(self._headers)
+
     def get_type(self, col):
         """ Return the column type integer for this column or ``None``. """
-        if self._token == col:
-            return self.TOKEN
-        elif self._global_enum == col:
-            return self.GLOBAL_ENUM
-        elif self._local_enum == col:
-            return self.LOCAL_ENUM
-        elif self._pos_tag == col:
-            return self.POS_TAG
-        elif col in self._segment_ids:
-            return self.SEGMENT_ID
-        elif col in self._entities:
-            return self.ENTITY
-        elif col in self._events:
-            return self.EVENT
-        elif col in self._relations:
-            return self.RELATION
-        elif col in self._normalizations:
-            return self.NORMALIZATION
-        elif col in self._attributes:
-            return self.ATTRIBUTE
-        elif col in self._global_refs:
-            return self.GLOBAL_REF
-        elif col in self._local_refs:
-            return self.LOCAL_REF
-        else:
+        try:
+            return self._types[col] if col >= 0 else None
+        except IndexError:
             return None
 
+    def get_types(self):
+        """ Return the tuple of column type integers (``None`` if unknown). """
+        return self._types
+
+    def get_target(self, col):
+        """
+        Return the target column of a reference, relation, or property
+        column (or ``None``).
+        """
+        return self._targets[col]
+
     @staticmethod
     def __get_references_before(colspec, col):
         for idx in range(col - 1, 0, -1):
@@ -432,6 +508,28 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
             else:
                 break
 
+    @property
+    def width(self):
+        """ The number of columns. """
+        return self._width
+
+    def get_used_columns(self):
+        """
+        Return a sorted tuple of all columns that are relevant for the
+        conversion (i.e., all but SEGMENT_ID and unknown columns).
+        """
+        return tuple(
+            col for col, coltype in enumerate(self._types)
+            if coltype not in (None, self.SEGMENT_ID)
+        )
+
+    def get_non_token_columns(self):
+        """
+        Return a sorted tuple of all columns but the token column (i.e., the
+        columns with mostly repetitive values).
+        """
+        return tuple(col for col in range(self._width) if col != self._token)
+
     @property
     def global_enum(self):
         return self._global_enum
@@ -449,44 +547,41 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
         return self._pos_tag
 
     def get_attribute_target(self, att):
-        return self._attributes[att]
+        return self._targets[att]
 
     def get_event_targets(self, event):
         """ Return a 2-tuple of (trigger column, reference columns tuple). """
         return self._events[event]
 
     def get_normalization_target(self, norm):
-        return self._normalizations[norm]
+        return self._targets[norm]
 
     def get_reference_target(self, ref):
-        if ref in self._global_refs:
-            return self._global_refs[ref]
-        else:
-            return self._local_refs[ref]
+        return self._targets[ref]
 
     def get_relation_target(self, rel):
-        return self._relations[rel]
+        return self._targets[rel]
 
     def has_global_refs(self):
         return 0 != len(self._global_refs)
 
     def is_entity(self, col):
-        return col in self._entities
+        return self._types[col] == ColumnSpecification.ENTITY
 
     def is_pos_tag(self, col):
         return col == self.pos_tag
 
     def is_event(self, col):
-        return col in self._events
+        return self._types[col] == ColumnSpecification.EVENT
 
     def is_global_ref(self, col):
-        return col in self._global_refs
+        return self._types[col] == ColumnSpecification.GLOBAL_REF
 
     # def isLocalRef(self, col):
     #     return col in self._local_refs
 
     def is_relation(self, col):
-        return col in self._relations
+        return self._types[col] == ColumnSpecification.RELATION
 
     def iter_segment_ids(self):
         return iter(self._segment_ids)
@@ -507,31 +602,15 @@ class ColumnSpecification(metaclass=ColumnSpecificationMetaClass):
         return self._attributes.keys()
 
     def get_property_target_column_type(self, col):
-        if self.is_entity(col):
-            return ColumnSpecification.ENTITY
-        elif self.is_pos_tag(col):
-            return ColumnSpecification.POS_TAG
-        elif self.is_relation(col):
-            return ColumnSpecification.RELATION
-        elif self.is_event(col):
-            return ColumnSpecification.EVENT
+        coltype = self._types[col]
+
+        if coltype in ColumnSpecification._PROPERTY_TARGET_COLUMNS:
+            return coltype
         else:
             raise ValueError(
                 'column %d not a valid property target' % (col + 1)
             )
 
-    def set_global_enum(self, val):
-        self._set_column('global_enum', val)
-
-    def set_local_enum(self, val):
-        self._set_column('local_enum', val)
-
-    def set_token(self, val):
-        self._set_column('token', val)
-
-    def set_pos_tag(self, val):
-        self._set_column('pos_tag', val)
-
     def _set_column(self, name, val):
         attr = '_%s' % name
         old = getattr(self, attr)
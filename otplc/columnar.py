@@ -0,0 +1,427 @@
+"""
+A compact, binary, columnar cache of parsed OTPL files.
+
+A cache file is stored next to the OTPL file (e.g., ``corpus.lst.col``, see
+:attr:`otplc.settings.Configuration.CACHE_SUFFIX`) and holds all segments
+column by column:
+integer (enumeration and reference) columns are stored as typed arrays, and
+all other columns are *dictionary-encoded*: as an array of integer codes and
+the vocabulary of the distinct values.
+The :class:`ColumnarOtplReader` memory-maps the cache and yields the same
+segments as the text-mode reader, without having to parse the OTPL file.
+
+The cache records the size, modification time and checksum of the OTPL file
+and the colspec, separator and filter used to build it, so a stale cache is
+detected and rebuilt.
+The vocabularies are stored apart from these properties, so checking the
+cache does not have to parse them.
+"""
+import json
+import os
+import sys
+from array import array
+from hashlib import blake2b
+from itertools import islice
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+
+from otplc.colspec import ColumnSpecification as Spec
+from otplc.reader import OtplReader, Segment, guess_colspec
+from otplc.settings import Configuration
+from otplc.streams import detect_compression
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+L = getLogger('otplc.columnar')
+
+MAGIC = b'OTPLCOL2'
+# magic, file size, mtime (ns), checksum, meta length, vocabularies length
+HEADER = Struct('<8sQq16sII')
+ALIGNMENT = 8
+MAX_TABLE = 1 << 16
+"Integer columns up to this value are decoded with a lookup table."
+INTEGER_COLUMNS = frozenset((Spec.GLOBAL_ENUM, Spec.LOCAL_ENUM,
+                             Spec.GLOBAL_REF, Spec.LOCAL_REF))
+"The colspec types stored as integer arrays (if all values are integers)."
+
+_INTEGER, _DICTIONARY = 'q', 'I'  # the array type codes of the two kinds
+
+
+def cache_path_for(otpl_file):
+    """ Return the path of the columnar cache file for an `otpl_file`. """
+    return '%s%s' % (otpl_file, Configuration.CACHE_SUFFIX)
+
+
+def checksum(otpl_file):
+    """ Return the (16 byte) checksum of an `otpl_file`'s content. """
+    digest = blake2b(digest_size=16)
+
+    with open(otpl_file, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.digest()
+
+
+def load_or_build_cache(reader, colspec=None):
+    """
+    Return a :class:`ColumnarOtplReader` for the file of a (configured)
+    `reader`, building and storing its cache first if it is missing or
+    stale.
+
+    :param reader: an :class:`otplc.reader.OtplReader` with a defined
+                   separator (and, optionally, filter)
+    :param colspec: the colspec of the file (default: guessed)
+    :return: a :class:`ColumnarOtplReader` or the `reader` itself if the
+             input cannot be cached (streams and compressed files)
+    :raises IOError: if the OTPL file cannot be read
+    """
+    path = reader._file_path
+
+    if hasattr(path, 'read') or detect_compression(path):
+        L.warning('cannot cache "%s"', reader.path)
+        return reader
+
+    cache_file = cache_path_for(path)
+    cache = ColumnarOtplReader(path, cache_file, **reader._open_args)
+    cache.separator = reader.separator
+    cache.filter = reader.filter
+    cache.compact = reader.compact
+
+    if reader.columns is not None:
+        cache.columns = reader.columns
+
+    if not cache.is_valid(colspec):
+        ColumnarCache.build(reader, colspec).save(cache_file)
+
+    return cache
+
+
+class ColumnarCache(object):
+
+    """
+    The columns of all segments of an OTPL file, as built by :meth:`.build`
+    and stored by :meth:`.save`.
+    """
+
+    def __init__(self, bounds, columns, vocabularies, meta):
+        """
+        :param bounds: an ``array('Q')`` of the first row of each segment,
+                       followed by the total number of rows
+        :param columns: one array per column (of type code ``q`` for integer
+                        columns and ``I`` for dictionary-encoded columns)
+        :param vocabularies: one list of values per column (or ``None`` for
+                             integer columns)
+        :param meta: a dictionary of the source file's properties
+        """
+        self.bounds = bounds
+        self.columns = columns
+        self.vocabularies = vocabularies
+        self.meta = meta
+
+    @classmethod
+    def build(cls, reader, colspec=None):
+        """
+        Build the cache for the file of a (configured) `reader` in a single
+        pass over its segments, read with a new, unprojected reader like it
+        (so the `reader` itself is left as it is).
+
+        :raises DataFormatError: when the column numbers vary
+        :raises IOError: if the OTPL file cannot be read
+        """
+        path = reader.path
+        stat = os.stat(path)
+        reader = OtplReader.like(reader)
+        reader.columns = None  # the cache always holds all columns
+
+        if colspec is None:
+            colspec = guess_colspec(reader)
+
+        bounds, data, vocabularies = array('Q', [0]), [], []
+        codes = []  # the value-to-code mapping of each column
+
+        for segment in reader:
+            if not data:
+                for col in range(len(segment[0])):
+                    integer = colspec is not None and \
+                        colspec.get_type(col) in INTEGER_COLUMNS
+                    data.append(array(_INTEGER if integer else _DICTIONARY))
+                    vocabularies.append(None if integer else [])
+                    codes.append(None if integer else {})
+
+            for row in segment:
+                for col, value in enumerate(row):
+                    if codes[col] is None and not _append_int(data[col],
+                                                              value):
+                        codes[col], vocabularies[col], data[col] = \
+                            _dictionary_encode(data[col])
+
+                    if codes[col] is not None:
+                        code = codes[col].get(value)
+
+                        if code is None:
+                            code = codes[col][value] = len(codes[col])
+                            vocabularies[col].append(value)
+
+                        data[col].append(code)
+
+            bounds.append(bounds[-1] + len(segment))
+
+        meta = dict(size=stat.st_size, mtime=stat.st_mtime_ns,
+                    checksum=checksum(path),
+                    colspec=colspec.header if colspec is not None else None,
+                    separator=reader.separator, filter=reader.filter)
+        L.info('%d segments with %d rows in "%s"',
+               len(bounds) - 1, bounds[-1], reader.path)
+        return cls(bounds, data, vocabularies, meta)
+
+    def save(self, cache_file):
+        """
+        Write this cache to the `cache_file`, storing each column in the
+        smallest array type that holds its values.
+        """
+        ranges = [(min(data, default=0), max(data, default=0))
+                  for data in self.columns]
+        columns = [_narrow(data, *bounds)
+                   for data, bounds in zip(self.columns, ranges)]
+        arrays = [self.bounds] + columns
+        meta = dict(self.meta, checksum=None,
+                    types=[a.typecode for a in columns], ranges=ranges,
+                    lengths=[len(a) for a in arrays])
+        meta = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        vocabularies = json.dumps(self.vocabularies,
+                                  ensure_ascii=False).encode('utf-8')
+
+        with open(cache_file, 'wb') as stream:
+            stream.write(HEADER.pack(MAGIC, self.meta['size'],
+                                     self.meta['mtime'],
+                                     self.meta['checksum'], len(meta),
+                                     len(vocabularies)))
+            stream.write(meta)
+            stream.write(vocabularies)
+
+            for data in arrays:
+                stream.write(b'\0' * (-stream.tell() % ALIGNMENT))
+
+                if sys.byteorder != 'little':
+                    data = array(data.typecode, data)
+                    data.byteswap()
+
+                stream.write(data.tobytes())
+
+
+class ColumnarOtplReader(OtplReader):
+
+    """
+    A reader that yields the segments of an OTPL file from its memory-mapped
+    columnar cache (see :func:`load_or_build_cache`).
+
+    The separator and filter have to be the ones the cache was built with.
+    """
+
+    def __init__(self, file_path, cache_file=None, **open_args):
+        """
+        Create a new reader instance.
+
+        :param file_path: the OTPL file location
+        :param cache_file: the cache file location (default: see
+                           :func:`cache_path_for`)
+        :param open_args: `open` keyword arguments other than the defaults
+        """
+        super(ColumnarOtplReader, self).__init__(file_path, **open_args)
+        self._cache_file = cache_file or cache_path_for(file_path)
+
+    def __iter__(self):
+        """
+        Yield OTLP segments as lists of rows with equal number of columns.
+
+        :raises IOError: if the cache cannot be read
+        :raises ValueError: if the cache is corrupt
+        """
+        with open(self._cache_file, 'rb') as stream:
+            buffer = mmap(stream.fileno(), 0, access=ACCESS_READ)
+
+        with buffer:
+            meta, bounds, columns = _map(buffer)
+
+            try:
+                yield from self._yield_segments(meta, bounds, columns)
+            finally:
+                for view in [bounds] + columns:
+                    view.release()
+
+    def _yield_segments(self, meta, bounds, columns):
+        """
+        Yield the segments, decoding one segment at a time column by column
+        into a flat, row-major cell list.
+        """
+        make_segment = self._make_segment
+        width = len(columns)
+        keep = range(width) if self._columns is None else self._columns
+        decoders = [(col, _decoder(meta, col), columns[col]) for col in keep]
+
+        for segment in range(len(bounds) - 1):
+            start, end = bounds[segment], bounds[segment + 1]
+            size = (end - start) * width
+            cells = [None] * size
+
+            for col, decode, data in decoders:
+                cells[col::width] = map(decode, data[start:end])
+
+            if make_segment is Segment:
+                yield Segment.from_cells(width, tuple(cells))
+            else:
+                yield [cells[i:i + width] for i in range(0, size, width)]
+
+    def lookahead(self):
+        """ Yield the first few segments (from the cache). """
+        return islice(iter(self), self.LOOKAHEAD_SEGMENTS)
+
+    def is_valid(self, colspec=None):
+        """
+        Return ``True`` if the cache exists and is valid for the current state
+        of the OTPL file, this reader's separator and filter, and (if given)
+        the `colspec`.
+
+        If only the modification time of the OTPL file changed, but not its
+        checksum, the cache's modification time is updated, so the file need
+        not be hashed again.
+        """
+        try:
+            stat = os.stat(self._file_path)
+
+            with open(self._cache_file, 'rb') as stream:
+                head = stream.read(HEADER.size)
+                magic, size, mtime, digest, length, _ = HEADER.unpack(head)
+                meta = json.loads(stream.read(length).decode('utf-8'))
+        except (IOError, OSError):
+            return False
+        except (ValueError, UnicodeDecodeError) as e:  # struct.error, too
+            L.warning('corrupt cache "%s": %s', self._cache_file, str(e))
+            return False
+
+        if magic != MAGIC:
+            L.warning('corrupt cache "%s"', self._cache_file)
+            return False
+        elif meta['separator'] != self.separator or \
+                meta['filter'] != self.filter or \
+                (colspec is not None and meta['colspec'] != colspec.header):
+            L.info('cache "%s" built for other settings', self._cache_file)
+            return False
+        elif size != stat.st_size or (mtime != stat.st_mtime_ns and
+                                      digest != checksum(self._file_path)):
+            L.info('stale cache "%s"', self._cache_file)
+            return False
+        elif mtime != stat.st_mtime_ns:
+            self._touch(head, stat.st_mtime_ns)
+
+        return True
+
+    def _touch(self, head, mtime):
+        """ Store the new `mtime` of the unchanged OTPL file in the cache. """
+        fields = list(HEADER.unpack(head))
+        fields[2] = mtime
+
+        try:
+            with open(self._cache_file, 'r+b') as stream:
+                stream.write(HEADER.pack(*fields))
+        except (IOError, OSError) as e:
+            L.debug('cannot update cache "%s": %s', self._cache_file, str(e))
+
+
+def _decoder(meta, col):
+    """ Return the function decoding the stored values of a column. """
+    vocabulary = meta['vocabularies'][col]
+
+    if vocabulary is None:
+        low, high = meta['ranges'][col]
+
+        if low < 0 or high > MAX_TABLE:
+            return str
+
+        vocabulary = [str(number) for number in range(high + 1)]
+
+    return vocabulary.__getitem__
+
+
+def _narrow(data, low, high):
+    """ Return the `data` in the smallest integer array type for its range. """
+    signed = data.typecode == _INTEGER
+
+    for typecode in ('b', 'h', 'i', 'q') if signed else ('B', 'H', 'I'):
+        bits = array(typecode).itemsize * 8
+
+        if signed and -(1 << bits - 1) <= low and high < 1 << bits - 1 or \
+                not signed and high < 1 << bits:
+            return array(typecode, data)
+
+    return data
+
+
+def _append_int(data, value):
+    """
+    Append `value` to an integer array, returning ``False`` if it is not an
+    integer (that would be restored unchanged).
+    """
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return False
+
+    if str(number) != value:
+        return False
+
+    data.append(number)
+    return True
+
+
+def _dictionary_encode(integers):
+    """ Convert an integer array to the dictionary encoding. """
+    codes, vocabulary, data = {}, [], array(_DICTIONARY)
+
+    for value in map(str, integers):
+        if value not in codes:
+            codes[value] = len(vocabulary)
+            vocabulary.append(value)
+
+        data.append(codes[value])
+
+    return codes, vocabulary, data
+
+
+def _map(buffer):
+    """
+    Return the meta-data dictionary and the memory views of the segment
+    bounds and column arrays in a mapped cache `buffer`.
+
+    :raises ValueError: if the cache is corrupt
+    """
+    magic, size, mtime, digest, length, words = HEADER.unpack_from(buffer)
+
+    if magic != MAGIC:
+        raise ValueError('corrupt cache')
+
+    offset = HEADER.size + length
+    meta = json.loads(buffer[HEADER.size:offset].decode('utf-8'))
+    meta['vocabularies'] = json.loads(
+        buffer[offset:offset + words].decode('utf-8')
+    )
+    offset += words
+    views = []
+
+    for typecode, count in zip(['Q'] + meta['types'], meta['lengths']):
+        offset += -offset % ALIGNMENT
+        end = offset + array(typecode).itemsize * count
+        data = buffer[offset:end] if sys.byteorder != 'little' else None
+
+        if data is None:
+            views.append(memoryview(buffer)[offset:end].cast(typecode))
+        else:
+            data = array(typecode, data)
+            data.byteswap()
+            views.append(memoryview(data))
+
+        offset = end
+
+    return meta, views[0], views[1:]
@@ -2,20 +2,206 @@
 Transform a OTPL file to and from brat annotations.
 """
 import os
+from copy import copy
+from codecs import getincrementaldecoder
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from itertools import count
-from logging import getLogger
-from collections import defaultdict
+from logging import getLogger, DEBUG
+from collections import defaultdict, namedtuple, OrderedDict
 from re import compile
 from os.path import exists, splitext, dirname, join
 from otplc import brat
+from otplc.aligner import SlidingText, TextAligner
 from otplc.colspec import ColumnSpecification
-from otplc.reader import guess_colspec, configure_reader, DataFormatError
+from otplc.reader import guess_colspec, guess_colspec_with_confidence, \
+    configure_reader, DataFormatError
 from otplc.settings import Configuration
 
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
 L = getLogger('otplc.converter')
 A_VALID_NAME = compile(r'^[\w-]+$')
+LOW_CONFIDENCE = 0.5
+"Guessed columns with a lower confidence are reported."
+
+
+class Reference(namedtuple('Reference',
+                           'column target is_global target_type')):
+
+    """
+    A resolved reference column: the column it targets, its scope, and the
+    type of the target column.
+    """
+
+    __slots__ = ()
+
+
+class Operation(namedtuple('Operation',
+                           'kind column target target_type references')):
+
+    """
+    A single column operation of a :class:`ConversionPlan`: the column's
+    type (`kind`), its own `target` column (relations, normalizations, and
+    attributes; ``None`` for events) and that column's type, and its
+    resolved :class:`Reference` columns (the reference of a relation or the
+    trigger and arguments of an event).
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        # noinspection PyUnresolvedReferences
+        names = ColumnSpecification.INTEGERS
+        parts = ['%s column %d' % (names[self.kind], self.column + 1)]
+
+        if self.target is not None:
+            parts.append('on column %d' % (self.target + 1))
+
+        for ref in self.references:
+            parts.append('%s ref column %d -> %d' % (
+                'global' if ref.is_global else 'local',
+                ref.column + 1, ref.target + 1
+            ))
+
+        return ', '.join(parts)
+
+
+class PendingAnnotation(object):
+
+    """
+    A relation or event waiting for the brat IDs of the annotations its
+    global references point to.
+    """
+
+    __slots__ = ('_store', 'ids', 'missing')
+
+    def __init__(self, store, ids):
+        """
+        :param store: the function to call with the resolved IDs
+        :param ids: the (list of) IDs resolved so far
+        """
+        self._store = store
+        self.ids = ids
+        self.missing = {}  # (target column, number) -> [(ref, idx), ...]
+
+    def wait_for(self, ref, num, idx):
+        """ Wait for the ID at position `idx` that `ref` resolves `num` to. """
+        self.missing.setdefault((ref.target, num), []).append((ref, idx))
+
+    def resolve(self, key, uid):
+        """
+        Resolve the references to the (target column, number) `key` with
+        `uid`, returning ``True`` once no more references are missing.
+        """
+        for ref, idx in self.missing.pop(key):
+            self.ids[idx] = uid
+
+        return not self.missing
+
+    def store(self):
+        self._store(*self.ids)
+
+
+class ConversionPlan(object):
+
+    """
+    A :class:`otplc.colspec.ColumnSpecification` compiled into the flat,
+    ordered list of column :attr:`.operations` the converter runs for each
+    segment, with all target, reference, and trigger columns resolved, and
+    the names of the converter methods (:attr:`.makers`) that run them.
+
+    Plans are immutable; use :func:`compile_plan` to reuse them across
+    converters and files.
+    """
+
+    MAKERS = {
+        ColumnSpecification.RELATION: '_make_relation',
+        ColumnSpecification.EVENT: '_make_event',
+        ColumnSpecification.NORMALIZATION: '_make_normalization',
+        ColumnSpecification.ATTRIBUTE: '_make_attribute',
+    }
+    "The converter method names that make the annotations of each kind."
+
+    def __init__(self, colspec):
+        self.colspec = colspec
+        self.token = colspec.token
+        self.pos_tag = colspec.pos_tag
+        self.global_enum = colspec.global_enum
+        self.local_enum = colspec.local_enum
+        self.entities = tuple(sorted(colspec.iter_entities()))
+        operations = []
+
+        for col in colspec.iter_relations():
+            source = colspec.get_target(col)
+            operations.append(Operation(
+                ColumnSpecification.RELATION, col, source,
+                colspec.get_property_target_column_type(source),
+                (self._reference(colspec, col - 1),)
+            ))
+
+        for col in colspec.iter_events():
+            trigger, arguments = colspec.get_event_targets(col)
+            operations.append(Operation(
+                ColumnSpecification.EVENT, col, None, None,
+                tuple(self._reference(colspec, c)
+                      for c in (trigger,) + arguments)
+            ))
+
+        for kind, columns in (
+                (ColumnSpecification.NORMALIZATION,
+                 colspec.iter_normalizations()),
+                (ColumnSpecification.ATTRIBUTE, colspec.iter_attributes()),
+        ):
+            for col in columns:
+                target = colspec.get_target(col)
+                operations.append(Operation(
+                    kind, col, target,
+                    colspec.get_property_target_column_type(target), ()
+                ))
+
+        self.operations = tuple(operations)
+        self.makers = tuple(self.MAKERS[op.kind] for op in operations)
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __str__(self):
+        """ A description of the plan (one operation per line). """
+        lines = ['token column %d' % (self.token + 1)]
+
+        if self.pos_tag is not None:
+            lines.append('POS_TAG column %d' % (self.pos_tag + 1))
+
+        lines.extend('ENTITY column %d' % (col + 1) for col in self.entities)
+        lines.extend(str(op) for op in self.operations)
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _reference(colspec, col):
+        target = colspec.get_target(col)
+        return Reference(col, target, colspec.is_global_ref(col),
+                         colspec.get_property_target_column_type(target))
+
+
+class Schema(namedtuple('Schema', 'entities relations events attributes '
+                                  'normalizations')):
+
+    """
+    The brat annotation types collected by a :class:`OtplBratConverter`
+    (see :meth:`OtplBratConverter.get_schema`), in a picklable form.
+    """
+
+    __slots__ = ()
+
+
+@lru_cache(maxsize=32)
+def compile_plan(colspec):
+    """ Return the (cached) :class:`ConversionPlan` for a `colspec`. """
+    return ConversionPlan(colspec)
 
 
 class OtplBratConverter:
@@ -40,27 +226,34 @@ class OtplBratConverter:
 
     def __init__(self):
         self._colspec = None  # the column specification instance
-        self._annotation_file = None  # the output file handle
+        self._plan = None  # the colspec's compiled ConversionPlan
+        self._steps = ()  # the plan's (operation, bound maker) pairs
+        self._annotation_file = None  # the brat.AnnotationWriter for output
+        self.buffer_size = brat.AnnotationWriter.BUFFER_SIZE  # per write
         self._config_file = None  # the configuration file handle
-        self._text = None  # the str text string that is being annotated
+        self._text = None  # the SlidingText that is being annotated
+        self._aligner = None  # the TextAligner of the tokens to the text
         self._name_dict = {}  # a remapping of annotation names
 
         self._reset_states()  # states for OTPL parsing
 
         # capture a few names to write a rudimentary brat config file:
+        # (argument target column types are stored, rather than columns,
+        # so files with different colspecs can share one config file)
         self._entities = dict()  # {name: None}
-        self._relations = defaultdict(set)  # {name: {column}}
+        self._relations = defaultdict(lambda: (set(), set()))
+        # {name: ({arg1 type}, {arg2 type})}
         # only the argument position is used in the list of events;
         # the Boolean value indicates if the argument is required;
         # that is, if the argument (a reference in its column)
         # was observed for all events:
-        self._events = dict()  # will be: {name: [(column, bool)]}
+        self._events = dict()  # will be: {name: [(column, bool, {type})]}
         # only stored as reference
         # (normalizations have to be configured in tools.conf):
         self._normalizations = set()  # {namespace}
         # the default modifier added (if absent) is ``True``:
         self._attributes = defaultdict(lambda: (set(), set()))
-        # {name: ({modifier}, {column})}
+        # {name: ({modifier}, {target type})}
 
     def set_name_dict(self, name_dict):
         """
@@ -90,13 +283,31 @@ class OtplBratConverter:
         :type otpl_colspec: otplc.colspec.ColumnSpecification
         """
         self._colspec = otpl_colspec
+        self._plan = None if otpl_colspec is None else \
+            compile_plan(otpl_colspec)
+        self._steps = () if self._plan is None else tuple(
+            (op, getattr(self, name))
+            for op, name in zip(self._plan.operations, self._plan.makers)
+        )
+
+        if self._plan is not None and L.isEnabledFor(DEBUG):
+            L.debug('conversion plan:\n%s', self._plan)
+
+    @property
+    def plan(self):
+        """ The :class:`ConversionPlan` of the current colspec or ``None``. """
+        return self._plan
 
     def convert(self, segments, text_file, brat_file=None):
         """
         Read an input `OTPL file` and write a `brat file` for a given `text
         file`.
 
-        Note that the whole text file will be read into memory.
+        The text file is read through a :class:`otplc.aligner.SlidingText`,
+        holding only the text of the current segment (and the aligner's window
+        beyond it) in memory.
+        Tokens are aligned to the text by a :class:`otplc.aligner.TextAligner`
+        and must follow each other within its window.
 
         :param segments: a :class:`OtplReader` instance
         :param text_file: the path to the annotated (plain-) text file
@@ -112,21 +323,64 @@ class OtplBratConverter:
             brat_file = make_path_to(text_file, Configuration.BRAT_SUFFIX)
 
         L.info('"%s" to "%s" using "%s"', segments.path, brat_file, text_file)
-        self._text = open(text_file, encoding='utf-8').read()
         self._reset_states()
 
         # NB: processing order is significant to resolve references
         try:
-            if self._colspec.has_global_refs():
-                self._convert_with_globals(segments, brat_file)
-            else:
-                self._convert_local(segments, brat_file)
+            with open(text_file, encoding='utf-8') as stream:
+                self._text = SlidingText(stream)
+                self._aligner = TextAligner(self._text)
+
+                if self._colspec.has_global_refs():
+                    self._convert_with_globals(segments, brat_file)
+                else:
+                    self._convert_local(segments, brat_file)
         except (ValueError, DataFormatError) as e:
             L.warning('failed - %s', str(e))
             return False
+        finally:
+            self._text = self._aligner = None
 
         return True
 
+    def get_schema(self):
+        """ Return a copy of the annotation types collected so far. """
+        return Schema(
+            list(self._entities),
+            dict((name, (set(arg1), set(arg2)))
+                 for name, (arg1, arg2) in self._relations.items()),
+            dict((name, [(col, req, set(types)) for col, req, types in args])
+                 for name, args in self._events.items()),
+            dict((name, (set(mods), set(types)))
+                 for name, (mods, types) in self._attributes.items()),
+            set(self._normalizations)
+        )
+
+    def merge_schema(self, schema):
+        """
+        Add the annotation types of another converter's :class:`Schema`,
+        as if this converter had converted its files, too.
+        """
+        for name in schema.entities:
+            self._entities.setdefault(name, None)
+
+        for name, (arg1_types, arg2_types) in schema.relations.items():
+            known1, known2 = self._relations[name]
+            known1.update(arg1_types)
+            known2.update(arg2_types)
+
+        for name, arguments in schema.events.items():
+            self._store_event_arguments(name, [
+                (col, req, set(types)) for col, req, types in arguments
+            ])
+
+        for name, (mods, types) in schema.attributes.items():
+            known_mods, known_types = self._attributes[name]
+            known_mods.update(mods)
+            known_types.update(types)
+
+        self._normalizations.update(schema.normalizations)
+
     def write_config_file(self, file_path):
         """ Write the annotation.conf file in the given location. """
         with open(file_path, 'wb') as self._config_file:
@@ -160,57 +414,80 @@ class OtplBratConverter:
 
         # OTPL enum <-> brat ID mapping helpers
         self._global_map = None
+        self._pending = None  # annotations waiting for global references
+        self._resolved = []  # (global key, uid) pairs awaited by _pending
         self.__global_count = 0
         self.__line_count = 1
         self._local_map = dict()
 
     def _convert_local(self, segments, brat_file):
-        offset = 0
+        with open(brat_file, 'wb') as stream, brat.AnnotationWriter(
+                stream, self.buffer_size) as self._annotation_file:
+            self._convert_segments(segments, 0)
+
+    def _convert_segments(self, segments, offset):
+        """
+        Convert the `segments` annotating the text starting at `offset`,
+        returning the offset after the last segment.
+        """
+        for seg in segments:
+            unused, offset = self._convert_tokens_and_entities(seg, offset)
 
-        with open(brat_file, 'wt') as self._annotation_file:
-            for seg in segments:
-                unused, offset = self._convert_tokens_and_entities(seg, offset)
-                self._convert_annotations(seg)
-                self.__global_count += len(seg)
-                self.__line_count += len(seg) + 1
+            if self._resolved:
+                self._store_resolved()
+
+            self._convert_annotations(seg)
+
+            if self._resolved:
+                self._store_resolved()
+
+            self.__global_count += len(seg)
+            self.__line_count += len(seg) + 1
+
+        return offset
 
     def _convert_with_globals(self, segments, brat_file):
         """
-        If global references are present, they might point to entities in the
-        future (that is, after the end of the current segment), so this
-        approach iteratively creates the targets for the whole OTPL file by
-        reading it twice (once for entities, and once for the other types).
-        In other words, a OTPL file with global references is more expensive to
-        convert.
+        If global references are present, they might point to annotations in
+        the future (that is, after the end of the current segment), so this
+        approach registers the global IDs of all annotations while converting
+        the segments in a single pass, and defers writing any relation or
+        event until all its global references can be resolved.
+        In other words, memory is only needed for the global ID map and the
+        annotations still waiting for their references.
         """
         self._global_map = defaultdict(dict)
-        offset = 0
-        local_maps = []
-
-        with open(brat_file, 'wt+') as self._annotation_file:
-            for seg in segments:
-                lmap, offset = self._convert_tokens_and_entities(seg, offset)
-                local_maps.append(lmap)
-                self.__global_count += len(seg)
-                self.__line_count += len(seg) + 1
-
-            self.__global_count = 0
-            self.__line_count = 1
-            local_maps = reversed(local_maps)
-
-            for seg in segments:
-                self._local_map = next(local_maps)
-                self._convert_annotations(seg)
-                self.__global_count += len(seg)
-                self.__line_count += len(seg) + 1
+        self._pending = defaultdict(list)
+
+        with open(brat_file, 'wb') as stream, brat.AnnotationWriter(
+                stream, self.buffer_size) as self._annotation_file:
+            self._convert_segments(segments, 0)
+
+        if self._pending:
+            key, waiting = next(iter(self._pending.items()))
+            ref = waiting[0].missing[key][0][0]
+            raise ValueError(
+                '%d unresolved global reference%s, e.g., %d->%d with '
+                'number %s' % (
+                    len(self._pending), '' if len(self._pending) == 1 else 's',
+                    ref.column + 1, ref.target + 1, key[1]
+                )
+            )
 
     def _convert_tokens_and_entities(self, segment, start):
         """ Convert the `segment` annotating the text starting at `offset`. """
-        L.debug('global_count=%d line_count=%d',
-                self.__global_count, self.__line_count)
-        L.debug('text at offset=%s:\n%s...', start,
-                self._text[start:start + 75].replace('\n', ' ').strip())
-        L.debug('segment:\n%s', '\n'.join('\t'.join(row) for row in segment))
+        self._text.discard(start)
+
+        if L.isEnabledFor(DEBUG):
+            L.debug('global_count=%d line_count=%d',
+                    self.__global_count, self.__line_count)
+            L.debug('text at offset=%s:\n%s...', start,
+                    self._text[start:start + 75].replace('\n', ' ').strip())
+            L.debug('segment:\n%s', '\n'.join(
+                '\t'.join('' if v is None else v for v in row)
+                for row in segment
+            ))
+
         self._local_map = defaultdict(dict)
         offsets = list(self._yield_offsets(start, segment))
         assert len(offsets) == len(segment)
@@ -219,32 +496,24 @@ class OtplBratConverter:
         return self._local_map, offsets[-1][-1]
 
     def _convert_annotations(self, segment):
-        for columns, maker_method in [
-            (self._colspec.iter_relations(), self._make_relation),
-            (self._colspec.iter_events(), self._make_event),
-            (self._colspec.iter_normalizations(), self._make_normalization),
-            (self._colspec.iter_attributes(), self._make_attribute),
-        ]:
-            OtplBratConverter._process_columns_with(segment, columns,
-                                                    maker_method)
+        for op, make in self._steps:
+            col = op.column
+
+            for row_num, data in enumerate(segment, 1):
+                value = data[col]
+
+                if value and value != 'NULL':
+                    make(data, row_num, op)
 
     def _yield_offsets(self, start, segment):
-        c = self._colspec.token
+        c = self._plan.token
+        align = self._aligner.align
 
         for idx, row in enumerate(segment):
             token = row[c]
-            length = len(token)
-
-            try:
-                update = self._text.index(token, start)
+            offsets = align(token, start)
 
-                if update - start > 1000:
-                    L.warning('"%s" found %d chars after "%s..."',
-                              token, update - start,
-                              self._text[start:start + len(token) + 10])
-
-                start = update
-            except ValueError:
+            if offsets is None:
                 content = self._text[start:start + len(token) + 10].replace(
                     '\n', '\\n'
                 )
@@ -254,11 +523,11 @@ class OtplBratConverter:
                     )
                 )
 
-            yield (start, start + length)
-            start += length
+            yield offsets
+            start = offsets[1]
 
     def _process_pos(self, segment, offsets):
-        col = self._colspec.pos_tag
+        col = self._plan.pos_tag
 
         if col is not None:
             for idx, data in enumerate(segment):
@@ -268,19 +537,13 @@ class OtplBratConverter:
                     self._make_entity([data], idx + 1, col, *offsets[idx])
 
     def _process_entities(self, segment, offsets):
-        for col in self._colspec.iter_entities():
+        for col in self._plan.entities:
             rows, start = self._parse_bioe(segment, col, offsets)
 
             if rows:
                 self._make_entity(rows, len(segment) - len(rows),
                                   col, start, offsets[-1][-1])
 
-    @staticmethod
-    def _process_columns_with(segment, column_iter, make_annotation):
-        for col in column_iter:
-            for row, data in enumerate(segment, 1):
-                make_annotation(data, row, col)
-
     def _parse_bioe(self, segment, col, offsets):
         start, data_rows = 0, []
         row_num = lambda: idx + 1 - len(data_rows)
@@ -321,7 +584,7 @@ class OtplBratConverter:
         return data_rows, start
 
     def _make_entity(self, rows, row_num, col, start, end):
-        pos_col = self._colspec.pos_tag
+        pos_col = self._plan.pos_tag
         off = 0 if col == pos_col else 2
 
         try:
@@ -348,37 +611,39 @@ class OtplBratConverter:
         self._store_annotation(brat.Entity(uid, name, start, end,
                                            self._text[start:end]))
 
-    def _make_normalization(self, data, row_num, col):
-        ns_id = data[col]
+    # The _make_* methods are only called for non-empty, non-NULL values
+    # of their operation's column (see _convert_annotations).
 
-        if ns_id and ns_id != 'NULL':
-            target_col = self._colspec.get_normalization_target(col)
-            target_id = self._get_local_target_id(target_col, data, row_num)
-            uid = self._register(col, 'N', self._normalization_counter,
-                                 row_num, data)
-            string = ns_id
+    def _make_normalization(self, data, row_num, op):
+        col = op.column
+        ns_id = data[col]
+        target_id = self._get_local_target_id(op.target, data, row_num)
+        uid = self._register(col, 'N', self._normalization_counter,
+                             row_num, data)
+        string = ns_id
 
-            if ' ' in ns_id:
-                ns_id, string = ns_id.split(' ', 1)
+        if ' ' in ns_id:
+            ns_id, string = ns_id.split(' ', 1)
 
-            db, xref = ns_id.split(':', 1)
+        db, xref = ns_id.split(':', 1)
 
-            try:
-                self._validate_name(db)
-            except DataFormatError:
-                L.error('brat cannot cope with DB name "%s" in column %d',
-                        db, col + 1)
-                return
+        try:
+            self._validate_name(db)
+        except DataFormatError:
+            L.error('brat cannot cope with DB name "%s" in column %d',
+                    db, col + 1)
+            return
 
-            self._normalizations.add(db)  # DB namespace only
-            self._store_annotation(brat.Normalization(uid, target_id, db,
-                                                      xref, string))
+        self._normalizations.add(db)  # DB namespace only
+        self._store_annotation(brat.Normalization(uid, target_id, db,
+                                                  xref, string))
 
-    def _make_relation(self, data, row_num, col):
+    def _make_relation(self, data, row_num, op):
+        col = op.column
         name = data[col]
-        ref_col = col - 1
+        ref = op.references[0]
 
-        if data[ref_col] and name and data[ref_col] != '0' and name != 'NULL':
+        if data[ref.column] and data[ref.column] != '0':
             try:
                 name = self._validate_name(name)
             except DataFormatError:
@@ -390,19 +655,20 @@ class OtplBratConverter:
 
             uid = self._register(col, 'R', self._relation_counter, row_num,
                                  data)
-            source_col = self._colspec.get_relation_target(col)
-            source_id = self._get_local_target_id(source_col, data, row_num)
-            target_id = self._get_referenced_id(data, ref_col)
-            self._relations[name].add(col)
-            self._store_annotation(brat.Relation(uid, name,
-                                                 source_id, target_id))
-
-    def _make_event(self, data, row_num, col):
+            source_id = self._get_local_target_id(op.target, data, row_num)
+            arg1_types, arg2_types = self._relations[name]
+            arg1_types.add(op.target_type)
+            arg2_types.add(ref.target_type)
+            self._defer(data, (ref,), lambda target_id: self._store_annotation(
+                brat.Relation(uid, name, source_id, target_id)
+            ))
+
+    def _make_event(self, data, row_num, op):
+        col = op.column
         name = data[col]
-        trigger_col, ref_cols = self._colspec.get_event_targets(col)
+        trigger = op.references[0]
 
-        if name and name != 'NULL' and \
-                data[trigger_col] and data[trigger_col] != '0':
+        if data[trigger.column] and data[trigger.column] != '0':
             try:
                 name = self._validate_name(name)
             except DataFormatError:
@@ -410,66 +676,98 @@ class OtplBratConverter:
                         name, col + 1)
                 return
 
+            arguments = op.references[1:]
             uid = self._register(col, 'E', self._event_counter, row_num, data)
-            trigger_id = self._get_referenced_id(data, trigger_col)
-            ref_ids = [(None if data[c] == '0' else
-                        self._get_referenced_id(data, c)) for c in ref_cols]
-            references = dict(('Arg%d' % num, rid)
-                              for num, rid in enumerate(ref_ids, 1)
-                              if rid is not None)
-            self._store_event_arguments(
-                name, list(zip(ref_cols, [i is not None for i in ref_ids]))
-            )
-            self._store_annotation(brat.Event(uid, name, trigger_id,
-                                              **references))
+            self._store_event_arguments(name, [
+                (ref.column, data[ref.column] != '0', {ref.target_type})
+                for ref in arguments
+            ])
+
+            def store(trigger_id, *ref_ids):
+                references = dict(('Arg%d' % num, rid)
+                                  for num, rid in enumerate(ref_ids, 1)
+                                  if rid is not None)
+                self._store_annotation(brat.Event(uid, name, trigger_id,
+                                                  **references))
 
-    def _store_event_arguments(self, name, col_req_pairs):
+            self._defer(data, op.references, store)
+
+    def _store_event_arguments(self, name, arguments):
         if name in self._events:
-            existing_pairs = self._events[name]
-            is_required = 1  # the second element in the pair; for readability
+            existing = self._events[name]
 
-            for idx, new_pair in enumerate(col_req_pairs):
-                if not new_pair[is_required] and \
-                        existing_pairs[idx][is_required]:
-                    existing_pairs[idx] = (new_pair[0], False)
+            for idx, (col, required, types) in enumerate(arguments):
+                old_col, old_required, old_types = existing[idx]
+                existing[idx] = (old_col, old_required and required,
+                                 old_types | types)
         else:
-            self._events[name] = col_req_pairs
+            self._events[name] = arguments
 
-    def _make_attribute(self, data, row_num, col):
+    def _make_attribute(self, data, row_num, op):
+        col = op.column
         name = data[col]
 
-        if name and name != 'NULL':
-            try:
-                name = self._validate_name(name)
-            except DataFormatError:
-                L.error(
-                    'brat cannot cope with attribute name "%s" in column %d',
-                    name, col + 1
-                )
-                return
+        try:
+            name = self._validate_name(name)
+        except DataFormatError:
+            L.error(
+                'brat cannot cope with attribute name "%s" in column %d',
+                name, col + 1
+            )
+            return
 
-            uid = 'A', + next(self._attribute_counter)
-            target_col = self._colspec.get_attribute_target(col)
-            target = self._get_local_target_id(target_col, data, row_num)
-            modifier = ''
+        uid = 'A%d' % next(self._attribute_counter)
+        target = self._get_local_target_id(op.target, data, row_num)
+        modifier = ''
 
-            if ' ' in name:
-                idx = name.index(' ')
-                name, modifier = name[:idx], name[idx:]
+        if ' ' in name:
+            idx = name.index(' ')
+            name, modifier = name[:idx], name[idx:]
 
-            mods, cols = self._attributes[name]
-            mods.add(modifier.rstrip(' ') if modifier else True)
-            cols.add(col)
-            self._store_annotation(brat.Attribute(uid, name, target, modifier))
+        mods, types = self._attributes[name]
+        mods.add(modifier.rstrip(' ') if modifier else True)
+        types.add(op.target_type)
+        self._store_annotation(brat.Attribute(uid, name, target, modifier))
 
     def _store_annotation(self, ann):
-        self._annotation_file.write(str(ann))
-        self._annotation_file.write(os.linesep)
+        self._annotation_file.write(ann)
+
+    def _defer(self, data, refs, store):
+        """
+        Call `store` with the brat IDs the `refs` in a row of `data` point to
+        (``None`` for references to "0") as soon as all of them are known.
+
+        Unknown global references are queued as pending until the referenced
+        annotation is registered (see :meth:`_convert_with_globals`).
+        """
+        ids = []
+        pending = None
+
+        for idx, ref in enumerate(refs):
+            num = data[ref.column]
+
+            if num == '0':
+                ids.append(None)
+            elif ref.is_global and self._pending is not None and \
+                    num not in self._global_map[ref.target]:
+                if pending is None:
+                    pending = PendingAnnotation(store, ids)
+
+                pending.wait_for(ref, num, idx)
+                ids.append(None)
+            else:
+                ids.append(self._get_referenced_id(data, ref))
+
+        if pending is None:
+            store(*ids)
+        else:
+            for key in pending.missing:
+                self._pending[key].append(pending)
 
     def _register(self, col, letter, counter, num, *data_items):
         uid = letter + str(next(counter))  # the uid for this brat annotation
-        global_enum = self._colspec.global_enum
-        local_enum = self._colspec.local_enum
+        global_enum = self._plan.global_enum
+        local_enum = self._plan.local_enum
         base_num = self.__global_count + num
 
         # register the uid to each data row
@@ -479,28 +777,39 @@ class OtplBratConverter:
                     data[global_enum]
                 self._global_map[col].setdefault(global_id, uid)
 
+                if self._pending and (col, global_id) in self._pending:
+                    self._resolved.append(((col, global_id), uid))
+
             local_id = str(num + idx) if local_enum is None else \
                 data[local_enum]
             self._local_map[col].setdefault(local_id, uid)
 
         return uid
 
-    def _get_referenced_id(self, data, ref_col):
-        target_col = self._colspec.get_reference_target(ref_col)
+    def _store_resolved(self):
+        """ Store the pending annotations whose references were registered. """
+        for key, uid in self._resolved:
+            for pending in self._pending.pop(key, ()):
+                if pending.resolve(key, uid):
+                    pending.store()
+
+        self._resolved = []
 
+    def _get_referenced_id(self, data, ref):
+        """ Resolve the brat ID a :class:`Reference` in a row points to. """
         try:
-            if self._colspec.is_global_ref(ref_col):
-                return self._get_global_id(target_col, data[ref_col])
+            if ref.is_global:
+                return self._get_global_id(ref.target, data[ref.column])
             else:
-                return self._ge_local_id(target_col, data[ref_col])
+                return self._ge_local_id(ref.target, data[ref.column])
         except RuntimeError:
             raise ValueError('unresolved reference %d->%d with number %s' % (
-                ref_col + 1, target_col + 1, data[ref_col]
+                ref.column + 1, ref.target + 1, data[ref.column]
             ))
 
     def _get_local_target_id(self, target_col, data, row_num):
-        row = str(row_num) if self._colspec.local_enum is None else \
-            data[self._colspec.local_enum]
+        local_enum = self._plan.local_enum
+        row = str(row_num) if local_enum is None else data[local_enum]
 
         try:
             return self._ge_local_id(target_col, row)
@@ -537,34 +846,29 @@ class OtplBratConverter:
         """ Write the entity name, None pair to the configuration file. """
         self._store_configuration('%s\n' % name)
 
-    def _write_relation_type(self, name, columns):
+    def _write_relation_type(self, name, types):
         """
-        Write the relation name, columns pair to the configuration file.
+        Write the relation name, argument types pair to the configuration
+        file.
         """
         self._store_configuration('%s\t' % name)
-
-        target1 = self._elicit_shortcut_for(
-            columns, self._colspec.get_relation_target
-        )
-        target2 = self._elicit_shortcut_for(
-            columns, lambda c: self._colspec.get_reference_target(c - 1)
-        )
+        target1 = self._elicit_shortcut_for(types[0])
+        target2 = self._elicit_shortcut_for(types[1])
         self._store_configuration('Arg1:%s, Arg2:%s\n' % (target1, target2))
 
-    def _write_event_type(self, name, pairs):
-        """ Write the event name, pairs pair to the configuration file. """
+    def _write_event_type(self, name, arguments):
+        """
+        Write the event name, arguments pair to the configuration file.
+        """
         self._store_configuration('%s\t' % name)
-        arguments = []
+        shortcuts = []
 
-        for col, req in pairs:
-            shortcut = self._elicit_shortcut_for(
-                [col], self._colspec.get_reference_target
-            )
-            arguments.append('Col%d%s:%s' % (
-                col + 1, '' if req else '?', shortcut
+        for col, req, types in arguments:
+            shortcuts.append('Col%d%s:%s' % (
+                col + 1, '' if req else '?', self._elicit_shortcut_for(types)
             ))
 
-        self._store_configuration(', '.join(arguments))
+        self._store_configuration(', '.join(shortcuts))
         self._store_configuration('\n')
 
     def _write_attribute_type(self, name, values):
@@ -573,9 +877,7 @@ class OtplBratConverter:
         """
         modifiers = '' if len(values[0]) == 1 else \
             ', Value:%s' % '|'.join(values[0])
-        shortcut = self._elicit_shortcut_for(
-            values[1], self._colspec.get_attribute_target
-        )
+        shortcut = self._elicit_shortcut_for(values[1])
         self._store_configuration(
             '%s\tArg:%s%s\n' % (name, shortcut, modifiers)
         )
@@ -596,20 +898,16 @@ class OtplBratConverter:
     def _store_configuration(self, string):
         self._config_file.write(string.encode('utf-8'))
 
-    def _elicit_shortcut_for(self, cols, get_target_column):
-        """ Establish the best shortcut name for the configuration file. """
-        coltype = None
-
-        for c in cols:
-            update = self._colspec.get_property_target_column_type(
-                get_target_column(c)
-            )
-
-            if coltype is None:
-                coltype = update
-            elif coltype != update:
-                coltype = ColumnSpecification._ANNOTATION
-                break
+    @staticmethod
+    def _elicit_shortcut_for(types):
+        """
+        Establish the best shortcut name for the configuration file from the
+        set of target column types observed.
+        """
+        if len(types) == 1:
+            coltype, = types
+        else:
+            coltype = ColumnSpecification._ANNOTATION
 
         if coltype == ColumnSpecification._ANNOTATION:
             return '<ANY>'
@@ -621,7 +919,7 @@ class OtplBratConverter:
             return '<EVENT>'
         else:
             raise ValueError(
-                'illegal shortcut %s for %s' % (str(coltype), str(cols))
+                'illegal shortcut %s for %s' % (str(coltype), str(types))
             )
 
     def _validate_name(self, name):
@@ -634,43 +932,161 @@ class OtplBratConverter:
         return name
 
 
-def otpl_to_brat(configuration):
+class IncrementalConverter(OtplBratConverter):
+
     """
-    For a list of `text_files` (paths), read the associated OTPL files and
-    write the converted brat files.
+    A converter for OTPL files that grow over time (see
+    :meth:`otplc.reader.OtplReader.follow`): each call to :meth:`.append`
+    converts only the new segments and appends their annotations to the brat
+    file, continuing the brat IDs and text offsets of the earlier calls.
+
+    The text file may grow, too; only its new content is read.
+    Global references are not supported, as they might point to segments
+    that have not been written yet.
+    If a call fails, the converter should be :meth:`.reset` (and the brat
+    file re-created).
+    """
+
+    def __init__(self):
+        super(IncrementalConverter, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """ Start over, with the next :meth:`.append` re-creating the file. """
+        self._reset_states()
+        self._text = SlidingText()
+        self._aligner = TextAligner(self._text)
+        self._text_size = 0  # the number of bytes read from the text file
+        self._decoder = getincrementaldecoder('utf-8')()
+        self._offset = 0  # the text offset after the last converted segment
+        self._started = False
+
+    def append(self, segments, text_file, brat_file=None):
+        """
+        Convert the new `segments` and append their annotations to the `brat
+        file`.
+
+        :param segments: an iterable of the new segments
+        :param text_file: the path to the annotated (plain-) text file
+        :param brat_file: the path to the brat file (by default determined by
+                          suffix replacement)
+        :return: True if successful, False otherwise
+        """
+        if self._colspec is None:
+            L.warning('cannot run without a colspec - specify one manually')
+            return False
+        elif self._colspec.has_global_refs():
+            L.warning('cannot convert global references incrementally')
+            return False
+
+        if brat_file is None:
+            brat_file = make_path_to(text_file, Configuration.BRAT_SUFFIX)
+
+        self._read_new_text(text_file)
+
+        try:
+            with open(brat_file, 'ab' if self._started else 'wb') as stream, \
+                    brat.AnnotationWriter(stream, self.buffer_size) as \
+                    self._annotation_file:
+                self._started = True
+                self._offset = self._convert_segments(segments, self._offset)
+        except (ValueError, DataFormatError) as e:
+            L.warning('failed - %s', str(e))
+            return False
+
+        return True
+
+    def _read_new_text(self, text_file):
+        """ Append the text added to the `text_file` since the last call. """
+        with open(text_file, 'rb') as stream:
+            stream.seek(self._text_size)
+            data = stream.read()
+
+        self._text_size += len(data)
+        self._text.feed(self._decoder.decode(data))
+
+
+def follow_to_brat(text_file, configuration, interval=1.0, timeout=None):
+    """
+    Follow the (growing) OTPL file for a `text_file`, appending the brat
+    annotations of each new segment to its brat file as soon as the segment
+    is complete (see :meth:`otplc.reader.OtplReader.follow`).
 
     :type configuration: Configuration
-    :return: the error count (number of failed conversions)
+    :param interval: the seconds to wait before polling for new segments
+    :param timeout: stop after this many seconds without new segments
+    :return: True if successful, False otherwise
     """
-    converter = OtplBratConverter()
-    converter.set_colspec(configuration.colspec)
-    errors = 0
+    otpl_file = make_path_to(text_file, configuration.otpl_suffix)
+    brat_file = make_path_to(text_file, configuration.brat_suffix)
+    segments = configure_reader(otpl_file, configuration)
+
+    if segments is None:
+        return False
+
+    converter = IncrementalConverter()
+    converter.set_colspec(configuration.colspec or guess_colspec(segments))
 
     if configuration.name_labels is not None:
         converter.set_name_dict(configuration.name_labels)
 
-    for text_file in configuration.input_files:
-        otpl_file = make_path_to(text_file, configuration.otpl_suffix)
-        brat_file = make_path_to(text_file, configuration.brat_suffix)
+    for segment in segments.follow(interval, timeout):
+        if not converter.append([segment], text_file, brat_file):
+            L.error('conversion of "%s" failed at line %d',
+                    otpl_file, segments.position[1])
+            return False
 
-        if exists(otpl_file):
-            segments = configure_reader(otpl_file, configuration)
+    return True
 
-            if segments is None:
+
+def otpl_to_brat(configuration):
+    """
+    For a list of `text_files` (paths), read the associated OTPL files and
+    write the converted brat files.
+
+    The colspec of each file is resolved as by :func:`plan_conversion`, so
+    a single run can cover a heterogeneous corpus.
+    Converting serially, each file is converted right after planning it,
+    with the same reader, so each OTPL file is only opened once.
+    If :attr:`Configuration.jobs` is not 1, the colspecs of all files are
+    resolved first and the files are converted in a pool of worker processes
+    (0: one per CPU), and the annotation types each worker found are merged
+    in input order (see :meth:`OtplBratConverter.merge_schema`) before the
+    brat config file is written.
+
+    :type configuration: Configuration
+    :return: the error count (number of failed conversions)
+    """
+    converter = _make_converter(configuration)
+    jobs = configuration.jobs or os.cpu_count() or 1
+    files, errors = _locate_otpl_files(configuration)
+
+    if jobs == 1 or len(files) < 2:
+        if configuration.colspec is None:
+            planned = _plan_files(files, configuration)
+        else:
+            planned = ((text_file, configuration.colspec, None)
+                       for text_file in files)
+
+        for text_file, colspec, segments in planned:
+            if colspec is None:
                 errors += 1
                 continue
 
-            if configuration.colspec is None:
-                configuration.colspec = guess_colspec(segments)
-                converter.set_colspec(configuration.colspec)
+            if converter.plan is None or converter.plan.colspec != colspec:
+                converter.set_colspec(colspec)
 
-            if not converter.convert(segments, text_file, brat_file):
-                L.error('conversion for "%s" failed', text_file)
+            if not _convert_file(converter, colspec, text_file,
+                                 configuration, segments):
                 errors += 1
-        else:
-            L.error('could not locate OTPL file "%s" for "%s"',
-                    otpl_file, text_file)
-            errors += 1
+    else:
+        groups, failed = _group_files(files, configuration)
+        errors += failed
+        colspecs = {text_file: colspec for colspec, text_files in groups
+                    for text_file in text_files}
+        tasks = [(colspecs[text_file], text_file) for text_file in files
+                 if text_file in colspecs]
+        errors += _convert_in_parallel(converter, tasks, configuration, jobs)
 
     if not errors:
         brat_config_file = join(dirname(configuration.input_files[-1]),
@@ -686,6 +1102,249 @@ def otpl_to_brat(configuration):
     return errors
 
 
+def _make_converter(configuration):
+    converter = OtplBratConverter()
+
+    if configuration.name_labels is not None:
+        converter.set_name_dict(configuration.name_labels)
+
+    return converter
+
+
+def _convert_file(converter, colspec, text_file, configuration,
+                  segments=None):
+    """
+    Convert the OTPL file for a `text_file` with a `converter` configured
+    for its `colspec`, returning ``True`` if successful.
+
+    :param segments: the reader configured for the OTPL file while planning
+                     (default: configure a new one)
+    """
+    otpl_file = make_path_to(text_file, configuration.otpl_suffix)
+    brat_file = make_path_to(text_file, configuration.brat_suffix)
+
+    if segments is None:
+        segments = configure_reader(otpl_file, configuration)
+
+    if segments is None:
+        return False
+
+    if configuration.columns is None:
+        _project_used_columns(segments, colspec)
+    elif segments.columns is None:
+        segments.columns = configuration.columns
+
+    if configuration.intern and segments.interned is None:
+        segments.interned = colspec.get_non_token_columns()
+
+    if not converter.convert(segments, text_file, brat_file):
+        L.error('conversion for "%s" failed', text_file)
+        return False
+
+    return True
+
+
+def _convert_in_parallel(converter, tasks, configuration, jobs):
+    """
+    Convert the ``(colspec, text file)`` `tasks` in a pool of `jobs` worker
+    processes, merging the schema of each file into the `converter` in task
+    order (so with the tasks in input order, the brat config file is the
+    same as for a serial run).
+
+    :return: the number of failed conversions
+    """
+    chunk_size = max(1, min(64, len(tasks) // (4 * jobs)))
+    colspecs, text_files = zip(*tasks)
+    errors = 0
+    # the workers need neither the input files, nor a copy with each task
+    settings = copy(configuration)
+    settings.input_files = None
+
+    with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                             initargs=(settings,)) as pool:
+        for success, schema in pool.map(_convert_in_worker, colspecs,
+                                        text_files, chunksize=chunk_size):
+            converter.merge_schema(schema)
+
+            if not success:
+                errors += 1
+
+    return errors
+
+
+_worker_configuration = None
+"The configuration of a worker process (see :func:`_init_worker`)."
+
+
+def _init_worker(configuration):
+    """ Set the configuration of a worker process once. """
+    global _worker_configuration
+    _worker_configuration = configuration
+
+
+def _convert_in_worker(colspec, text_file):
+    """ Convert a single file, returning its success and :class:`Schema`. """
+    configuration = _worker_configuration
+    converter = _make_converter(configuration)
+    converter.set_colspec(colspec)
+    success = _convert_file(converter, colspec, text_file, configuration)
+    return success, converter.get_schema()
+
+
+def plan_conversion(configuration):
+    """
+    Resolve the colspec of each input file and group the files by it.
+
+    If the configuration defines a colspec, all files form one group.
+    Otherwise, the colspec of each file is taken from its header or guessed
+    (see :func:`_guess_colspec`), reusing the guesses made for files with
+    the same layout (see :class:`otplc.layouts.LayoutCache`; persistently,
+    if :attr:`Configuration.guess_cache` is set).
+    Only the lookahead of each file is read.
+
+    :type configuration: Configuration
+    :return: a ``(groups, errors)`` tuple, where the groups are a list of
+             ``(colspec, [text file])`` pairs, in order of their first file,
+             and the errors are the number of files that could not be
+             planned
+    """
+    files, errors = _locate_otpl_files(configuration)
+    groups, failed = _group_files(files, configuration)
+    return groups, errors + failed
+
+
+def _group_files(files, configuration):
+    """
+    Group the (located) `files` by their colspec, returning the groups and
+    the number of files that could not be planned (see
+    :func:`plan_conversion`).
+    """
+    errors = 0
+
+    if configuration.colspec is not None:
+        return ([(configuration.colspec, files)] if files else []), errors
+
+    groups = OrderedDict()  # {colspec: [text file]}
+
+    for text_file, colspec, _ in _plan_files(files, configuration):
+        if colspec is None:
+            errors += 1
+        else:
+            groups.setdefault(colspec, []).append(text_file)
+
+    for num, (colspec, text_files) in enumerate(groups.items(), 1):
+        L.info('group %d: %d file%s with colspec "%s"', num, len(text_files),
+               '' if len(text_files) == 1 else 's', colspec.header)
+
+    return list(groups.items()), errors
+
+
+def _locate_otpl_files(configuration):
+    """
+    Return the input (text) files that have an OTPL file and the number of
+    those that do not.
+    """
+    files = []
+    errors = 0
+
+    for text_file in configuration.input_files:
+        otpl_file = make_path_to(text_file, configuration.otpl_suffix)
+
+        if exists(otpl_file):
+            files.append(text_file)
+        else:
+            L.error('could not locate OTPL file "%s" for "%s"',
+                    otpl_file, text_file)
+            errors += 1
+
+    return files, errors
+
+
+def _plan_files(files, configuration):
+    """
+    Yield a ``(text file, colspec, reader)`` tuple for each of the `files`,
+    having read no more than the lookahead of the reader (unless sampling
+    the colspec guess), so it can go on to convert the file.
+    The colspec (and the reader) are ``None`` if the file could not be
+    planned.
+    Once all files are planned, the colspec guesses are stored.
+    """
+    from otplc.layouts import LayoutCache  # circular import
+
+    layouts = LayoutCache(configuration.guess_cache)
+
+    for text_file in files:
+        otpl_file = make_path_to(text_file, configuration.otpl_suffix)
+        segments = configure_reader(otpl_file, configuration)
+        colspec = None
+
+        if segments is not None:
+            colspec = _cached_colspec(segments, layouts, configuration)
+
+        yield text_file, colspec, segments
+
+    L.info('colspec guesses: %d reused, %d made', layouts.hits, layouts.misses)
+
+    try:
+        layouts.save()
+    except IOError as e:
+        L.error('could not store the colspec cache: %s', e)
+
+
+def _guess_colspec(segments, configuration):
+    """
+    Guess the colspec from the reader's lookahead or, if configured, from a
+    sample of the whole file, warning about columns guessed with a low
+    confidence.
+    """
+    if not configuration.guess_sample:
+        return guess_colspec(segments)
+
+    colspec, confidences = guess_colspec_with_confidence(
+        segments, configuration.guess_sample
+    )
+
+    for col, confidence in enumerate(confidences):
+        if confidence < LOW_CONFIDENCE:
+            # noinspection PyUnresolvedReferences
+            name = ColumnSpecification.INTEGERS[colspec.get_type(col)]
+            L.warning('column %d guessed as %s with a low confidence (%.2f)',
+                      col + 1, name, confidence)
+
+    return colspec
+
+
+def _cached_colspec(segments, layouts, configuration):
+    """
+    Look up the colspec for the reader's file in the `layouts` cache,
+    guessing (and caching) it for unknown or mismatched layouts.
+
+    :return: the colspec or ``None`` if it could not be determined
+    """
+    try:
+        colspec = layouts.colspec_for(
+            segments, lambda reader: _guess_colspec(reader, configuration)
+        )
+    except DataFormatError as e:
+        L.error('%s', e)
+        return None
+
+    if colspec is None:
+        L.error('no colspec for "%s" - specify one manually', segments.path)
+
+    return colspec
+
+
+def _project_used_columns(segments, colspec):
+    """
+    Make the reader skip the SEGMENT_ID and unknown columns (if any).
+    """
+    used = colspec.get_used_columns()
+
+    if len(used) < colspec.width:
+        segments.columns = used
+
+
 def make_path_to(text_file, suffix):
     """Replace the `text_file` suffix with `suffix."""
     base, ext = splitext(text_file)
@@ -90,6 +90,11 @@ def otpl_to_text(configuration):
 
         token = configuration.colspec.token
 
+        if configuration.columns is None:
+            segments.columns = (token,)
+        elif segments.columns is None:
+            segments.columns = configuration.columns
+
         try:
             with open(text_file,
                       encoding=configuration.encoding,
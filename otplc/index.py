@@ -0,0 +1,203 @@
+"""
+A persistent index of segment offsets for random access into OTPL files.
+
+The index is stored as a small binary *sidecar* file next to the OTPL file
+(e.g., ``corpus.lst.idx``, see :attr:`otplc.settings.Configuration.INDEX_SUFFIX`)
+and holds the byte offset and line number of the first row of every segment.
+It records the size and modification time of the OTPL file and the filter
+regex and character encoding used to build it, so a stale index is detected
+and rebuilt.
+"""
+import os
+import sys
+from array import array
+from codecs import lookup
+from logging import getLogger
+from re import compile
+from struct import Struct
+
+from otplc.settings import Configuration
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+L = getLogger('otplc.index')
+
+MAGIC = b'OTPLIDX2'
+# magic, file size, mtime (ns), segments, filter length, encoding length:
+HEADER = Struct('<8sQqQII')
+
+
+def index_path_for(otpl_file):
+    """ Return the path of the index sidecar file for an `otpl_file`. """
+    return '%s%s' % (otpl_file, Configuration.INDEX_SUFFIX)
+
+
+def load_or_build_index(otpl_file, filter_regex=None,
+                        encoding=Configuration.ENCODING):
+    """
+    Load the sidecar index of an `otpl_file` or, if it is missing or stale,
+    build and store a new one.
+
+    :param otpl_file: the path of the OTPL file
+    :param filter_regex: the reader's filter regex (a string) or ``None``
+    :param encoding: the OTPL file's character encoding
+    :return: a :class:`SegmentIndex` instance
+    :raises IOError: if the OTPL file cannot be read
+    """
+    index_file = index_path_for(otpl_file)
+    index = SegmentIndex.load(index_file, otpl_file, filter_regex, encoding)
+
+    if index is None:
+        index = SegmentIndex.build(otpl_file, filter_regex, encoding)
+
+        try:
+            index.save(index_file)
+        except IOError as e:
+            L.warning('could not store "%s": %s', index_file, str(e))
+
+    return index
+
+
+class SegmentIndex(object):
+
+    """
+    The byte offsets and (one-based) line numbers of the first row of each
+    segment in an OTPL file.
+
+    Indexing an instance with a segment number returns that segment's
+    ``(offset, line number)`` pair.
+    """
+
+    def __init__(self, offsets, lines, size, mtime, filter_regex=None,
+                 encoding=Configuration.ENCODING):
+        """
+        :param offsets: an ``array('Q')`` of segment byte offsets
+        :param lines: an ``array('Q')`` of segment line numbers
+        :param size: the size of the indexed file
+        :param mtime: the modification time of the indexed file (in ns)
+        :param filter_regex: the filter used while building the index
+        :param encoding: the encoding used while building the index
+        """
+        assert len(offsets) == len(lines)
+        self.offsets = offsets
+        self.lines = lines
+        self.size = size
+        self.mtime = mtime
+        self.filter = filter_regex
+        self.encoding = _encoding_name(encoding)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, segment):
+        return self.offsets[segment], self.lines[segment]
+
+    @classmethod
+    def build(cls, otpl_file, filter_regex=None,
+              encoding=Configuration.ENCODING):
+        """
+        Build the index for an `otpl_file` in a single streaming pass.
+
+        Segments are separated by empty lines; lines matching the (optional)
+        `filter_regex` are skipped just as the :class:`otplc.reader.OtplReader`
+        does, and segments consisting only of filtered lines are not indexed.
+
+        :raises IOError: if the OTPL file cannot be read
+        """
+        stat = os.stat(otpl_file)
+        skip = None if filter_regex in (None, r'^$') else \
+            compile(filter_regex).search
+        offsets, lines = array('Q'), array('Q')
+        in_segment = False
+        offset = 0
+
+        with open(otpl_file, 'rb') as stream:
+            for lno, raw_line in enumerate(stream, 1):
+                line = raw_line.rstrip(b'\r\n')
+
+                if not line:
+                    in_segment = False
+                elif not in_segment and (
+                    skip is None or not skip(line.decode(encoding))
+                ):
+                    offsets.append(offset)
+                    lines.append(lno)
+                    in_segment = True
+
+                offset += len(raw_line)
+
+        L.info('%d segments in "%s"', len(offsets), otpl_file)
+        return cls(offsets, lines, stat.st_size, stat.st_mtime_ns,
+                   filter_regex, encoding)
+
+    @classmethod
+    def load(cls, index_file, otpl_file, filter_regex=None,
+             encoding=Configuration.ENCODING):
+        """
+        Load an index, but only if it is valid for the current state of the
+        `otpl_file` and the given `filter_regex` and `encoding`.
+
+        :return: a :class:`SegmentIndex` or ``None`` if the index file is
+                 missing, corrupt, or stale
+        """
+        try:
+            stat = os.stat(otpl_file)
+
+            with open(index_file, 'rb') as stream:
+                data = stream.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            magic, size, mtime, count, length, coding = \
+                HEADER.unpack_from(data)
+            start = HEADER.size + length
+            stored_filter = data[HEADER.size:start].decode('utf-8') or None
+            stored_encoding = data[start:start + coding].decode('ascii')
+            start += coding
+        except (ValueError, UnicodeDecodeError) as e:
+            L.warning('corrupt index "%s": %s', index_file, str(e))
+            return None
+
+        if magic != MAGIC or len(data) != start + 16 * count:
+            L.warning('corrupt index "%s"', index_file)
+            return None
+        elif size != stat.st_size or mtime != stat.st_mtime_ns or \
+                stored_filter != filter_regex or \
+                stored_encoding != _encoding_name(encoding):
+            L.info('stale index "%s"', index_file)
+            return None
+
+        offsets, lines = array('Q'), array('Q')
+        offsets.frombytes(data[start:start + 8 * count])
+        lines.frombytes(data[start + 8 * count:])
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            lines.byteswap()
+
+        return cls(offsets, lines, size, mtime, filter_regex, encoding)
+
+    def save(self, index_file):
+        """ Write this index to the `index_file`. """
+        offsets, lines = array('Q', self.offsets), array('Q', self.lines)
+        pattern = (self.filter or '').encode('utf-8')
+        encoding = self.encoding.encode('ascii')
+
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            lines.byteswap()
+
+        with open(index_file, 'wb') as stream:
+            stream.write(HEADER.pack(MAGIC, self.size, self.mtime,
+                                     len(offsets), len(pattern),
+                                     len(encoding)))
+            stream.write(pattern)
+            stream.write(encoding)
+            stream.write(offsets.tobytes())
+            stream.write(lines.tobytes())
+
+
+def _encoding_name(encoding):
+    """ Return the normalized name of an `encoding` (default: UTF-8). """
+    return lookup(encoding or Configuration.ENCODING).name
@@ -0,0 +1,272 @@
+"""
+A persistent cache of column specifications, keyed by the structural
+*signature* of the OTPL files they were guessed for.
+
+Corpora of many OTPL files usually share only a handful of layouts; instead
+of guessing the colspec of each file (or reusing the first file's guess for
+all others), the signature of a file - its column count, separator, and a
+hash of its header or of the kinds of values found in each column - is
+looked up in a small JSON file (see
+:attr:`otplc.settings.Configuration.guess_cache`).
+A cached colspec is only used if it validates against the file's lookahead;
+otherwise, or for unknown signatures, the colspec is guessed and stored.
+"""
+import json
+import os
+from hashlib import blake2b
+from logging import getLogger
+
+from otplc.colspec import ColumnSpecification as Spec
+from otplc.reader import NORM, guess_colspec, header_colspec
+from otplc.validator import OtplValidator
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+L = getLogger('otplc.layouts')
+
+VERSION = 1
+"The version of the cache file format."
+
+
+def signature(otpl_reader):
+    """
+    Return the structural signature of the file read by an `otpl_reader`,
+    based on its lookahead.
+
+    The signature is a string of the form ``"width/separator/hash"``, where
+    the hash covers the colspec header (if the file has one) or the kinds
+    of values found in each column (see :func:`column_kinds`).
+
+    :param otpl_reader: an :class:`otplc.reader.OtplReader` with a defined
+                        separator
+    :return: the signature string or ``None`` if the file has no segments
+    :raises DataFormatError: when the column numbers vary
+    """
+    segments = list(otpl_reader.lookahead())
+
+    if not segments:
+        return None
+
+    width = len(segments[0][0])
+
+    if header_colspec(segments[0]) is not None:
+        profile = 'header:' + ' '.join(segments[0][0])
+    else:
+        profile = 'kinds:' + column_kinds(segments)
+
+    digest = blake2b(profile.encode('utf-8'), digest_size=8).hexdigest()
+    return '%d/%s/%s' % (width, otpl_reader.separator, digest)
+
+
+def column_kinds(segments):
+    """
+    Classify the values of each column of the `segments` by a single
+    character:
+
+    * ``n``: only integers,
+    * ``e``: only BIOE tags (``B-x``, ``I-x``, ``E-x``) or ``O``,
+    * ``k``: only normalizations (``NS:ID``) or ``NULL``,
+    * ``?``: only ``O`` or ``NULL`` (i.e., no evidence either way), and
+    * ``s``: anything else (tokens, tags, relation labels, ...).
+
+    Projected-out (``None``) columns are classified as ``?``.
+    """
+    width = len(segments[0][0])
+    integers = [True] * width
+    tags = [True] * width
+    norms = [True] * width
+    evidence = [False] * width
+
+    for segment in segments:
+        for row in segment:
+            for col, value in enumerate(row):
+                if value is None:  # projected out: no evidence
+                    integers[col] = False
+                    continue
+
+                if integers[col] and not value.isdigit():
+                    integers[col] = False
+
+                if value == 'O' or value == 'NULL':
+                    tags[col] = tags[col] and value == 'O'
+                    norms[col] = norms[col] and value == 'NULL'
+                    continue
+
+                evidence[col] = True
+
+                if tags[col] and (value[:2] not in ('B-', 'I-', 'E-') or
+                                  len(value) < 3):
+                    tags[col] = False
+
+                if norms[col] and not NORM.match(value):
+                    norms[col] = False
+
+    kinds = []
+
+    for col in range(width):
+        if integers[col]:
+            kinds.append('n')
+        elif not evidence[col] and (tags[col] or norms[col]):
+            kinds.append('?')
+        elif tags[col]:
+            kinds.append('e')
+        elif norms[col]:
+            kinds.append('k')
+        else:
+            kinds.append('s')
+
+    return ''.join(kinds)
+
+
+def fits(otpl_reader, colspec):
+    """
+    Return ``True`` if the `colspec` validates against the segments in the
+    lookahead of an `otpl_reader`.
+
+    Global references are not resolved, as their targets might be found
+    beyond the lookahead.
+    """
+    checker = OtplValidator(colspec)
+    lno = 0
+
+    for segment in otpl_reader.lookahead():
+        if header_colspec(segment) is not None:
+            continue
+
+        rows = []
+
+        for row in segment:
+            lno += 1
+
+            if len(row) != colspec.width:
+                return False
+
+            rows.append((lno, row))
+
+        checker.check_segment(rows)
+
+        if checker.problems:
+            L.debug('%s', checker.problems[0])
+            return False
+
+    return True
+
+
+class LayoutCache(object):
+
+    """
+    A persistent mapping of file signatures to colspec strings, stored in
+    a JSON file (or only kept in memory if no path is given).
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: the path of the cache file (need not exist) or ``None``
+        """
+        self.path = path
+        self._layouts = self._load()
+        self._added = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def __contains__(self, sig):
+        return sig in self._layouts
+
+    def get(self, sig):
+        """ Return the colspec cached for the signature `sig` or ``None``. """
+        spec = self._layouts.get(sig)
+        return None if spec is None else Spec.from_string(spec)
+
+    def put(self, sig, colspec):
+        """ Cache the `colspec` for the signature `sig`. """
+        self._layouts[sig] = self._added[sig] = colspec.header
+
+    def colspec_for(self, otpl_reader, guess=guess_colspec):
+        """
+        Return the colspec for the file read by an `otpl_reader`, either
+        from the cache or by (validating and caching) a `guess`.
+
+        :param otpl_reader: an :class:`otplc.reader.OtplReader` with a
+                            defined separator
+        :param guess: a function that guesses the colspec for a reader
+        :return: a :class:`otplc.colspec.ColumnSpecification` or ``None``
+                 if the guess failed
+        :raises DataFormatError: when the column numbers vary
+        """
+        sig = signature(otpl_reader)
+
+        if sig is None:
+            return guess(otpl_reader)
+
+        if sig in self._layouts:
+            try:
+                colspec = self.get(sig)
+            except ValueError as e:
+                L.warning('dropping broken colspec cached for %s: %s', sig, e)
+                colspec = None
+
+            if colspec is not None and fits(otpl_reader, colspec):
+                L.debug('using cached colspec for %s', sig)
+                self.hits += 1
+                return colspec
+
+            L.warning('cached colspec for %s does not fit - guessing', sig)
+
+        self.misses += 1
+        colspec = guess(otpl_reader)
+
+        if colspec is not None:
+            if fits(otpl_reader, colspec):
+                self.put(sig, colspec)
+            else:
+                L.info('guessed colspec "%s" does not validate; '
+                       'not caching it', colspec)
+
+        return colspec
+
+    def save(self):
+        """
+        Write the colspecs added since loading to the cache file, merging
+        them with any others stored in the meantime.
+
+        :raises IOError: when the cache file cannot be written
+        """
+        if not self._added or self.path is None:
+            return
+
+        layouts = self._load()
+        layouts.update(self._added)
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            json.dump({'version': VERSION, 'layouts': layouts}, out,
+                      indent=1, sort_keys=True)
+
+        os.replace(tmp_path, self.path)
+        self._layouts.update(layouts)
+        self._added = {}
+        L.info('stored %d layouts in "%s"', len(layouts), self.path)
+
+    def _load(self):
+        if self.path is None:
+            return {}
+
+        try:
+            with open(self.path, encoding='utf-8') as stream:
+                data = json.load(stream)
+        except FileNotFoundError:
+            return {}
+        except (IOError, ValueError) as e:
+            L.warning('ignoring unreadable colspec cache "%s": %s',
+                      self.path, e)
+            return {}
+
+        if not isinstance(data, dict) or data.get('version') != VERSION:
+            L.warning('ignoring colspec cache "%s" of unknown version',
+                      self.path)
+            return {}
+
+        return dict(data.get('layouts', {}))
@@ -1,11 +1,23 @@
 """
 Functionality for reading and working with OTPL files.
 """
-from collections import defaultdict
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import StringIO, TextIOWrapper
+from itertools import chain, islice, repeat
 from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from random import Random
 from re import compile
+from sys import intern
+from time import monotonic, sleep
 
 from otplc.colspec import ColumnSpecification as Spec
+from otplc.index import load_or_build_index
+from otplc.streams import aiterate, detect_compression, iter_lines, \
+    ASYNC_BLOCK, ASYNC_READ_AHEAD
 
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
@@ -18,6 +30,8 @@ L = getLogger('otplc.reader')
 TAB = compile('\t')
 SPACES = compile(r'\s+')
 NORM = compile(r'^(?:\S+:\S+|NULL)$')
+BLANK_LINE = compile(b'\n\r?\n')
+LINE_NUMBER = compile(r'^line (\d+)')
 DEFAULT_ENCODING = 'utf-8'
 
 
@@ -34,20 +48,56 @@ def configure_reader(file_path, config):
     Create a new :class:`OtplReader`, optionally with a filter regex and a
     pre-defined column separator regex.
 
+    If the configuration's ``mmap`` flag is set, a :class:`MappedOtplReader`
+    is created instead of the default, text-mode reader.
+    If its ``cache`` flag is set, a
+    :class:`otplc.columnar.ColumnarOtplReader` reading from the file's
+    columnar cache (built first, if necessary) is returned.
+    The configured column projection and interning are only applied if the
+    configuration has a colspec, so a colspec guessed from the reader sees
+    all columns; otherwise, apply them once the colspec is resolved.
+
     :param file_path: to the OTPL file
     :param config: a :class:`otplc.settings.Configuation` object
     :return: a :class:`OtplReader` instance
     """
-    reader = OtplReader(file_path, encoding=config.encoding)
+    reader_class = OtplReader
+
+    if config.mmap:
+        if hasattr(file_path, 'read') or detect_compression(file_path):
+            L.warning(u'cannot memory-map "%s"', file_path)
+        else:
+            reader_class = MappedOtplReader
+
+    reader = reader_class(file_path, encoding=config.encoding)
 
     if config.filter is not None:
         reader.filter = config.filter
 
+    if config.compact:
+        reader.compact = True
+
+    if config.colspec is not None:
+        if config.columns is not None:
+            reader.columns = config.columns
+
+        if config.intern:
+            reader.interned = config.colspec.get_non_token_columns()
+
     if config.separator is not None:
         reader.separator = config.separator
     elif not reader.detect_separator():
         L.error(u'for "%s" failed: not field separator detected', file_path)
-        reader = None
+        return None
+
+    if config.cache:
+        from otplc.columnar import load_or_build_cache  # circular import
+
+        try:
+            reader = load_or_build_cache(reader, config.colspec)
+        except (DataFormatError, IOError) as e:
+            L.error(u'caching "%s" failed: %s', file_path, str(e))
+            return None
 
     return reader
 
@@ -61,15 +111,36 @@ class OtplReader(object):
     Iterating over a reader instance will yield its *segments*.
     Segments simply are lists (token rows) of lists (the columns), with each
     row having an equal number of columns.
+    If the :attr:`.compact` flag is set, :class:`Segment` instances are yielded
+    instead.
+    If a :attr:`.columns` projection is set, the values of all other columns
+    are ``None``.
     If not using the builder function, ensure that the field/column
     :attr:`.separator` has been properly defined before iterating.
     """
 
+    LOOKAHEAD_SEGMENTS = 10
+    "The maximum number of segments kept in the lookahead buffer."
+
+    LOOKAHEAD_LINES = 10000
+    """
+    The maximum number of lines kept in the lookahead buffer, unless the
+    first segment alone is longer (the buffer always holds one segment).
+    """
+
+    ASYNC_READ_AHEAD = ASYNC_READ_AHEAD
+    "The default number of segment blocks read ahead by :meth:`.aiter`."
+
+    ASYNC_BLOCK_SEGMENTS = ASYNC_BLOCK
+    "The default number of segments read per block by :meth:`.aiter`."
+
     def __init__(self, file_path, **open_args):
         """
         Create a new reader instance.
 
-        :param file_path: the OTPL file location
+        :param file_path: the OTPL file location or a readable stream (e.g.,
+                          :data:`sys.stdin`); compressed files and streams
+                          (gzip, bzip2, xz) are decompressed transparently
         :param open_args: `open` keyword arguments other than the defaults
         """
         self._file_path = file_path
@@ -77,32 +148,389 @@ class OtplReader(object):
         self._separator = None
         # skip lines matching "self._filter.search(line)":
         self._filter = compile(r'^$')
+        # the compiled line parser (see _compile_line_parser):
+        self._split, self._skip = None, None
+        self._columns = None
+        self._interned = None
+        self._make_segment = list
+        # the lookahead buffer and the open line iterator continuing it:
+        self._buffer = None
+        self._pending = None
+        self._exhausted = False
+        self._stream_used = False
+        self._index = None
+        # the column count of the file's first row, once known:
+        self._width = None
+        # the byte offset and line number up to which follow() has consumed:
+        self._position = (0, 1)
+        self._inode = None
+
+    @classmethod
+    def like(cls, reader, *args):
+        """
+        Create a new reader of this class for the file of another `reader`,
+        with the same separator, filter, column projection, interned columns,
+        and compact flag.
+
+        :param reader: an :class:`OtplReader` of a file (not a stream)
+        :param args: further positional arguments for the constructor (e.g.,
+                     the `jobs` of a :class:`ParallelOtplReader`)
+        """
+        other = cls(reader._file_path, *args, **reader._open_args)
+        other._separator = reader._separator
+        other._filter = reader._filter
+        other._columns = reader._columns
+        other._interned = reader._interned
+        other._make_segment = reader._make_segment
+        other._compile()
+        return other
 
     def __iter__(self):
         """
         Yield OTLP segments as lists of rows with equal number of columns.
 
         Requires that the separator regex property has been defined.
+        If the lookahead buffer has been filled (e.g., by
+        :meth:`.detect_separator` or :func:`guess_colspec`), the first pass
+        continues reading from the already opened input.
 
         :raises DataFormatError: when the column numbers vary
-        :raises IOError: when the I/O operation fails
+        :raises IOError: when the I/O operation fails or a stream input
+                         would have to be read a second time
         :raises UnicodeDecodeError: when the input isn't in UTF-8 encoding
         :raises AttributeError: if the separator property is undefined
         """
-        column_count = 0
+        return self._segments(self._open())
+
+    def __aiter__(self):
+        """
+        Asynchronously yield OTPL segments (``async for``), as :meth:`.aiter`
+        does with the default read-ahead settings.
+        """
+        return self.aiter()
+
+    def aiter(self, depth=None, block=None, executor=None):
+        """
+        Asynchronously yield OTPL segments, reading and parsing them in blocks
+        off the :mod:`asyncio` event loop.
+
+        :param depth: the number of segment blocks to read ahead
+                      (default: :attr:`.ASYNC_READ_AHEAD`)
+        :param block: the number of segments read per block
+                      (default: :attr:`.ASYNC_BLOCK_SEGMENTS`)
+        :param executor: the executor doing the reading (default: the event
+                         loop's default executor)
+        :return: an asynchronous generator of segments
+        :raises: the same errors as iterating over the reader
+        """
+        return aiterate(self, depth or self.ASYNC_READ_AHEAD,
+                        block or self.ASYNC_BLOCK_SEGMENTS, executor)
+
+    def batches(self, max_segments=None, max_tokens=None, max_bytes=None,
+                bucket_width=None):
+        """
+        Yield lists of segments bounded in size, as described for
+        :func:`batch_segments`.
+        """
+        return batch_segments(self, max_segments, max_tokens, max_bytes,
+                              bucket_width)
+
+    def lines(self):
+        """
+        Return the lines (without line terminators) for a full pass over the
+        input, continuing from the lookahead buffer if it has been filled.
+
+        :raises IOError: when a stream input would have to be read a second
+                         time
+        """
+        return self._open()
+
+    def line_parser(self):
+        """
+        Return a ``(split, skip)`` pair of functions for the separator and
+        filter of this reader, ignoring the column projection and interning:
+        `split` splits a line into all its fields and `skip` (if not
+        ``None``) tells if a line is filtered out.
+
+        :raises AttributeError: if the separator property is undefined
+        """
+        return _compile_line_parser(self._separator, self._filter)
+
+    def lookahead(self):
+        """
+        Yield the (complete) segments in the lookahead buffer, filling it
+        first if necessary, without consuming them from the input.
+
+        Requires that the separator regex property has been defined.
+
+        :raises DataFormatError: when the column numbers vary
+        :raises AttributeError: if the separator property is undefined
+        """
+        lines = self._prefetch()
+        end = len(lines)
+
+        if not self._exhausted:
+            # drop the last, possibly incomplete segment
+            while end and lines[end - 1]:
+                end -= 1
+
+        return self._segments(lines[:end])
+
+    def segment(self, number):
+        """
+        Return a single segment by its (zero-based) `number`, using the
+        :attr:`.index` to seek to it directly.
+
+        :raises IndexError: if there is no such segment
+        """
+        for segment in self.slice(number, number + 1):
+            return segment
+
+        raise IndexError('segment %d not in "%s"' % (number, self.path))
+
+    def slice(self, start, stop=None):
+        """
+        Yield the segments from `start` up to (but excluding) `stop` (or the
+        end of the file), using the :attr:`.index` to seek to the first one.
+
+        Line numbers in :class:`DataFormatError` messages remain those of the
+        whole file, and the column count is checked against the file's first
+        row.
+        """
+        index = self.index
+        start, stop, _ = slice(start, stop).indices(len(index))
+
+        if start >= stop:
+            return
+
+        offset, lno = index[start]
+        width = self._first_width() if start else 0
+
+        with open(self._file_path, 'rb') as raw:
+            raw.seek(offset)
+            stream = TextIOWrapper(
+                raw, encoding=self._open_args.get('encoding'),
+                errors=self._open_args.get('errors')
+            )
+            lines = (line.rstrip('\r\n') for line in stream)
+
+            for segment in islice(self._segments(lines, lno, width),
+                                  stop - start):
+                yield segment
+
+    def _first_width(self):
+        """ Return (and remember) the column count of the file's first row. """
+        if self._width is None:
+            self._width = next((len(s[0]) for s in self.slice(0, 1)), 0)
+
+        return self._width
+
+    def follow(self, interval=1.0, timeout=None):
+        """
+        Yield segments as they are appended to a growing OTPL file, each as
+        soon as its terminating empty line has been written.
+
+        Reading starts at (and advances) the reader's :attr:`.position`.
+        If the file is replaced (rotated) while being followed, the last
+        segment of the old file is yielded and reading continues at the start
+        of the new file; if the file is truncated, or has been replaced since
+        the last call, reading restarts at its beginning.
+
+        :param interval: the seconds to wait before polling for new data
+        :param timeout: stop after this many seconds without new data
+                        (default: follow the file forever)
+        :raises DataFormatError: when the column numbers vary
+        :raises IOError: if the input is a stream or compressed
+        :raises AttributeError: if the separator property is undefined
+        """
+        if hasattr(self._file_path, 'read') or \
+                detect_compression(self._file_path):
+            raise IOError('cannot follow "%s"' % self.path)
+        elif self._split is None:
+            raise AttributeError('separator undefined')
+
+        stream = None
+        pending, tail = [], b''
+        idle = 0.0
+
+        try:
+            while True:
+                if stream is None:
+                    stream = self._reopen()
+
+                line = stream.readline() if stream is not None else b''
+
+                if line.endswith(b'\n'):
+                    pending.append(tail + line)
+                    tail = b''
+                    idle = 0.0
+
+                    if not pending[-1].rstrip(b'\r\n'):
+                        yield from self._consume(pending)
+                        pending = []
+
+                    continue
+
+                tail += line
+
+                if stream is not None and self._replaced(stream):
+                    stream.close()
+                    stream = None
+
+                    if tail:
+                        pending.append(tail + b'\n')
+
+                    yield from self._consume(pending)
+                    pending, tail = [], b''
+                    self._position = (0, 1)
+                elif stream is not None and self._truncated(stream):
+                    stream.close()
+                    stream = None
+                    pending, tail = [], b''
+                    self._position = (0, 1)
+                elif timeout is not None and idle >= timeout:
+                    return
+                else:
+                    sleep(interval)
+                    idle += interval
+        finally:
+            if stream is not None:
+                stream.close()
+
+    def _reopen(self):
+        """
+        Open the file at the current :attr:`.position` (or at its start, if
+        it has been replaced or truncated), or return ``None`` if it does not
+        exist.
+        """
+        try:
+            stream = open(self._file_path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        stat = os.fstat(stream.fileno())
+
+        if self._inode not in (None, stat.st_ino):
+            L.info('"%s" replaced', self.path)
+            self._position = (0, 1)
+        elif stat.st_size < self._position[0]:
+            L.info('"%s" truncated', self.path)
+            self._position = (0, 1)
+
+        self._inode = stat.st_ino
+
+        stream.seek(self._position[0])
+        return stream
+
+    def _replaced(self, stream):
+        """
+        Return ``True`` if the file at the reader's path has been replaced
+        (e.g., rotated) since the `stream` was opened.
+        """
+        try:
+            replaced = os.stat(self._file_path).st_ino != \
+                os.fstat(stream.fileno()).st_ino
+        except FileNotFoundError:
+            return False  # moved away, but the replacement does not exist yet
+
+        if replaced:
+            L.info('"%s" replaced', self.path)
+
+        return replaced
+
+    def _truncated(self, stream):
+        """
+        Return ``True`` if the `stream`'s file has been truncated to less than
+        has been read from it.
+        """
+        if os.fstat(stream.fileno()).st_size < stream.tell():
+            L.info('"%s" truncated', self.path)
+            return True
+
+        return False
+
+    def _consume(self, raw_lines):
+        """
+        Return the segment (if any) in the `raw_lines` as a list, and only
+        then advance the :attr:`.position` past them; rows after the start of
+        the file are checked against the column count of those before.
+
+        :raises DataFormatError: when the column numbers vary (without
+                                 advancing the position)
+        """
+        offset, lno = self._position
+        encoding = self._open_args.get('encoding') or DEFAULT_ENCODING
+        errors = self._open_args.get('errors') or 'strict'
+        lines = [line.decode(encoding, errors).rstrip('\r\n')
+                 for line in raw_lines]
+        width = (self._width or 0) if lno > 1 else 0
+        segments = list(self._segments(lines, lno, width))
+
+        if segments:
+            self._width = len(segments[0][0])
+
+        self._position = (offset + sum(map(len, raw_lines)),
+                          lno + len(raw_lines))
+        return segments
+
+    @property
+    def index(self):
+        """
+        The :class:`otplc.index.SegmentIndex` of this reader's file, loaded
+        from (or, if missing or stale, built and stored in) its sidecar file.
+
+        :raises IOError: if the input is a stream or cannot be read
+        """
+        if hasattr(self._file_path, 'read'):
+            raise IOError('cannot index stream "%s"' % self.path)
+        elif detect_compression(self._file_path):
+            raise IOError('cannot index compressed "%s"' % self.path)
+
+        if self._index is None:
+            self._index = load_or_build_index(
+                self._file_path, self.filter,
+                self._open_args.get('encoding', DEFAULT_ENCODING)
+            )
+
+        return self._index
+
+    def _segments(self, lines, first_lno=1, column_count=0):
+        """
+        Yield the segments in the `lines`, numbered from `first_lno`, checking
+        that all rows have `column_count` columns (default: as many as the
+        first row).
+        """
+        if self._split is None:
+            raise AttributeError('separator undefined')
+
+        split, skip = self._split, self._skip
+        make_segment = self._make_segment
         segment = []
 
-        for lno, line in enumerate(self._open(), 1):
+        for lno, line in enumerate(lines, first_lno):
             if line:
-                column_count = self._parse_line(
-                    line, lno, segment, column_count
-                )
+                if skip is not None and skip(line):
+                    continue
+
+                fields = split(line)
+
+                if len(fields) != column_count:
+                    if column_count:
+                        raise DataFormatError(
+                            'line %d has %d columns, but expected %d' % (
+                                lno, len(fields), column_count
+                            )
+                        )
+
+                    column_count = len(fields)
+
+                segment.append(fields)
             elif segment:
-                yield segment
+                yield make_segment(segment)
                 segment = []
 
         if segment:
-            yield segment
+            yield make_segment(segment)
 
     def detect_separator(self):
         """
@@ -119,11 +547,11 @@ class OtplReader(object):
             separator = _choose_separator(spaces_fields, tab_fields)
         elif len(spaces_fields) == 0 and len(tab_fields) == 0:
             L.warning(u'either "%s" is empty or all lines were filtered' %
-                      self._file_path)
+                      self.path)
 
         if separator is None:
             L.warning(u'failed because "%s" has no stable column-count' %
-                      self._file_path)
+                      self.path)
         else:
             self.separator = separator.pattern
 
@@ -135,7 +563,7 @@ class OtplReader(object):
         count = 0
 
         try:
-            for line in self._open():
+            for line in self._prefetch():
                 if line and not self._filter.match(line):
                     spaces_fields[len(SPACES.split(line))] += 1
                     tab_fields[len(TAB.split(line))] += 1
@@ -149,33 +577,130 @@ class OtplReader(object):
 
         return spaces_fields, tab_fields
 
-    def _extract_fields(self, line, lno, column_count):
-        fields = self._separator.split(line)
+    def _compile(self):
+        """
+        Compile the line parser for the current separator, filter, column
+        projection, and interned columns.
+        """
+        if self._separator is not None:
+            self._split, self._skip = _compile_line_parser(
+                self._separator, self._filter, self._columns, self._interned
+            )
+
+    def _open(self):
+        """ Return the lines for a full pass over the input. """
+        if self._pending is not None:
+            lines = chain(self._buffer, self._pending)
+            self._buffer, self._pending = None, None
+            return lines
 
-        if column_count != 0 and column_count != len(fields):
-            raise DataFormatError('line %d has %d columns, but expected %d' % (
-                lno, len(fields), column_count
-            ))
+        return self._read_lines()
 
-        return fields
+    def _prefetch(self):
+        """ Fill the lookahead buffer (if necessary) and return it. """
+        if self._buffer is None:
+            self._pending = self._read_lines()
+            self._buffer = []
+            self._exhausted = True
+            segments = 0
 
-    def _open(self):
-        for raw_line in open(self._file_path, **self._open_args):
+            for line in self._pending:
+                self._buffer.append(line)
+
+                if not line and len(self._buffer) > 1 and self._buffer[-2]:
+                    segments += 1
+
+                if segments == self.LOOKAHEAD_SEGMENTS or (
+                        segments and
+                        len(self._buffer) >= self.LOOKAHEAD_LINES):
+                    self._exhausted = False
+                    break
+
+        return self._buffer
+
+    def _read_lines(self):
+        if hasattr(self._file_path, 'read'):
+            if self._stream_used:
+                raise IOError('cannot re-read stream "%s"' % self.path)
+
+            self._stream_used = True
+
+        for raw_line in iter_lines(self._file_path, **self._open_args):
             yield raw_line.rstrip('\r\n')
 
-    def _parse_line(self, line, lno, segment, column_count):
-        if not self._filter.search(line):
-            segment.append(self._extract_fields(line, lno, column_count))
-            column_count = len(segment[0]) if column_count == 0 else \
-                column_count
+    @property
+    def position(self):
+        """
+        The ``(byte offset, line number)`` up to which :meth:`.follow` has
+        consumed the file; set it to resume following at that position.
+        """
+        return self._position
 
-        return column_count
+    @position.setter
+    def position(self, position):
+        """ :type position: (int, int) """
+        self._position = tuple(position)
+        self._inode = None
 
     @property
     def path(self):
-        """ The file path of this reader. """
+        """ The file path (or stream name) of this reader. """
+        if hasattr(self._file_path, 'read'):
+            return getattr(self._file_path, 'name', '<stream>')
+
         return self._file_path
 
+    @property
+    def is_stream(self):
+        """ ``True`` if this reader reads a stream (that cannot be re-read). """
+        return hasattr(self._file_path, 'read')
+
+    @property
+    def compact(self):
+        """ If ``True``, segments are yielded as :class:`Segment` instances. """
+        return self._make_segment is Segment
+
+    @compact.setter
+    def compact(self, flag):
+        """ :type flag: bool """
+        self._make_segment = Segment if flag else list
+
+    @property
+    def columns(self):
+        """
+        The (zero-based) columns the consumer uses or ``None`` for all.
+
+        The rows of segments still have all columns, but the values of
+        columns not in this projection are never kept (``None``).
+        """
+        return self._columns
+
+    @columns.setter
+    def columns(self, columns):
+        """ :type columns: iterable of int """
+        self._columns = None if columns is None else tuple(sorted(set(columns)))
+        L.info(u'= %s', self._columns)
+        self._compile()
+
+    @property
+    def interned(self):
+        """
+        The (zero-based) columns whose values are interned or ``None``.
+
+        Interning makes all equal values of these columns (e.g., tags, labels,
+        ``NULL``, or ``0``) share one string object, which saves memory when
+        segments are kept (but costs some parsing time).
+        """
+        return self._interned
+
+    @interned.setter
+    def interned(self, columns):
+        """ :type columns: iterable of int """
+        self._interned = None if columns is None else \
+            tuple(sorted(set(columns))) or None
+        L.info(u'= %s', self._interned)
+        self._compile()
+
     @property
     def filter(self):
         """ A regex that defines which lines are ignored. """
@@ -186,6 +711,9 @@ class OtplReader(object):
         """ :type regex: str """
         L.info(u'= /%s/', regex)
         self._filter = compile(regex)
+        self._index = None
+        self._width = None
+        self._compile()
 
     @property
     def separator(self):
@@ -197,6 +725,696 @@ class OtplReader(object):
         """ :type regex: str """
         L.info(u'= /%s/', regex)
         self._separator = compile(regex)
+        self._width = None
+        self._compile()
+
+
+class MappedOtplReader(OtplReader):
+
+    """
+    A reader that memory-maps the OTPL file instead of decoding it line by
+    line.
+
+    Segment boundaries (empty lines) are found and column counts are verified
+    on the raw bytes; the rows of the yielded segments only are decoded and
+    split (once) when a consumer first accesses the segment (see
+    :class:`MappedSegment`).
+    This only works for a literal (e.g., tab) separator, where the columns
+    can be counted without splitting the line; for other separators, the
+    rows are decoded and split right away, as they would have to be split
+    for counting anyway, and plain lists are yielded.
+    Therefore, the file encoding must be ASCII-compatible (e.g., UTF-8), the
+    filter and separator patterns should be ASCII-only, and lines must be
+    terminated by ``\\n`` or ``\\r\\n`` (but not ``\\r`` alone).
+    The :attr:`.compact` flag has no effect on this reader.
+    """
+
+    CHUNK_SIZE = 1 << 20
+    "The number of bytes split into lines at a time."
+
+    def __init__(self, file_path, **open_args):
+        """
+        Create a new reader instance.
+
+        :param file_path: the OTPL file location
+        :param open_args: only the ``encoding`` argument is used
+        """
+        super(MappedOtplReader, self).__init__(file_path, **open_args)
+        self._encoding = open_args.get('encoding', DEFAULT_ENCODING)
+        self._split_raw, self._skip_raw = None, None
+        self._literal = None  # the raw separator, if a literal byte string
+
+    def __iter__(self):
+        """
+        Yield OTLP segments as lazily decoded :class:`MappedSegment`
+        instances (or as lists of rows for non-literal separators).
+
+        :raises DataFormatError: when the column numbers vary
+        :raises IOError: when the I/O operation fails
+        :raises AttributeError: if the separator property is undefined
+        """
+        if self._split_raw is None:
+            raise AttributeError('separator undefined')
+
+        if self._literal is None:
+            return super(MappedOtplReader, self).__iter__()
+
+        return self._mapped_segments()
+
+    def _mapped_segments(self):
+        literal, skip = self._literal, self._skip_raw
+        decode = self._decode_lines
+        column_count = 0
+        lno = 1  # the line number at the start of the current block
+
+        for block in self._blocks():
+            lines = block.lstrip(b'\n')
+            first_lno = lno + len(block) - len(lines)
+            lno += block.count(b'\n') + 2
+            lines = lines.rstrip(b'\n')
+
+            if not lines:
+                continue
+
+            lines = lines.split(b'\n')
+            rows = lines if skip is None else \
+                [line for line in lines if not skip(line)]
+
+            if not rows:
+                continue
+
+            if column_count == 0:
+                column_count = rows[0].count(literal) + 1
+
+            widths = set(map(bytes.count, rows, repeat(literal)))
+
+            if len(widths) != 1 or widths.pop() != column_count - 1:
+                for idx, line in enumerate(lines):
+                    width = line.count(literal) + 1
+
+                    if width != column_count and (skip is None or
+                                                  not skip(line)):
+                        raise DataFormatError(
+                            'line %d has %d columns, but expected %d' % (
+                                first_lno + idx, width, column_count
+                            )
+                        )
+
+            yield MappedSegment(rows, decode)
+
+    def _blocks(self):
+        """
+        Yield the raw text (with ``\\n`` line-breaks only) between the
+        empty lines of the mapped file, reading chunks of about
+        :attr:`.CHUNK_SIZE` bytes that end after an empty line.
+        """
+        with open(self._file_path, 'rb') as stream:
+            try:
+                buffer = mmap(stream.fileno(), 0, access=ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                return
+
+            with buffer:
+                size = len(buffer)
+                start = 0
+
+                while start < size:
+                    match = BLANK_LINE.search(buffer, start + self.CHUNK_SIZE)
+                    end = size if match is None else match.end()
+                    chunk = buffer[start:end]
+
+                    if b'\r' in chunk:
+                        chunk = chunk.replace(b'\r\n', b'\n')
+
+                    blocks = chunk.split(b'\n\n')
+
+                    if match is not None:
+                        blocks.pop()  # the (empty) rest after the chunk's end
+
+                    yield from blocks
+                    start = end
+
+    def _prefetch(self):
+        buffer = super(MappedOtplReader, self)._prefetch()
+
+        if self._pending is not None:
+            # mapping the file again is cheap, so do not keep it open
+            self._pending.close()
+            self._pending = None
+
+        return buffer
+
+    def _read_lines(self):
+        encoding = self._encoding
+
+        for block in self._blocks():
+            yield from block.decode(encoding).split('\n')
+            yield ''
+
+    def _compile(self):
+        super(MappedOtplReader, self)._compile()
+
+        if self._separator is not None:
+            raw_separator = compile(self.separator.encode(self._encoding))
+            raw_filter = compile(self.filter.encode(self._encoding))
+            self._split_raw, self._skip_raw = _compile_line_parser(
+                raw_separator, raw_filter
+            )
+            self._literal = _literal_separator(raw_separator)
+
+    def _decode_lines(self, lines):
+        text = b'\n'.join(lines).decode(self._encoding)
+
+        if self._columns is None and self._interned is None:
+            separator = self._literal.decode(self._encoding)
+            return [line.split(separator) for line in text.split('\n')]
+
+        split = self._split
+        return [split(line) for line in text.split('\n')]
+
+
+def _literal_separator(separator):
+    """
+    Return the raw `separator` pattern if it matches exactly one, fixed
+    byte string (e.g., a tab), or ``None`` otherwise.
+    """
+    pattern = {b'\\t': b'\t', b'\\s': None}.get(separator.pattern,
+                                                  separator.pattern)
+
+    if pattern and not any(c in b'.^$*+?{}[]\\|()' for c in pattern):
+        return pattern
+
+    return None
+
+
+class ParallelOtplReader(OtplReader):
+
+    """
+    A reader that parses a single (large) OTPL file in parallel.
+
+    The file is split into byte ranges of about :attr:`.CHUNK_SIZE` bytes,
+    each snapped to the end of the next empty line, and the chunks are parsed
+    in a process pool.
+    The segments are yielded in file order, and line numbers in
+    :class:`DataFormatError` messages refer to the whole file.
+    Lines must be terminated by ``\\n`` or ``\\r\\n`` (but not ``\\r``
+    alone), and the input must be a file (not a stream).
+
+    Note that the parsed segments have to be transferred back from the
+    workers, so this reader only pays off with several cores and CPU-bound
+    parsing (e.g., complex separator or filter patterns).
+    """
+
+    CHUNK_SIZE = 1 << 24
+    "The approximate number of bytes in each chunk."
+
+    def __init__(self, file_path, jobs=None, chunk_size=None, **open_args):
+        """
+        Create a new reader instance.
+
+        :param file_path: the OTPL file location
+        :param jobs: the number of worker processes (default: CPU count)
+        :param chunk_size: the approximate chunk size in bytes
+        :param open_args: `open` keyword arguments other than the defaults
+        """
+        super(ParallelOtplReader, self).__init__(file_path, **open_args)
+        self._jobs = jobs or os.cpu_count() or 1
+        self._chunk_size = chunk_size or self.CHUNK_SIZE
+
+    def __iter__(self):
+        """
+        Yield OTLP segments as lists of rows with equal number of columns.
+
+        :raises DataFormatError: when the column numbers vary
+        :raises IOError: when the I/O operation fails
+        :raises UnicodeDecodeError: when the input isn't in UTF-8 encoding
+        :raises AttributeError: if the separator property is undefined
+        """
+        column_count = 0
+        line_offset = 0
+        # strings interned in a worker are unpickled as new objects here:
+        interned = self._interned
+
+        if interned and self._columns:
+            interned = tuple(c for c in interned if c in self._columns)
+
+        for result in self.map_chunks(_parse_chunk):
+            segments, lines, width, first_row, error = result
+
+            if column_count == 0:
+                column_count = width
+            elif width not in (0, column_count):
+                lno = line_offset + first_row
+                raise DataFormatError(
+                    'line %d has %d columns, but expected %d' % (
+                        lno, width, column_count
+                    )
+                )
+
+            for segment in segments:
+                if interned and len(segment[0]) > interned[-1]:
+                    for row in segment:
+                        for col in interned:
+                            row[col] = intern(row[col])
+
+                yield self._make_segment(segment)
+
+            if error is not None:
+                raise DataFormatError(_rebase(error, line_offset))
+
+            line_offset += lines
+
+    def map_chunks(self, parse):
+        """
+        Yield the results of `parse` for each chunk in file order, keeping
+        at most twice as many chunks in flight as there are workers.
+
+        In a worker process, `parse` is called with the lines of a chunk
+        (without line terminators) and an :class:`OtplReader` configured like
+        this reader, so `parse` has to be picklable (e.g., a module-level
+        function).
+        Line numbers in the chunk start at one.
+
+        :raises IOError: if the input is a stream or a compressed file
+        :raises AttributeError: if the separator property is undefined
+        """
+        if hasattr(self._file_path, 'read') or \
+                detect_compression(self._file_path):
+            raise IOError('cannot split "%s" into chunks' % self.path)
+
+        spans = _chunk_spans(self._file_path, self._chunk_size)
+        args = (self._file_path, self.separator, self.filter, self._columns,
+                self._interned, self._open_args)
+        pending = deque()
+
+        with ProcessPoolExecutor(self._jobs) as pool:
+            for start, end in spans:
+                pending.append(pool.submit(_map_chunk, parse, start, end,
+                                           *args))
+
+                if len(pending) > 2 * self._jobs:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+
+def _chunk_spans(file_path, chunk_size):
+    """
+    Yield ``(start, end)`` byte ranges of about `chunk_size` bytes, with
+    each range ending right after an empty line (or at the end of the file).
+    """
+    with open(file_path, 'rb') as stream:
+        try:
+            buffer = mmap(stream.fileno(), 0, access=ACCESS_READ)
+        except ValueError:  # empty files cannot be mapped
+            return
+
+        with buffer:
+            size = len(buffer)
+            start = 0
+
+            while start < size:
+                match = BLANK_LINE.search(
+                    buffer, max(start, start + chunk_size - 2)
+                )
+                end = size if match is None else match.end()
+                yield start, end
+                start = end
+
+
+def _read_chunk(file_path, start, end, open_args):
+    """ Read and decode one chunk of a file, returning its lines. """
+    with open(file_path, 'rb') as stream:
+        stream.seek(start)
+        data = stream.read(end - start)
+
+    text = data.decode(open_args.get('encoding') or DEFAULT_ENCODING,
+                       open_args.get('errors') or 'strict')
+    return [line.rstrip('\r\n') for line in StringIO(text)]
+
+
+def _map_chunk(parse, start, end, file_path, separator, filter_regex,
+               columns, interned, open_args):
+    """ Read one chunk of a file and `parse` it (in a worker process). """
+    lines = _read_chunk(file_path, start, end, open_args)
+    reader = OtplReader(None)
+    reader._separator = compile(separator)
+    reader._filter = compile(filter_regex)
+    reader._columns = columns
+    reader._interned = interned
+    reader._compile()
+    return parse(lines, reader)
+
+
+def _parse_chunk(lines, reader):
+    """
+    Parse the segments in the `lines` of one chunk of a file with a `reader`
+    (in a worker process).
+
+    :return: a ``(segments, line count, column count, first row line number,
+             error message)`` tuple, where line numbers (including the one in
+             the error message) are relative to the chunk, and the segments
+             are those before the error, if any
+    """
+    segments = []
+    error = None
+
+    try:
+        for segment in reader._segments(lines):
+            segments.append(segment)
+    except DataFormatError as e:
+        error = str(e)
+
+    first_row = next((lno for lno, line in enumerate(lines, 1)
+                      if line and not reader._filter.search(line)), 0)
+    width = len(reader._split(lines[first_row - 1])) if first_row else 0
+    return segments, len(lines), width, first_row, error
+
+
+def _rebase(message, line_offset):
+    """ Add the `line_offset` to the line number in an error `message`. """
+    return LINE_NUMBER.sub(
+        lambda m: 'line %d' % (int(m.group(1)) + line_offset), message
+    )
+
+
+class MappedSegment(object):
+
+    """
+    A segment yielded by the :class:`MappedOtplReader` that holds on to the
+    raw bytes of its lines and only decodes and splits them into rows (lists
+    of columns) when first accessed; its length is known without decoding.
+    """
+
+    __slots__ = ('_raw', '_decode', '_rows')
+
+    def __init__(self, lines, decode):
+        """
+        :param lines: the raw lines of the segment
+        :param decode: the function to decode and split the raw lines
+        """
+        self._raw = lines
+        self._decode = decode
+        self._rows = None
+
+    def __len__(self):
+        rows = self._rows
+        return len(self._raw) if rows is None else len(rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __eq__(self, other):
+        return self.rows == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(self.rows)
+
+    @property
+    def rows(self):
+        """
+        The decoded rows of this segment.
+
+        :raises UnicodeDecodeError: when a line cannot be decoded
+        """
+        if self._rows is None:
+            self._rows = self._decode(self._raw)
+            self._raw = self._decode = None
+
+        return self._rows
+
+
+class Segment(object):
+
+    """
+    A compact, immutable segment that stores all its cells in one flat,
+    row-major tuple instead of one list per row.
+
+    Indexing a segment returns a row view (a tuple), so the familiar
+    ``segment[row][column]`` access works as with list-of-lists segments,
+    while :meth:`.column` returns a view of all values in one column.
+    """
+
+    __slots__ = ('_width', '_cells')
+
+    def __init__(self, rows=()):
+        """
+        Create a new segment from a sequence of equally wide rows.
+
+        :param rows: a sequence of rows, each a sequence of column values
+        """
+        self._width = len(rows[0]) if len(rows) else 0
+        self._cells = tuple(chain.from_iterable(rows))
+
+    @classmethod
+    def from_cells(cls, width, cells):
+        """
+        Create a segment directly from its flat, row-major cell tuple.
+
+        :param width: the number of columns
+        :param cells: a tuple of ``width * len(segment)`` values
+        """
+        assert width > 0 and len(cells) % width == 0, 'illegal cell count'
+        segment = cls.__new__(cls)
+        segment._width = width
+        segment._cells = cells
+        return segment
+
+    def __len__(self):
+        return len(self._cells) // self._width if self._width else 0
+
+    def __getitem__(self, index):
+        width = self._width
+
+        if isinstance(index, slice):
+            return Segment.from_cells(width, tuple(chain.from_iterable(
+                self[i] for i in range(*index.indices(len(self)))
+            ))) if width else Segment()
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError('segment row index out of range')
+
+        return self._cells[index * width:(index + 1) * width]
+
+    def __iter__(self):
+        width = self._width
+        cells = self._cells
+
+        for start in range(0, len(cells), width):
+            yield cells[start:start + width]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(
+                list(mine) == list(theirs) for mine, theirs in zip(self, other)
+            )
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return 'Segment(%r)' % [list(row) for row in self]
+
+    @property
+    def width(self):
+        """ The number of columns of this segment. """
+        return self._width
+
+    def column(self, column):
+        """ Return all values of one `column` as a tuple. """
+        return self._cells[column::self._width]
+
+
+def batch_segments(segments, max_segments=None, max_tokens=None,
+                   max_bytes=None, bucket_width=None):
+    """
+    Group `segments` into batches (lists) bounded by the number of segments,
+    the number of tokens (rows), and/or the approximate size of the data in
+    bytes (characters and separators).
+
+    A batch is yielded as soon as adding the next segment would exceed any
+    bound; a single segment exceeding a bound forms a batch of its own.
+    The segments themselves are not copied.
+
+    If a `bucket_width` is given, segments are bucketed by their length
+    (``len(segment) // bucket_width``) and each bucket is batched separately,
+    so batches contain segments of similar length; the partial batches left
+    over at the end are yielded ordered by bucket.
+
+    :param segments: an iterable of segments, e.g., an :class:`OtplReader`
+    :param max_segments: the maximum number of segments per batch
+    :param max_tokens: the maximum number of tokens per batch
+    :param max_bytes: the maximum (approximate) data size per batch
+    :param bucket_width: the range of segment lengths per bucket
+    :return: a generator of segment lists
+    :raises ValueError: if no bound is given
+    """
+    if not (max_segments or max_tokens or max_bytes):
+        raise ValueError('no batch size bound given')
+
+    max_segments = max_segments or float('inf')
+    max_tokens = max_tokens or float('inf')
+    max_bytes = max_bytes or float('inf')
+    measure = _segment_bytes if max_bytes != float('inf') else \
+        (lambda segment: 0)
+    buckets = {}  # bucket key: [batch, tokens, bytes]
+
+    for segment in segments:
+        key = len(segment) // bucket_width if bucket_width else 0
+        tokens, size = len(segment), measure(segment)
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            buckets[key] = [[segment], tokens, size]
+        elif len(bucket[0]) < max_segments and \
+                bucket[1] + tokens <= max_tokens and \
+                bucket[2] + size <= max_bytes:
+            bucket[0].append(segment)
+            bucket[1] += tokens
+            bucket[2] += size
+        else:
+            yield bucket[0]
+            buckets[key] = [[segment], tokens, size]
+
+    for key in sorted(buckets):
+        yield buckets[key][0]
+
+
+def _segment_bytes(segment):
+    """ The approximate size of a `segment`'s data (characters). """
+    if isinstance(segment, Segment):
+        cells = segment._cells
+    else:
+        cells = chain.from_iterable(segment)
+
+    return sum(len(c) + 1 for c in cells if c is not None)
+
+
+def _compile_splitter(separator):
+    """
+    Return the fastest function that splits a line into fields for a
+    compiled `separator` pattern (for either `str` or `bytes` lines).
+
+    A tab separator uses a literal split, and the (default) whitespace
+    separator uses the argument-less split unless the line starts or ends with
+    whitespace (where the regex would produce empty fields).
+    """
+    literal = separator.pattern
+
+    if literal in ('\t', b'\t'):
+        return partial(literal.__class__.split, sep=literal)
+    elif literal in (SPACES.pattern, SPACES.pattern.encode()):
+        split = literal.__class__.split
+        split_regex = separator.split
+
+        def split_spaces(line):
+            if line[:1].isspace() or line[-1:].isspace():
+                return split_regex(line)
+
+            return split(line)
+
+        return split_spaces
+    else:
+        return separator.split
+
+
+def _compile_projection(separator, split, columns):
+    """
+    Wrap a `split` function to only keep the values of the given `columns`,
+    replacing all other values with ``None``.
+
+    For a tab separator, the fields right of the last column are never split
+    out (they are only counted).
+    """
+    last = columns[-1]
+    dropped = [col for col in range(last) if col not in columns]
+    literal = separator.pattern
+
+    if literal in ('\t', b'\t'):
+        def project(line):
+            fields = line.split(literal, last + 1)
+
+            if len(fields) > last + 1:
+                fields[-1:] = [None] * (fields[-1].count(literal) + 1)
+
+            if len(fields) > last:
+                for col in dropped:
+                    fields[col] = None
+
+            return fields
+    else:
+        def project(line):
+            fields = split(line)
+
+            if len(fields) > last:
+                fields[last + 1:] = [None] * (len(fields) - last - 1)
+
+                for col in dropped:
+                    fields[col] = None
+
+            return fields
+
+    return project
+
+
+def _compile_interning(split, interned):
+    """
+    Wrap a `split` function to intern the values of the `interned` columns,
+    so equal values share one string object.
+    """
+    last = interned[-1]
+
+    def split_interned(line):
+        fields = split(line)
+
+        if len(fields) > last:
+            for col in interned:
+                fields[col] = intern(fields[col])
+
+        return fields
+
+    return split_interned
+
+
+def _compile_line_parser(separator, filter_regex, columns=None,
+                         interned=None):
+    """
+    Return a ``(split, skip)`` pair of functions, where `split` splits a line
+    into its fields and `skip` (if not ``None``) is the filter's search.
+
+    No filter is returned at all if the filter is the default (``^$``),
+    which never matches a non-empty line.
+    If a sorted tuple of `columns` is given, `split` only keeps those values.
+    If a sorted tuple of `interned` columns is given, `split` interns their
+    (kept) values.
+    """
+    split = _compile_splitter(separator)
+
+    if columns:
+        split = _compile_projection(separator, split, columns)
+
+    if interned and columns:
+        interned = tuple(col for col in interned if col in columns)
+
+    if interned:
+        split = _compile_interning(split, interned)
+
+    if filter_regex is None or filter_regex.pattern in ('^$', b'^$'):
+        return split, None
+
+    return split, filter_regex.search
 
 
 def _choose_separator(spaces_fields, tab_fields):
@@ -227,7 +1445,7 @@ def _choose_separator(spaces_fields, tab_fields):
 # COLUMN TYPE GUESSING CODE #
 # ========================= #
 
-def guess_colspec(otpl_reader):
+def guess_colspec(otpl_reader, sample=None, budget=None):
     """
     Note that for guessing to work, the optionally present global enumeration
     column must be placed *before* the (also optional) local enumeration
@@ -235,62 +1453,395 @@ def guess_colspec(otpl_reader):
 
     If the input file has a colspec header, that header is used instead of any
     guessing.
+    By default, only the segments in the reader's lookahead buffer are used,
+    so the reader's next pass continues on the same input.
+    If a `sample` size is given, the guess is instead made from a random
+    sample of segments from across the whole file (see
+    :func:`sample_segments`), most informative segments first.
 
     :param otpl_reader: a reader instance
     :type otpl_reader: OtplReader
+    :param sample: the number of segments to sample from the whole file
+    :param budget: the maximum number of seconds to spend sampling
     :raises AttributeError: if the reader has an undefined separator property
     :returns: a :class:`ColumnSpecification` or ``None`` if the guessing fails
     """
+    return guess_colspec_with_confidence(otpl_reader, sample, budget,
+                                         scored=False)[0]
+
+
+def guess_colspec_with_confidence(otpl_reader, sample=100, budget=None,
+                                  scored=True):
+    """
+    Guess the colspec as :func:`guess_colspec` does (but from a sample of
+    segments by default), and score each column of the guess.
+
+    A column's confidence is the fraction of the segments used for guessing
+    that, on their own, lead to the same type for that column.
+
+    :param otpl_reader: a reader instance
+    :type otpl_reader: OtplReader
+    :param sample: the number of segments to sample from the whole file (or
+                   ``None`` to only use the lookahead buffer)
+    :param budget: the maximum number of seconds to spend sampling
+    :param scored: if ``False``, the confidence scores are not calculated
+    :raises AttributeError: if the reader has an undefined separator property
+    :returns: a ``(colspec, confidences)`` tuple, where the colspec is a
+              :class:`ColumnSpecification` or ``None`` if the guessing fails
+              and the confidences are a list of floats, one per column
+    """
     try:
-        guess = _make_guess(otpl_reader)
+        segments = list(otpl_reader.lookahead())
+        header = header_colspec(segments[0]) if segments else None
+
+        if header is not None:
+            L.info(u'from header: %s', str(header))
+            return header, [1.0] * header.width
+        elif sample:
+            segments = sorted(
+                sample_segments(otpl_reader, sample, budget),
+                key=_informativeness, reverse=True
+            )
+            guess = _make_guess(segments, rounds=None)
+        else:
+            guess = _make_guess(segments)
     except (IOError, UnicodeDecodeError, DataFormatError) as e:
         L.warning(str(e))
         guess = []
 
-    if isinstance(guess, Spec):
-        L.info(u'from header: %s', str(guess))
-        return guess
-    elif len(guess) < 2:
+    if len(guess) < 2:
         L.warning(u'failed for "%s"', otpl_reader.path)
         L.debug(u'discarded guess was: %s', Spec.to_string(guess))
-        return None
-    else:
-        L.debug(u'as: %s', Spec.to_string(guess))
-        return Spec.from_integers(guess)
+        return None, []
+
+    L.debug(u'as: %s', Spec.to_string(guess))
+    colspec = Spec.from_integers(guess)
+
+    if not scored:
+        return colspec, []
+
+    confidences = _score_guess(guess, segments)
+    L.info(u'confidences: %s', u' '.join(u'%.2f' % c for c in confidences))
+    return colspec, confidences
+
+
+def sample_segments(otpl_reader, size, budget=None, random=None):
+    """
+    Return a random sample of (up to) `size` segments (in file order) from
+    across the whole file of a reader.
+
+    Plain files are sampled using the segment :attr:`OtplReader.index`;
+    compressed files are read in full and reservoir-sampled; for streams,
+    which cannot be read twice, only the lookahead buffer is sampled.
+
+    :param otpl_reader: a reader instance
+    :param size: the sample size
+    :param budget: the maximum number of seconds to spend sampling; when it
+                   is exceeded, the sample collected so far is returned
+    :param random: a :class:`random.Random` instance
+    :raises AttributeError: if the reader has an undefined separator property
+    """
+    random = random or Random()
+    deadline = None if budget is None else monotonic() + budget
+    if otpl_reader.is_stream:
+        L.warning(u'sampling only the lookahead of stream "%s"',
+                  otpl_reader.path)
+        segments = list(otpl_reader.lookahead())
+        return random.sample(segments, min(size, len(segments)))
+    elif not detect_compression(otpl_reader.path):
+        index = otpl_reader.index
+        numbers = sorted(random.sample(range(len(index)),
+                                       min(size, len(index))))
+        segments = []
+
+        for number in numbers:
+            if deadline is not None and monotonic() > deadline:
+                L.info(u'sampling budget exceeded')
+                break
+
+            segments.append(otpl_reader.segment(number))
+
+        return segments
+
+    reservoir = []
+
+    for count, segment in enumerate(otpl_reader):
+        if count < size:
+            reservoir.append((count, segment))
+        else:
+            slot = random.randint(0, count)
+
+            if slot < size:
+                reservoir[slot] = (count, segment)
 
+        if deadline is not None and monotonic() > deadline:
+            L.info(u'sampling budget exceeded after %d segments', count + 1)
+            break
+
+    return [segment for count, segment in sorted(reservoir,
+                                                  key=lambda s: s[0])]
+
+
+def header_colspec(segment):
+    """
+    Return the colspec if the `segment` is a colspec header (see
+    :mod:`otplc.colspec`) or ``None`` otherwise.
+    """
+    # noinspection PyUnresolvedReferences
+    if len(segment) == 1 and all(
+            n is not None and n.split(u':')[0] in Spec.NAMES
+            for n in segment[0]
+    ):
+        return Spec.from_string(' '.join(segment[0]))
+
+    return None
+
+
+def _informativeness(segment):
+    """ The number of cells in a `segment` that are not empty values. """
+    return sum(1 for row in segment for value in row
+               if value not in (None, u'NULL', u'O', u'0'))
+
+
+def _score_guess(guess, segments):
+    """
+    Return the fraction of `segments` that on their own lead to the same
+    column types as the `guess`.
+    """
+    agreements = [0] * len(guess)
+
+    for segment in segments:
+        try:
+            single = Guess(segment).guess
+        except (DataFormatError, AttributeError, ValueError, IndexError):
+            continue
+
+        for col, coltype in enumerate(single[:len(guess)]):
+            if coltype == guess[col]:
+                agreements[col] += 1
 
-def _make_guess(segments):
+    return [count / len(segments) if segments else 0.0
+            for count in agreements]
+
+
+def _make_guess(segments, rounds=5):
+    """
+    Guess the column types from (up to) the first `rounds` + 1 segments (or
+    all, if ``None``), stopping one round after the guess is complete.
+    """
     guess = None
     last_round = False
 
+    if rounds is None:
+        segments = list(segments)
+
     for idx, segment in enumerate(segments):
         if not guess:
-            # noinspection PyUnresolvedReferences
-            if len(segment) == 1 and all(
-                    n.split(u':')[0] in Spec.NAMES for n in segment[0]
-            ):
-                return Spec.from_string(' '.join(segment[0]))
+            header = header_colspec(segment)
+
+            if header is not None:
+                return header
 
             guess = Guess(segment)
+
+            if rounds is None:
+                _profile_all(guess, segments, idx + 1)
+                break
         else:
             guess.update(segment)
 
-        if idx > 4 or last_round:
+        if idx >= rounds or last_round:
             break
         elif guess.complete():
             last_round = True
 
-    return guess.guess
+    return guess.guess if guess else []
+
+
+def _profile_all(guess, segments, start, batch=1024):
+    """ Profile the `segments` after `start` in batches, then classify. """
+    for offset in range(start, len(segments), batch):
+        guess.add(*segments[offset:offset + batch])
+
+    guess.classify()
+
+
+class ColumnProfile(object):
+
+    """
+    Statistics on the values of one column, collected in a single pass over
+    each segment and merged across segments.
+    """
+
+    __slots__ = ('rows', 'digits', 'bioe', 'norms', 'nulls', 'min_int',
+                 'max_int', 'values', 'constant', 'multi_row',
+                 'out_of_segment')
+
+    DISTINCT_LIMIT = 10000
+    "The maximum number of distinct values tracked per column."
+
+    def __init__(self):
+        self.rows = 0  # the number of values seen
+        self.digits = 0  # ... that are integers
+        self.bioe = 0  # ... that are BIOE tags or "O"
+        self.norms = 0  # ... that are normalizations (NS:ID) or NULL
+        self.nulls = 0  # ... that are NULL
+        self.min_int = None  # the smallest integer value
+        self.max_int = None  # the largest integer value
+        self.values = set()  # the distinct values (up to DISTINCT_LIMIT)
+        self.constant = True  # no segment has more than one distinct value
+        self.multi_row = False  # some segment had more than one row
+        # some non-zero integer is larger than its segment's row count:
+        self.out_of_segment = False
+
+    @property
+    def distinct(self):
+        """ The number of distinct values (saturates at the limit). """
+        return len(self.values)
+
+    @property
+    def digit_ratio(self):
+        return self.digits / self.rows if self.rows else 0.0
+
+    @property
+    def bioe_ratio(self):
+        return self.bioe / self.rows if self.rows else 0.0
+
+    @property
+    def norm_ratio(self):
+        return self.norms / self.rows if self.rows else 0.0
+
+    def add(self, values, sizes=None, kinds=None):
+        """
+        Profile the `values` of the column in one or more consecutive
+        segments.
+
+        :param values: a sequence of the column's values
+        :param sizes: the row counts of the segments (default: one segment)
+        :param kinds: a dictionary to memoize the kind of each value (see
+                      :func:`_value_kind`) across columns and segments
+        """
+        if sizes is None:
+            sizes = (len(values),)
+
+        distinct = set(values)
+
+        if None in distinct:  # projected out (see OtplReader.columns)
+            return
+        self.rows += len(values)
+        self.multi_row = self.multi_row or max(sizes) > 1
+
+        if kinds is None:
+            kinds = {}
+
+        for value in distinct.difference(kinds):
+            kinds[value] = _value_kind(value)
+
+        found = list(map(kinds.__getitem__, values))
+
+        for kind in set(found):
+            n = found.count(kind)
+
+            if kind & _DIGITS:
+                self.digits += n
+
+            if kind & _BIOE:
+                self.bioe += n
+
+            if kind & _NORM:
+                self.norms += n
+
+        if u'NULL' in distinct:
+            self.nulls += values.count(u'NULL')
+
+        if self.constant and len(distinct) > 1:
+            self.constant = all(
+                segment.count(segment[0]) == len(segment)
+                for segment in _split(values, sizes) if segment
+            )
+
+        if _DIGITS in found:
+            self._add_numbers(values, sizes, distinct)
+
+        self._merge_values(distinct)
+
+    def _add_numbers(self, values, sizes, distinct):
+        numbers = {v: int(v) for v in distinct if v.isdigit()}
+        high = max(numbers.values())
+        self._merge_range(min(numbers.values()), high)
+
+        if not self.out_of_segment and high > min(sizes):
+            ints = list(map(numbers.get, values, repeat(0, len(values))))
+            self.out_of_segment = any(
+                max(segment) > len(segment)
+                for segment in _split(ints, sizes) if segment
+            )
+
+    def merge(self, other):
+        """ Merge the statistics of an `other` profile into this one. """
+        self.rows += other.rows
+        self.digits += other.digits
+        self.bioe += other.bioe
+        self.norms += other.norms
+        self.nulls += other.nulls
+        self.constant = self.constant and other.constant
+        self.multi_row = self.multi_row or other.multi_row
+        self.out_of_segment = self.out_of_segment or other.out_of_segment
+
+        if other.max_int is not None:
+            self._merge_range(other.min_int, other.max_int)
+
+        self._merge_values(other.values)
+
+    def _merge_range(self, low, high):
+        if self.max_int is None:
+            self.min_int, self.max_int = low, high
+        else:
+            self.min_int = min(self.min_int, low)
+            self.max_int = max(self.max_int, high)
+
+    def _merge_values(self, values):
+        if len(self.values) < ColumnProfile.DISTINCT_LIMIT:
+            self.values.update(values)
+
+
+_DIGITS, _BIOE, _NORM = 1, 2, 4  # value kind flags
+
+
+def _split(values, sizes):
+    """ Yield the consecutive slices of `values` with the given `sizes`. """
+    start = 0
+
+    for size in sizes:
+        yield values[start:start + size]
+        start += size
+
+
+def _value_kind(value):
+    """
+    Return the kind of a column `value`, a combination of flags for
+    integers, BIOE tags (including "O"), and normalizations (including
+    "NULL").
+    """
+    return ((_DIGITS if value.isdigit() else 0) |
+            (_BIOE if value == u'O' or value[:2] in (u'B-', u'I-', u'E-')
+             else 0) |
+            (_NORM if NORM.match(value) is not None else 0))
 
 
 class Guess(object):
 
+    """
+    Guesses the column types from the merged :class:`ColumnProfile` of each
+    column, so the guessing cost grows linearly with the number of segments.
+    """
+
     def __init__(self, segment):
         self.columns = len(segment[0])
         self.guess = [Spec._UNKNOWN] * self.columns
-        self._segment = segment
-        self._analyze()
-        self._assign_annotation_types()
+        self.profiles = [ColumnProfile() for _ in range(self.columns)]
+        self._kinds = {}  # memoized value kinds (see _value_kind)
+        self.update(segment)
 
     def __len__(self):
         return self.columns
@@ -298,35 +1849,44 @@ class Guess(object):
     def complete(self):
         return all(g != Spec._UNKNOWN for g in self.guess)
 
+    def add(self, *segments):
+        """ Profile more `segments` (without updating the guess). """
+        if len(self._kinds) > ColumnProfile.DISTINCT_LIMIT:
+            self._kinds.clear()
+
+        sizes = [len(segment) for segment in segments]
+        rows = chain.from_iterable(segments)
+
+        for profile, values in zip(self.profiles, zip(*rows)):
+            profile.add(values, sizes, self._kinds)
+
     def update(self, segment):
-        self._segment = segment
-        self._analyze()
-        self._assign_annotation_types()
+        """ Profile another `segment` and update the guess. """
+        self.add(segment)
+        self.classify()
 
-    def _analyze(self):
+    def classify(self):
+        """ Guess the column types from the current profiles. """
+        self.guess = [Spec._UNKNOWN] * self.columns
         self.__token_seen = False
 
         for col in range(self.columns):
             self._analyze_column(col)
 
+        self._assign_annotation_types()
+
     def _analyze_column(self, column):
-        if self.guess[column] == Spec._UNKNOWN:
-            if not self.__token_seen:
-                self._guess_id_or_token(column)
-            else:
-                self._guess_annotation_or_reference(column)
-        elif self.guess[column] in (Spec.LOCAL_REF, Spec.GLOBAL_REF):
-            # re-test refs on every round, to be as sure as possible they work
-            self._ensure_reference(column)
+        if not self.__token_seen:
+            self._guess_id_or_token(column)
+        else:
+            self._guess_annotation_or_reference(column)
 
     def _guess_id_or_token(self, column):
-        val = self._segment[0][column]
+        profile = self.profiles[column]
 
-        if all(
-                row[column] == val for row in self._segment
-        ) and len(self._segment) > 1:
+        if profile.constant and profile.multi_row:
             self.guess[column] = Spec.SEGMENT_ID
-        elif all(row[column].isdigit() for row in self._segment):
+        elif profile.digit_ratio == 1.0:
             if column == 0:
                 self.guess[column] = Spec.LOCAL_ENUM
             else:
@@ -378,43 +1938,31 @@ class Guess(object):
 
     def _guess_annotation_or_reference(self, column):
         """ Decide if a tag or reference column. """
-        if all(row[column].isdigit() for row in self._segment):
+        if self.profiles[column].digit_ratio == 1.0:
             self._guess_local_or_global_reference(column)
         else:
             # was not a numeric column, so it must be an annotation
             self.guess[column] = Spec._ANNOTATION
             # NB: annotations will be resolved separately
 
-    def _ensure_reference(self, column):
-        """ Ensure the guessed reference column "still works". """
-        if all(row[column].isdigit() for row in self._segment):
-            self._guess_local_or_global_reference(column)
-        else:
-            self.guess[column] = Spec._UNKNOWN
-
     def _guess_local_or_global_reference(self, column):
-        """ For a known integers-only column, detect its reference scope. """
-        references = {
-            int(row[column]) for row in self._segment if row[column] != u'0'
-        }
-        enums = list(self._iter_columns((Spec.LOCAL_ENUM,)))
-
-        if max(references) > len(self._segment):
+        """
+        For a known integers-only column, detect its reference scope.
+
+        A column is a global reference if some segment has a (non-zero)
+        value larger than its number of rows, and a local reference
+        otherwise.
+        Whether the references are a subset of the values in a local
+        enumeration column is no longer checked: that check fell back to a
+        local reference when they were not, so it never changed the guess,
+        but it required all rows of a segment at once, while the column
+        profiles are merged per column (see :class:`ColumnProfile`).
+        """
+        if self.profiles[column].out_of_segment:
             self.guess[column] = Spec.GLOBAL_REF
         else:
-            for idx, unused in enums:
-                try:
-                    if references.issubset(set([
-                            int(row[idx]) for row in self._segment
-                    ])):
-                        self.guess[column] = Spec.LOCAL_REF
-                        return
-                except ValueError:
-                    self.guess[idx] = Spec._UNKNOWN
-            else:
-                L.info(u'fallback: guess local reference scope for column %s',
-                       column)
-                self.guess[column] = Spec.LOCAL_REF
+            # includes columns without any evidence for either scope
+            self.guess[column] = Spec.LOCAL_REF
 
     def _assign_annotation_types(self):
         for col, guess in enumerate(self.guess):
@@ -434,25 +1982,20 @@ class Guess(object):
         return False
 
     def _guess_tag_or_property(self, column):
-        vals = [row[column] for row in self._segment]
+        profile = self.profiles[column]
         tagged = self._has_a_tag_to_the_left(column)
-        matches_prefix = lambda val: any(
-            val.startswith(pre) for pre in (u'B-', u'E-', u'I-')
-        )
 
-        if tagged and all(
-                NORM.match(v) is not None for v in vals if v != u'NULL'
-        ):
+        if tagged and profile.norm_ratio == 1.0:
             self.guess[column] = Spec.NORMALIZATION
-        elif all(matches_prefix(v) or v == u'O' for v in vals):
+        elif profile.bioe_ratio == 1.0:
             self.guess[column] = Spec.ENTITY
         elif tagged:
             self.guess[column] = Spec.ATTRIBUTE
         elif self.guess[column - 1] == Spec.TOKEN:
             self.guess[column] = Spec.POS_TAG
         else:
-            L.debug(u'no guess (yet?) for column %s with values %s',
-                    column + 1, vals)
+            L.debug(u'no guess (yet?) for column %s with %d distinct values',
+                    column + 1, profile.distinct)
             self.guess[column] = Spec._UNKNOWN
 
     def _guess_event_or_relation(self, column):
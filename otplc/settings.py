@@ -23,6 +23,12 @@ class Configuration(object):
     TEXT_SUFFIX = '.txt'
     "The default text file suffix."
 
+    INDEX_SUFFIX = '.idx'
+    "The suffix appended to OTPL file names for their segment index sidecar."
+
+    CACHE_SUFFIX = '.col'
+    "The suffix appended to OTPL file names for their columnar cache file."
+
     CONFIG = 'annotation.conf'
     "The default name of the brat annotation configuration file."
 
@@ -42,6 +48,14 @@ class Configuration(object):
         self.encoding = Configuration.ENCODING  # char encoding of all files
         self.filter = None  # filter regex (skip matching lines)
         self.colspec = None  # column specification for OTPL files
+        self.guess_sample = None  # segments sampled to guess the colspec
+        self.guess_cache = None  # path of a persistent colspec guess cache
         self.separator = None  # column separator for OTPL files
+        self.mmap = False  # memory-map OTPL files (see MappedOtplReader)
+        self.compact = False  # yield compact Segment instances from readers
+        self.columns = None  # column projection for readers (None: all)
+        self.cache = False  # read OTPL files from their columnar cache
+        self.intern = False  # intern the values of all non-token columns
+        self.jobs = 1  # worker processes converting or validating (0: one per CPU)
         # translations for labels/annotations in the conversion process:
         self.name_labels = None
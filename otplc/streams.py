@@ -0,0 +1,275 @@
+"""
+Transparent reading of plain or compressed files and streams.
+
+Compressed input (gzip, bzip2, or xz/lzma) is detected by the file suffix or,
+failing that, by the magic bytes at the start of the file or stream.
+Compressed input is decompressed in a background thread that feeds a bounded
+queue of line blocks, so decompression overlaps with parsing.
+
+For :mod:`asyncio` applications, :func:`aiterate` turns any of these
+(blocking) iterators into an asynchronous one that reads off the event loop.
+"""
+import asyncio
+import bz2
+import gzip
+import lzma
+from functools import partial
+from io import TextIOBase, TextIOWrapper
+from itertools import islice
+from os.path import splitext
+from queue import Queue, Full
+from threading import Event, Thread
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+SUFFIXES = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.lzma': lzma.open,
+}
+
+MAGIC_BYTES = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
+
+READ_AHEAD = 64
+"The maximum number of line blocks queued by the background reader."
+
+BLOCK_LINES = 1024
+"The number of lines in each block passed on by the background reader."
+
+ASYNC_READ_AHEAD = 4
+"The maximum number of item blocks :func:`aiterate` reads ahead."
+
+ASYNC_BLOCK = 256
+"The number of items :func:`aiterate` reads per executor call."
+
+_END = object()
+
+
+def detect_compression(source):
+    """
+    Return the `open` function for a compressed file path or binary stream,
+    or ``None`` if the `source` is not compressed.
+    """
+    if hasattr(source, 'read'):
+        if isinstance(source, TextIOBase) or not hasattr(source, 'peek'):
+            return None
+
+        return _match_magic(source.peek(6))
+
+    opener = SUFFIXES.get(splitext(source)[1].lower())
+
+    if opener is None:
+        with open(source, 'rb') as stream:
+            opener = _match_magic(stream.read(6))
+
+    return opener
+
+
+def _match_magic(head):
+    for magic, opener in MAGIC_BYTES:
+        if head.startswith(magic):
+            return opener
+
+    return None
+
+
+def iter_lines(source, encoding=None, **open_args):
+    """
+    Yield the lines of a (possibly compressed) file or stream.
+
+    Streams passed in are not closed; binary streams are decoded with the
+    given `encoding`.
+
+    :param source: a file path or a readable (text or binary) stream
+    :param encoding: the character encoding
+    :param open_args: further :func:`open` keyword arguments
+    :raises IOError: if the source cannot be read
+    """
+    if hasattr(source, 'read'):
+        opener = detect_compression(source)
+
+        if opener is not None:
+            with opener(source, 'rt', encoding=encoding, **open_args) as text:
+                yield from read_ahead(text)
+        elif isinstance(source, TextIOBase):
+            # not "yield from", which would close the stream if abandoned
+            for line in source:
+                yield line
+        else:
+            text = TextIOWrapper(source, encoding=encoding, **open_args)
+
+            try:
+                for line in text:
+                    yield line
+            finally:
+                text.detach()
+    else:
+        opener = SUFFIXES.get(splitext(source)[1].lower())
+
+        if opener is not None:
+            with opener(source, 'rt', encoding=encoding, **open_args) as text:
+                yield from read_ahead(text)
+        else:
+            # sniff the magic bytes on the stream that is read
+            with open(source, 'rb') as stream:
+                lines = iter_lines(stream, encoding, **open_args)
+
+                try:
+                    for line in lines:
+                        yield line
+                finally:
+                    lines.close()  # detach before the stream is closed
+
+
+def read_ahead(lines, depth=READ_AHEAD, block=BLOCK_LINES):
+    """
+    Iterate over `lines` in a background thread, reading up to `depth`
+    blocks of `block` lines ahead of the consumer.
+
+    Any exception raised while reading is re-raised in the consumer.
+    """
+    queue = Queue(depth)
+    stop = Event()
+    thread = Thread(target=_produce, args=(lines, queue, stop, block),
+                    daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = queue.get()
+
+            if item is _END:
+                break
+            elif isinstance(item, BaseException):
+                raise item
+
+            yield from item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _produce(lines, queue, stop, block):
+    """ Feed blocks of `lines` into the `queue` until done or stopped. """
+    lines = iter(lines)
+
+    while True:
+        chunk, error = _read_block(lines, block)
+
+        if chunk and not _put(queue, chunk, stop):
+            return
+        elif error is not None or not chunk:
+            _put(queue, _END if error is None else error, stop)
+            return
+
+
+def _read_block(items, block):
+    """
+    Read up to `block` items, returning them together with the exception
+    that stopped the reading early, if any.
+    """
+    chunk = []
+
+    try:
+        chunk.extend(islice(items, block))
+    except BaseException as e:
+        return chunk, e
+
+    return chunk, None
+
+
+def _put(queue, item, stop):
+    """ Put an item into the queue unless the consumer has stopped. """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+
+    return False
+
+
+async def aiterate(iterable, depth=ASYNC_READ_AHEAD, block=ASYNC_BLOCK,
+                   executor=None):
+    """
+    Asynchronously iterate over a blocking `iterable`.
+
+    The items are read in blocks of `block` items by the `executor` (the
+    event loop's default executor if ``None``), so the event loop is never
+    blocked on I/O and no thread is dedicated to any one iterable.
+    Up to `depth` blocks are read ahead of the consumer.
+
+    Any exception raised while reading is re-raised in the consumer.
+    """
+    blocks = aiter_blocks(iterable, depth, block, executor)
+
+    try:
+        async for chunk in blocks:
+            for item in chunk:
+                yield item
+    finally:
+        await blocks.aclose()
+
+
+async def aiter_blocks(iterable, depth=ASYNC_READ_AHEAD, block=ASYNC_BLOCK,
+                       executor=None):
+    """
+    Asynchronously yield lists of (up to) `block` items from an `iterable`,
+    as described for :func:`aiterate`.
+    """
+    loop = asyncio.get_running_loop()
+    items = await loop.run_in_executor(executor, iter, iterable)
+    queue = asyncio.Queue(depth)
+    running = [None]  # the executor call currently reading a block
+    producer = loop.create_task(_aproduce(
+        loop, executor, partial(_read_block, items, block), queue, running
+    ))
+
+    try:
+        while True:
+            item = await queue.get()
+
+            if item is _END:
+                break
+            elif isinstance(item, BaseException):
+                raise item
+
+            yield item
+    finally:
+        producer.cancel()
+
+        try:
+            await producer
+        except asyncio.CancelledError:
+            pass
+
+        if running[0] is not None and not running[0].done():
+            try:
+                # the items must not be closed while still being read
+                await running[0]
+            except Exception:
+                pass
+
+        if hasattr(items, 'close'):
+            items.close()
+
+
+async def _aproduce(loop, executor, fetch, queue, running):
+    """ Feed blocks read by the `executor` into the `queue` until done. """
+    while True:
+        running[0] = loop.run_in_executor(executor, fetch)
+        chunk, error = await asyncio.shield(running[0])
+
+        if chunk:
+            await queue.put(chunk)
+
+        if error is not None or not chunk:
+            await queue.put(_END if error is None else error)
+            return
@@ -0,0 +1,79 @@
+# coding=utf-8
+from io import StringIO
+
+from otplc.aligner import SlidingText, TextAligner
+from otplc.test_base import OtplTestBase
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestAligner(OtplTestBase):
+
+    def align(self, text, tokens, **kwargs):
+        aligner = TextAligner(text, **kwargs)
+        offsets = []
+        start = 0
+
+        for token in tokens:
+            span = aligner.align(token, start)
+
+            if span is None:
+                offsets.append(None)
+            else:
+                offsets.append(text[span[0]:span[1]])
+                start = span[1]
+
+        return offsets, aligner
+
+    def testWhitespace(self):
+        offsets, aligner = self.align(' a  b\n\tc', ['a', 'b', 'c'])
+        self.assertEqual(['a', 'b', 'c'], offsets)
+        self.assertEqual((0, 0), (aligner.skipped, aligner.resynced))
+
+    def testSkippedCharacters(self):
+        self.interceptLogs('otplc.aligner')
+        offsets, aligner = self.align('a, b', ['a', 'b'])
+        self.assertEqual(['a', 'b'], offsets)
+        self.assertEqual(2, aligner.skipped)
+        self.test_log.assertMatches('skipped "%s" before "%s" at %d', args=(', ', 'b', 3))
+
+    def testBoundedWindow(self):
+        text = 'a %s b' % ('x' * 20)
+        self.assertEqual(['a', None], self.align(text, ['a', 'b'], window=10)[0])
+        self.assertEqual(['a', 'b'], self.align(text, ['a', 'b'], window=30)[0])
+
+    def testEscapedTokens(self):
+        text = 'He said “hi (there)” to {me} and/or you.'
+        tokens = ['He', 'said', '``', 'hi', '-LRB-', 'there', '-RRB-', "''", 'to',
+                  '-LCB-', 'me', '-RCB-', 'and\\/or', 'you', '.']
+        offsets, aligner = self.align(text, tokens)
+        self.assertEqual(['He', 'said', '“', 'hi', '(', 'there', ')', '”', 'to',
+                          '{', 'me', '}', 'and/or', 'you', '.'], offsets)
+        self.assertEqual(7, aligner.resynced)
+
+    def testNormalizedTokens(self):
+        text = 'Florianʼs fine co–op'
+        offsets, _ = self.align(text, ['Florian', "'s", 'ﬁne', 'co-op'])
+        self.assertEqual(['Florian', 'ʼs', 'fine', 'co–op'], offsets)
+
+    def testMissingToken(self):
+        offsets, _ = self.align('This is a test.', ['This', 'anti-test', 'is'])
+        self.assertEqual(['This', None, 'is'], offsets)
+
+    def testSlidingText(self):
+        text = 'Ein “Über”-Test für Flöße. ' * 10
+        tokens = ['Ein', '``', 'Über', "''", '-', 'Test', 'für', 'Flöße', '.'] * 10
+        sliding = SlidingText(StringIO(text), chunk=4)
+        aligner = TextAligner(sliding, window=20)
+        expected = self.align(text, tokens, window=20)[0]
+        start = 0
+
+        for token, value in zip(tokens, expected):
+            sliding.discard(start)
+            span = aligner.align(token, start)
+            self.assertEqual(value, sliding[span[0]:span[1]])
+            self.assertEqual(value, text[span[0]:span[1]])
+            start = span[1]
+
+        self.assertLess(sliding.end - sliding.start, 40)
+        self.assertRaises(IndexError, sliding.view, 0, 1)
@@ -1,9 +1,14 @@
 # coding=utf-8
-from io import TextIOWrapper
+import asyncio
+import bz2
+import gzip
+from io import BufferedWriter, BytesIO, TextIOWrapper
 import os
+from tempfile import NamedTemporaryFile
 from mock import MagicMock, patch, sentinel, call
 from unittest import TestCase
-from otplc.brat import Entity, Event, Relation, Attribute, Normalization, Equiv, Note, read, write
+from otplc.brat import Entity, Event, Relation, Attribute, Normalization, Equiv, Note, aread, read, write, \
+    AnnotationWriter
 
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
@@ -163,14 +168,15 @@ class TestRead(TestCase):
     def assertRead(self, expected_anns, string_anns):
         expected_anns = list(reversed(expected_anns))
 
-        with patch('builtins.open', create=True) as open_mock:
-            open_mock.return_value = MagicMock(spec=TextIOWrapper)
-            handle = open_mock.return_value.__enter__.return_value
-            handle.__iter__.return_value = string_anns
+        with patch('otplc.brat.iter_lines') as iter_mock:
+            iter_mock.return_value = iter(string_anns)
 
             for ann in read(sentinel.file_path):
                 self.assertEqual(expected_anns.pop(), ann)
 
+            iter_mock.assert_called_once_with(sentinel.file_path,
+                                              encoding='utf-8')
+
         self.assertEqual(0, len(expected_anns), ', '.join(ann.uid for ann in expected_anns))
 
     def test_normal(self):
@@ -179,23 +185,83 @@ class TestRead(TestCase):
         self.assertRead(cases, raw)
 
 
+class TestReadCompressed(TestCase):
+
+    def setUp(self):
+        self.cases = [Entity('T1', 'name', 0, 4, 'tëxt'), Attribute('A1', 'name', 'T1')]
+        self.data = ''.join('%s\n' % c for c in self.cases).encode('utf-8')
+        self.file = NamedTemporaryFile(suffix='.ann.bz2', delete=False)
+        self.file.close()
+
+    def tearDown(self):
+        os.remove(self.file.name)
+
+    def test_suffix(self):
+        with bz2.open(self.file.name, 'wb') as stream:
+            stream.write(self.data)
+
+        self.assertEqual(self.cases, list(read(self.file.name)))
+
+    def test_async(self):
+        with bz2.open(self.file.name, 'wb') as stream:
+            stream.write(self.data)
+
+        async def collect():
+            return [ann async for ann in aread(self.file.name, block=1)]
+
+        self.assertEqual(self.cases, asyncio.run(collect()))
+
+    def test_magic_bytes(self):
+        with open(self.file.name, 'wb') as stream:
+            stream.write(gzip.compress(self.data))
+
+        with open(self.file.name, 'rb') as stream:
+            self.assertEqual(self.cases, list(read(stream)))
+
+
 class TestWrite(TestCase):
 
-    def assertWrite(self, expected_lines, annotations):
-        file_mock = MagicMock(spec=TextIOWrapper)
-        expected_lines = [(l, os.linesep) for l in expected_lines]
-        expected_lines = [item for pair in expected_lines for item in pair]
+    def assertWrite(self, expected_lines, annotations, mode='wb', spec=BufferedWriter, **kwargs):
+        file_mock = MagicMock(spec=spec)
 
         with patch('builtins.open', create=True) as open_mock:
             open_mock.return_value.__enter__.return_value = file_mock
-            write(sentinel.file_path, annotations)
-
-        for expected, real in zip(expected_lines, file_mock.write.call_args_list):
-            self.assertEqual(call(expected), real)
+            write(sentinel.file_path, annotations, mode, **kwargs)
 
-        self.assertEqual(len(expected_lines), len(file_mock.write.call_args_list))
+        open_mock.assert_called_once_with(sentinel.file_path, mode=mode)
+        self.assertEqual([call(expected) for expected in expected_lines],
+                         file_mock.write.call_args_list)
 
     def test_normal(self):
         cases = [Entity('T1', 'Entity', 0, 3, 'txt'), Attribute('A1', 'Attribute', 'T1')]
-        raw = ['%s' % str(c) for c in cases]
-        self.assertWrite(raw, cases)
+        raw = ''.join('%s%s' % (c, os.linesep) for c in cases).encode('utf-8')
+        self.assertWrite([raw], cases)
+
+    def test_text_mode(self):
+        cases = [Entity('T1', 'Entität', 0, 3, 'txt'), Attribute('A1', 'Attribute', 'T1')]
+        raw = ''.join('%s\n' % c for c in cases)
+        self.assertWrite([raw], cases, 'wt', TextIOWrapper)
+
+    def test_buffer_size(self):
+        cases = [Entity('T%d' % i, 'Entity', 0, 3, 'txt') for i in range(1, 4)]
+        raw = [('%s%s' % (c, os.linesep)).encode('utf-8') for c in cases]
+        self.assertWrite([raw[0] + raw[1], raw[2]], cases, buffer_size=2)
+
+    def test_writer_flushes_when_full(self):
+        cases = [Entity('T%d' % i, 'Entity', 0, 3, 'txt') for i in range(1, 4)]
+        raw = [('%s%s' % (c, os.linesep)).encode('utf-8') for c in cases]
+        stream = BytesIO()
+
+        with AnnotationWriter(stream, buffer_size=2) as writer:
+            for annotation in cases:
+                writer.write(annotation)
+
+            self.assertEqual(raw[0] + raw[1], stream.getvalue())
+
+        self.assertEqual(b''.join(raw), stream.getvalue())
+
+    def test_nothing(self):
+        with patch('builtins.open', create=True) as open_mock:
+            write(sentinel.file_path, [])
+
+        self.assertFalse(open_mock.called)
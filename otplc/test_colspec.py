@@ -1,4 +1,5 @@
 # coding=utf-8
+import pickle
 from otplc.colspec import ColumnSpecification as C
 from otplc.test_base import OtplTestBase
 
@@ -35,6 +36,17 @@ class TestColspec(OtplTestBase):
         self.assertEqual({12: 10}, converter._normalizations)  # important: norm of event!
         self.assertEqual({11: 10}, converter._attributes)
 
+    def testGetTarget(self):
+        colspec = C.from_string('TOKEN ENTITY LOCAL_REF RELATION ATTRIBUTE NORMALIZATION')
+        self.assertEqual((None, None, 1, 1, 3, 3),
+                         tuple(colspec.get_target(col) for col in range(colspec.width)))
+
+    def testUsedColumns(self):
+        colspec = C.from_string('SEGMENT_ID LOCAL_ENUM TOKEN SEGMENT_ID POS_TAG LOCAL_REF RELATION')
+        self.assertEqual(7, colspec.width)
+        self.assertEqual((1, 2, 4, 5, 6), colspec.get_used_columns())
+        self.assertEqual((0, 1, 3, 4, 5, 6), colspec.get_non_token_columns())
+
     def testUndefinedColumn(self):
         colspec = [1, 2, 3, 4, 50]
         self.assertRaisesRegexp(ValueError, u'unknown _TYPE_ \(50\) column 5',
@@ -83,3 +95,26 @@ class TestColspec(OtplTestBase):
         colspec = [C.TOKEN, C.NORMALIZATION]
         self.assertRaisesRegexp(ValueError, u'NORMALIZATION column 2 with no target',
                                 C.from_integers, colspec)
+
+    def testImmutableAndHashable(self):
+        header = 'SEGMENT_ID TOKEN ENTITY ENTITY LOCAL_REF:4 LOCAL_REF:7 EVENT'
+        colspec = C.from_string(header)
+        self.assertEqual(header, colspec.header)
+        self.assertEqual('SEGMENT_ID TOKEN ENTITY ENTITY LOCAL_REF LOCAL_REF EVENT', str(colspec))
+        self.assertEqual((C.SEGMENT_ID, C.TOKEN, C.ENTITY, C.ENTITY, C.LOCAL_REF, C.LOCAL_REF,
+                          C.EVENT), colspec.get_types())
+        self.assertEqual(3, colspec.get_reference_target(4))
+        self.assertRaises(AttributeError, setattr, colspec, '_token', 0)
+        self.assertRaises(AttributeError, colspec._set_column, 'pos_tag', 2)
+        same = C.from_string(header)
+        self.assertEqual(hash(colspec), hash(same))
+        self.assertEqual({colspec: 2}, {colspec: 1, same: 2})
+        self.assertNotEqual(colspec, C.from_string(header.replace(':7', '')))
+        self.assertEqual(colspec, pickle.loads(pickle.dumps(colspec)))
+
+    def testUnknownColumnString(self):
+        colspec = C.from_integers([C.GLOBAL_ENUM, C._UNKNOWN, C.TOKEN])
+        self.assertEqual('GLOBAL_ENUM', str(colspec))
+        self.assertEqual('GLOBAL_ENUM _UNKNOWN TOKEN', colspec.header)
+        self.assertEqual(None, colspec.get_type(1))
+        self.assertEqual(None, colspec.get_type(3))
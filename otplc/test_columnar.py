@@ -0,0 +1,91 @@
+# coding=utf-8
+import os
+from mock import patch
+from otplc import ColumnSpecification, Configuration, configure_reader
+from otplc.columnar import ColumnarCache, ColumnarOtplReader, cache_path_for
+from otplc.reader import Segment
+from otplc.test_base import OtplTestBase
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestColumnar(OtplTestBase):
+
+    def setUp(self):
+        super(TestColumnar, self).setUp()
+        self.otpl_file.write(u"1\ttök\tNN\t2\n2\ttok\tNN\t0\n\n3\tx\tVB\t007\n")
+        self.otpl_file.close()
+        self.config = Configuration([__file__])
+        self.config.colspec = ColumnSpecification.from_string(
+            'GLOBAL_ENUM TOKEN POS_TAG GLOBAL_REF'
+        )
+        self.expected = [[[u'1', u'tök', u'NN', u'2'], [u'2', u'tok', u'NN', u'0']],
+                         [[u'3', u'x', u'VB', u'007']]]
+
+    def tearDown(self):
+        super(TestColumnar, self).tearDown()
+
+        if os.path.exists(cache_path_for(self.otpl_file.name)):
+            os.remove(cache_path_for(self.otpl_file.name))
+
+    def configure(self):
+        return configure_reader(self.otpl_file.name, self.config)
+
+    def testCachedSegments(self):
+        self.config.cache = True
+        segments = self.configure()
+        self.assertIsInstance(segments, ColumnarOtplReader)
+        self.assertEqual(self.expected, list(segments))
+        self.assertEqual(self.expected, list(segments))
+        self.assertTrue(segments.is_valid(self.config.colspec))
+        self.assertFalse(segments.is_valid(ColumnSpecification.from_string(
+            'LOCAL_ENUM TOKEN POS_TAG LOCAL_REF'
+        )))
+        self.assertFalse(segments.is_valid(ColumnSpecification.from_string(
+            'GLOBAL_ENUM TOKEN POS_TAG GLOBAL_REF:3'
+        )))
+
+    def testProjectionAndCompactSegments(self):
+        self.config.cache = True
+        self.config.compact = True
+        self.config.columns = (1, 2)
+        result = list(self.configure())
+        self.assertIsInstance(result[0], Segment)
+        self.assertEqual([[None, u'tök', u'NN', None], [None, u'tok', u'NN', None]], result[0])
+
+    def testBuildLeavesReader(self):
+        self.config.columns = (1,)
+        segments = self.configure()
+        cache = ColumnarCache.build(segments, self.config.colspec)
+        self.assertEqual(4, len(cache.columns))
+        self.assertEqual((1,), segments.columns)
+        self.assertEqual([None, u'tök', None, None], next(iter(segments))[0])
+
+    def testStaleCache(self):
+        self.config.cache = True
+        segments = self.configure()
+        os.utime(self.otpl_file.name, ns=(0, 0))
+        self.assertTrue(segments.is_valid())
+
+        with patch('otplc.columnar.checksum') as checksum_mock:
+            self.assertTrue(segments.is_valid())
+            self.assertFalse(checksum_mock.called)
+
+        with open(self.otpl_file.name, 'a') as stream:
+            stream.write(u"4\ty\tVB\t0\n")
+
+        self.assertFalse(segments.is_valid())
+        self.assertEqual(2, len(list(self.configure())[1]))
+
+    def testHeaderWithoutVocabularies(self):
+        self.config.cache = True
+        segments = self.configure()
+
+        with patch('otplc.columnar.json.loads', return_value={
+            'separator': segments.separator, 'filter': segments.filter
+        }) as loads_mock:
+            self.assertTrue(segments.is_valid())
+
+        raw = loads_mock.call_args[0][0]
+        self.assertIn(u'separator', raw)
+        self.assertNotIn(u'tök', raw)
@@ -1,9 +1,12 @@
 # coding=utf-8
 import logging
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from os import remove
-from otplc import guess_colspec, configure_reader, Configuration
-from otplc.converter import OtplBratConverter
+from os.path import join
+from mock import patch
+from otplc import guess_colspec, configure_reader, ColumnSpecification, Configuration
+from otplc.converter import IncrementalConverter, OtplBratConverter, Reference, compile_plan, \
+    otpl_to_brat, plan_conversion
 from otplc.test_base import OtplTestBase
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
@@ -17,6 +20,40 @@ class TestConverter(OtplTestBase):
         config.separator = r'\s+'
         self.segments = configure_reader(self.otpl_file.name, config)
 
+    def makeCorpus(self, texts, otpl):
+        """
+        Write a text file for each name in `texts` and an OTPL file for each
+        name in `otpl` to a temporary directory (removed after the test),
+        returning the directory and the text file paths (sorted by name).
+        """
+        corpus = TemporaryDirectory()
+        self.addCleanup(corpus.cleanup)
+        text_files = []
+
+        for name, text in sorted(texts.items()):
+            text_files.append(join(corpus.name, name + Configuration.TEXT_SUFFIX))
+            self.writeFile(text_files[-1], text)
+
+        for name, content in otpl.items():
+            self.writeFile(join(corpus.name, name + Configuration.OTPL_SUFFIX), content)
+
+        return corpus.name, text_files
+
+    @staticmethod
+    def writeFile(path, content):
+        with open(path, 'w') as stream:
+            print(content, file=stream)
+
+    @staticmethod
+    def readFile(path):
+        with open(path) as stream:
+            return stream.read()
+
+    @staticmethod
+    def readLines(path):
+        with open(path) as stream:
+            return [line.rstrip('\r\n') for line in stream]
+
     def testDefault(self):
         logging.getLogger().addHandler(logging.StreamHandler())  # might spam your console...
         self.interceptLogs('otplc.converter')
@@ -64,6 +101,172 @@ class TestConverter(OtplTestBase):
             line = line.strip('\r\n')
             self.assertEqual(expected[lno], line)
 
+    def testIncrementalConversion(self):
+        self.text_file.write('This is a test.')
+        self.text_file.flush()
+        self.otpl_file.write("This DT B-NP\nis VBZ O\n\n")
+        self.otpl_file.flush()
+        self.brat_file.close()
+        converter = IncrementalConverter()
+        converter.set_colspec(guess_colspec(self.segments))
+        follow = lambda: list(self.segments.follow(interval=0.01, timeout=0))
+        self.assertTrue(converter.append(follow(), self.text_file.name, self.brat_file.name))
+        self.text_file.write(' Another ')
+        self.text_file.close()
+        self.otpl_file.write("a DT B-NP\ntest NN E-NP\n. DOT O\n\nAnother DT O\n")
+        self.otpl_file.close()
+        self.assertTrue(converter.append(follow(), self.text_file.name, self.brat_file.name))
+        self.assertEqual([
+            "T1\tDT 0 4\tThis", "T2\tVBZ 5 7\tis", "T3\tNP 0 4\tThis",
+            "T4\tDT 8 9\ta", "T5\tNN 10 14\ttest", "T6\tDOT 14 15\t.", "T7\tNP 8 14\ta test",
+        ], self.readLines(self.brat_file.name))
+
+    def testConversionPlan(self):
+        C = ColumnSpecification
+        colspec = C.from_string('TOKEN ENTITY NORMALIZATION LOCAL_REF RELATION '
+                                'GLOBAL_REF LOCAL_REF EVENT')
+        plan = compile_plan(colspec)
+        self.assertIs(plan, compile_plan(C.from_string(str(colspec))))
+        self.assertEqual((1,), plan.entities)
+        self.assertEqual([(C.RELATION, 4, 1), (C.EVENT, 7, None), (C.NORMALIZATION, 2, 1)],
+                         [(op.kind, op.column, op.target) for op in plan])
+        self.assertEqual((Reference(5, 1, True, C.ENTITY), Reference(6, 1, False, C.ENTITY)),
+                         plan.operations[1].references)
+        self.assertEqual('token column 1\n'
+                         'ENTITY column 2\n'
+                         'RELATION column 5, on column 2, local ref column 4 -> 2\n'
+                         'EVENT column 8, global ref column 6 -> 2, local ref column 7 -> 2\n'
+                         'NORMALIZATION column 3, on column 2', str(plan))
+        self.assertEqual(('_make_relation', '_make_event', '_make_normalization'),
+                         plan.makers)
+        converter = OtplBratConverter()
+        converter.set_colspec(colspec)
+        self.assertIs(plan, converter.plan)
+
+    def testHeterogeneousCorpus(self):
+        self.interceptLogs('otplc.converter')
+        corpus, text_files = self.makeCorpus({'a': 'This is', 'b': 'This is', 'c': 'It is'}, {
+            'a': "This DT B-NP\nis VBZ O\n\n",
+            'b': "1 This DT B-NP\n2 is VBZ O\n\n",
+            'c': "It PRP B-NP\nis VBZ O\n\n",
+        })
+        config = Configuration(text_files)
+        groups, errors = plan_conversion(config)
+        self.assertEqual(0, errors)
+        self.assertEqual([('TOKEN POS_TAG ENTITY', [text_files[0], text_files[2]]),
+                          ('LOCAL_ENUM TOKEN POS_TAG ENTITY', [text_files[1]])],
+                         [(str(colspec), files) for colspec, files in groups])
+        self.test_log.assertMatches('group %d: %d file%s with colspec "%s"', count=2)
+        self.assertEqual(0, otpl_to_brat(config))
+        self.assertEqual(["T1\tPRP 0 2\tIt", "T2\tVBZ 3 5\tis", "T3\tNP 0 2\tIt"],
+                         self.readLines(join(corpus, 'c.ann')))
+        self.assertEqual(["T1\tDT 0 4\tThis", "T2\tVBZ 5 7\tis", "T3\tNP 0 4\tThis"],
+                         self.readLines(join(corpus, 'b.ann')))
+
+    def testProjectionWithoutColspec(self):
+        corpus, text_files = self.makeCorpus({'a': 'This is'},
+                                             {'a': "s1 This DT B-NP\ns1 is VBZ O\n\n"})
+        config = Configuration(text_files)
+        config.columns = [1, 2, 3]
+        self.assertEqual(0, otpl_to_brat(config))
+        self.assertEqual(["T1\tDT 0 4\tThis", "T2\tVBZ 5 7\tis", "T3\tNP 0 4\tThis"],
+                         self.readLines(join(corpus, 'a.ann')))
+
+    def testOtplFilesOpenedOnce(self):
+        otpl = "This DT B-NP\nis VBZ O\n"
+        corpus, text_files = self.makeCorpus({'a': 'This is', 'b': 'This is'},
+                                             {'a': otpl, 'b': otpl})
+
+        with patch('builtins.open', wraps=open) as open_mock:
+            self.assertEqual(0, otpl_to_brat(Configuration(text_files)))
+
+        opened = [args[0] for args, _ in open_mock.call_args_list
+                  if str(args[0]).endswith(Configuration.OTPL_SUFFIX)]
+        self.assertEqual(sorted(opened), sorted(set(opened)))
+        self.assertEqual(2, len(opened))
+
+    def testParallelMissingOtplFile(self):
+        self.interceptLogs('otplc.converter')
+        otpl = "This DT B-NP\nis VBZ O\n"
+        corpus, text_files = self.makeCorpus({'a': 'This is', 'b': 'This is', 'c': 'This is'},
+                                             {'a': otpl, 'c': otpl})
+        config = Configuration(text_files)
+        config.jobs = 3
+        self.assertEqual(1, otpl_to_brat(config))
+        self.test_log.assertMatches('could not locate OTPL file "%s" for "%s"', count=1)
+
+    def testParallelConversion(self):
+        corpus, text_files = self.makeCorpus({
+            'a': 'This is', 'b': 'This is', 'c': 'It is', 'd': 'It was',
+        }, {
+            'a': "This DT B-NP\nis VBZ O\n\n",
+            'b': "1 This DT B-NP\n2 is VBZ B-VP\n\n",
+            'c': "It PRP B-NP\nis VBZ O\n\n",
+            'd': "It PRP B-NP\nis VBZ O\n",  # a missing token
+        })
+        config_file = join(corpus, Configuration.CONFIG)
+        config = Configuration(text_files)
+        config.jobs = 2
+        self.assertEqual(1, otpl_to_brat(config))
+        self.assertEqual(["T1\tPRP 0 2\tIt", "T2\tVBZ 3 5\tis", "T3\tNP 0 2\tIt"],
+                         self.readLines(join(corpus, 'c.ann')))
+
+        config.input_files = text_files[:3]
+        self.assertEqual(0, otpl_to_brat(config))
+        parallel = self.readFile(config_file)
+        remove(config_file)
+        config.jobs = 1
+        self.assertEqual(0, otpl_to_brat(config))
+        self.assertEqual(self.readFile(config_file), parallel)
+        remove(config_file)
+        config.jobs = 0  # one per CPU
+        self.assertEqual(0, otpl_to_brat(config))
+        self.assertEqual(self.readFile(config_file), parallel)
+        self.assertIn('\nVP\n', parallel)
+
+    def testParallelSchemaInInputOrder(self):
+        colspec = 'LOCAL_ENUM TOKEN ENTITY LOCAL_REF LOCAL_REF EVENT'
+        headers = {'a': colspec, 'b': 'SEGMENT_ID ' + colspec, 'c': colspec}
+        corpus, text_files = self.makeCorpus(dict.fromkeys(headers, 'It binds'), {
+            'a': "1 It B-NP 0 0 NULL\n2 binds O 0 0 NULL\n\n",
+            'b': "s 1 It B-NP 0 0 NULL\ns 2 binds B-VB 2 1 bind\n\n",
+            'c': "1 It B-NP 0 0 NULL\n2 binds B-VB 2 1 bind\n\n",
+        })
+        colspecs = {text_file: ColumnSpecification.from_string(headers[name])
+                    for name, text_file in zip(sorted(headers), text_files)}
+        plan = lambda files, _: ((f, colspecs[f], None) for f in files)
+        config_file = join(corpus, Configuration.CONFIG)
+        config = Configuration(text_files)
+        config.separator = r'\s+'
+
+        with patch('otplc.converter._plan_files', side_effect=plan):
+            config.jobs = 2
+            self.assertEqual(0, otpl_to_brat(config))
+            parallel = self.readFile(config_file)
+            remove(config_file)
+            config.jobs = 1
+            self.assertEqual(0, otpl_to_brat(config))
+
+        self.assertEqual(self.readFile(config_file), parallel)
+        self.assertIn('bind\tCol6:', parallel)
+
+    def testMergeSchema(self):
+        converter = OtplBratConverter()
+        converter._entities['NP'] = None
+        converter._relations['nn'][0].add('NP')
+        converter._events['bind'] = [(3, True, {'NP'})]
+        other = OtplBratConverter()
+        other._entities['VP'] = None
+        other._relations['nn'][1].add('VP')
+        other._events['bind'] = [(5, False, {'VP'})]
+        other._normalizations.add('db')
+        converter.merge_schema(other.get_schema())
+        schema = converter.get_schema()
+        self.assertEqual(['NP', 'VP'], schema.entities)
+        self.assertEqual({'nn': ({'NP'}, {'VP'})}, schema.relations)
+        self.assertEqual({'bind': [(3, False, {'NP', 'VP'})]}, schema.events)
+        self.assertEqual({'db'}, schema.normalizations)
+
     def testUnmatchedTokens(self):
         self.interceptLogs('otplc.converter')
         self.text_file.write('This is Florianʼs weird test.')
@@ -89,6 +292,59 @@ class TestConverter(OtplTestBase):
             args=('token "anti-test" from line 6 not found at " test." (23)',)
         )
 
+    def testForwardGlobalReferences(self):
+        self.text_file.write('Mary met John. He smiled.')
+        self.text_file.close()
+        self.otpl_file.write(
+            "1 Mary   B-PER 5 coref\n"
+            "2 met    O     0 NULL\n"
+            "3 John   B-PER 0 NULL\n"
+            "4 .      O     0 NULL\n\n"
+            "5 He     B-PER 3 coref\n"
+            "6 smiled O     0 NULL\n"
+            "7 .      O     0 NULL\n\n"
+        )
+        self.otpl_file.close()
+        self.brat_file.close()
+        converter = OtplBratConverter()
+        converter.set_colspec(ColumnSpecification.from_string(
+            'GLOBAL_ENUM TOKEN ENTITY GLOBAL_REF RELATION'
+        ))
+        self.assertTrue(converter.convert(
+            self.segments, self.text_file.name, self.brat_file.name
+        ))
+        lines = self.readLines(self.brat_file.name)
+        self.assertEqual([
+            "T1	PER 0 4	Mary",
+            "T2	PER 9 13	John",
+            "T3	PER 15 17	He",
+            "R1	coref Arg1:T1 Arg2:T3",
+            "R2	coref Arg1:T3 Arg2:T2",
+        ], lines)
+
+    def testUnresolvedGlobalReferences(self):
+        self.interceptLogs('otplc.converter')
+        self.text_file.write('Mary smiled.')
+        self.text_file.close()
+        self.otpl_file.write(
+            "1 Mary   B-PER 9 coref\n"
+            "2 smiled O     0 NULL\n"
+            "3 .      O     0 NULL\n\n"
+        )
+        self.otpl_file.close()
+        self.brat_file.close()
+        converter = OtplBratConverter()
+        converter.set_colspec(ColumnSpecification.from_string(
+            'GLOBAL_ENUM TOKEN ENTITY GLOBAL_REF RELATION'
+        ))
+        self.assertFalse(converter.convert(
+            self.segments, self.text_file.name, self.brat_file.name
+        ))
+        self.test_log.assertMatches(
+            'failed - %s', levelname='WARNING',
+            args=('1 unresolved global reference, e.g., 4->3 with number 9',)
+        )
+
     def testMissingColspec(self):
         self.interceptLogs('otplc.converter')
         self.text_file.close()
@@ -0,0 +1,47 @@
+# coding=utf-8
+import os
+from otplc.index import SegmentIndex, index_path_for, load_or_build_index
+from otplc.test_base import OtplTestBase
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestSegmentIndex(OtplTestBase):
+
+    def setUp(self):
+        super(TestSegmentIndex, self).setUp()
+        self.index_file = index_path_for(self.otpl_file.name)
+
+    def tearDown(self):
+        if os.path.exists(self.index_file):
+            os.remove(self.index_file)
+
+        super(TestSegmentIndex, self).tearDown()
+
+    def testBuild(self):
+        self.otpl_file.write(u"% a\nä b\r\nc d\n\n\n% e\n\nf g\n% h\n\n% i\nj k\n")
+        self.otpl_file.close()
+        index = SegmentIndex.build(self.otpl_file.name, u'^%')
+        self.assertEqual([4, 21, 34], list(index.offsets))
+        self.assertEqual([2, 8, 12], list(index.lines))
+        self.assertEqual((21, 8), index[1])
+
+    def testStoreAndInvalidate(self):
+        self.otpl_file.write(u"a b\n\nc d\n")
+        self.otpl_file.close()
+        index = load_or_build_index(self.otpl_file.name)
+        self.assertTrue(os.path.exists(self.index_file))
+        loaded = SegmentIndex.load(self.index_file, self.otpl_file.name)
+        self.assertEqual(list(index.offsets), list(loaded.offsets))
+        self.assertEqual(list(index.lines), list(loaded.lines))
+        self.assertIsNone(SegmentIndex.load(self.index_file, self.otpl_file.name, u'^%'))
+        self.assertIsNotNone(SegmentIndex.load(self.index_file, self.otpl_file.name,
+                                               encoding='utf8'))
+        self.assertIsNone(SegmentIndex.load(self.index_file, self.otpl_file.name,
+                                            encoding='latin-1'))
+
+        with open(self.otpl_file.name, 'a') as stream:
+            stream.write(u"\ne f\n")
+
+        self.assertIsNone(SegmentIndex.load(self.index_file, self.otpl_file.name))
+        self.assertEqual(3, len(load_or_build_index(self.otpl_file.name)))
@@ -0,0 +1,114 @@
+# coding=utf-8
+from os import remove
+from os.path import exists
+from tempfile import NamedTemporaryFile
+
+from otplc import ColumnSpecification, Configuration, configure_reader
+from otplc.layouts import LayoutCache, column_kinds, fits, signature
+from otplc.test_base import OtplTestBase
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestLayouts(OtplTestBase):
+
+    def setUp(self):
+        super(TestLayouts, self).setUp()
+        self.config = Configuration([__file__])
+        self.config.separator = r'\s+'
+        self.cache_path = '%s.json' % self.otpl_file.name
+        self.other = NamedTemporaryFile(suffix=Configuration.OTPL_SUFFIX, mode='w+t', delete=False,
+                                        encoding=Configuration.ENCODING)
+        self.otpl_file.write(
+            u"1 This    DT  B-NP\n"
+            u"2 is      VBZ B-VP\n"
+            u"3 a       DT  B-NP\n"
+            u"4 test    NN  E-NP\n"
+            u"\n"
+            u"1 Yes     UH  O\n"
+        )
+        self.otpl_file.close()
+
+    def tearDown(self):
+        super(TestLayouts, self).tearDown()
+        self.other.close()
+        remove(self.other.name)
+
+        if exists(self.cache_path):
+            remove(self.cache_path)
+
+    def reader(self, path):
+        return configure_reader(path, self.config)
+
+    def testColumnKinds(self):
+        segments = [[['1', 'a', 'O', 'NULL', 'db:1'], ['2', 'b', 'B-X', 'NULL', 'NULL']]]
+        self.assertEqual('nse?k', column_kinds(segments))
+        projected = [[[None, 'a', 'O', None, 'db:1'], [None, 'b', 'B-X', None, 'NULL']]]
+        self.assertEqual('?se?k', column_kinds(projected))
+
+    def testSignatureOfSameLayout(self):
+        self.other.write(u"1 Another DT B-NP\n2 one NN E-NP\n")
+        self.other.close()
+        sig = signature(self.reader(self.otpl_file.name))
+        self.assertTrue(sig.startswith('4/\\s+/'))
+        self.assertEqual(sig, signature(self.reader(self.other.name)))
+
+    def testSignatureOfOtherLayout(self):
+        self.other.write(u"Another DT B-NP 1\none NN E-NP 1\n")
+        self.other.close()
+        self.assertNotEqual(signature(self.reader(self.otpl_file.name)),
+                            signature(self.reader(self.other.name)))
+
+    def testFits(self):
+        segments = self.reader(self.otpl_file.name)
+        self.assertTrue(fits(segments, ColumnSpecification.from_string(
+            'SEGMENT_ID TOKEN POS_TAG ENTITY'
+        )))
+        self.assertFalse(fits(segments, ColumnSpecification.from_string(
+            'SEGMENT_ID TOKEN ENTITY POS_TAG'
+        )))
+        self.assertFalse(fits(segments, ColumnSpecification.from_string(
+            'SEGMENT_ID TOKEN POS_TAG'
+        )))
+
+    def testCachedGuess(self):
+        self.other.write(u"1 Another DT B-NP\n2 one NN E-NP\n")
+        self.other.close()
+        layouts = LayoutCache(self.cache_path)
+        colspec = layouts.colspec_for(self.reader(self.otpl_file.name))
+        self.assertEqual('LOCAL_ENUM TOKEN POS_TAG ENTITY', str(colspec))
+        layouts.save()
+
+        layouts = LayoutCache(self.cache_path)
+        self.assertEqual(1, len(layouts))
+        guesses = []
+
+        def guess(reader):
+            guesses.append(reader)
+
+        self.assertEqual(colspec, layouts.colspec_for(self.reader(self.other.name), guess))
+        self.assertEqual([], guesses)
+        self.assertEqual((1, 0), (layouts.hits, layouts.misses))
+
+    def testMismatchedCachedColspec(self):
+        self.interceptLogs('otplc.layouts')
+        segments = self.reader(self.otpl_file.name)
+        layouts = LayoutCache(self.cache_path)
+        layouts.put(signature(segments), ColumnSpecification.from_string(
+            'SEGMENT_ID TOKEN ENTITY POS_TAG'
+        ))
+        colspec = layouts.colspec_for(segments)
+        self.assertEqual('LOCAL_ENUM TOKEN POS_TAG ENTITY', str(colspec))
+        self.assertEqual(colspec, layouts.get(signature(segments)))
+        self.test_log.assertMatches('cached colspec for %s does not fit - guessing',
+                                    levelname='WARNING')
+
+    def testUnreadableCacheFile(self):
+        self.interceptLogs('otplc.layouts')
+
+        with open(self.cache_path, 'w') as out:
+            out.write('not json')
+
+        self.assertEqual(0, len(LayoutCache(self.cache_path)))
+        self.test_log.assertMatches('ignoring unreadable colspec cache "%s": %s',
+                                    levelname='WARNING')
@@ -1,6 +1,14 @@
 # coding=utf-8
+import asyncio
+import lzma
+import os
+from io import StringIO
+from threading import Timer
 from otplc import ColumnSpecification, Configuration
-from otplc.reader import SPACES, TAB, DataFormatError, configure_reader, guess_colspec
+from otplc.index import index_path_for
+from otplc.reader import SPACES, TAB, ColumnProfile, DataFormatError, MappedOtplReader, \
+    OtplReader, ParallelOtplReader, Segment, configure_reader, guess_colspec, \
+    guess_colspec_with_confidence
 from otplc.test_base import OtplTestBase
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
@@ -14,6 +22,13 @@ class TestReader(OtplTestBase):
         config.separator = r'\s+'
         self.segments = configure_reader(self.otpl_file.name, config)
 
+    def tearDown(self):
+        super(TestReader, self).tearDown()
+        index_file = index_path_for(self.otpl_file.name)
+
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
     def testVariableColumnNumbers(self):
         self.otpl_file.write(u"1\t2\t3\n1\t2\n")
         self.otpl_file.close()
@@ -40,6 +55,284 @@ class TestReader(OtplTestBase):
         for expected, actual in zip(expected_segments, actual_segments):
             self.assertListEqual(expected, actual)
 
+    def testSinglePassOverStream(self):
+        stream = StringIO(u"tok1\tpos1\ttag1\ntok2\tpos2\ttag2\n\n"
+                          u"tok3\tpos3\ttag3\n\ntok4\tpos4\ttag4\n")
+        segments = OtplReader(stream)
+        self.assertTrue(segments.detect_separator())
+        self.assertEqual(TAB.pattern, segments.separator)
+        self.assertEqual(u'TOKEN POS_TAG ATTRIBUTE', str(guess_colspec(segments)))
+        self.assertEqual([u'tok1', u'tok3', u'tok4'], [s[0][0] for s in segments])
+        self.assertRaises(IOError, list, segments)
+
+    def testLookaheadIsBounded(self):
+        self.otpl_file.write(u"1 a\n2 b\n\n3 c\n\n4 d\n5 e\n\n6 f\n\n")
+        self.otpl_file.close()
+        self.segments.LOOKAHEAD_SEGMENTS = 2
+        self.assertEqual(2, len(list(self.segments.lookahead())))
+        self.assertEqual(4, len(list(self.segments)))
+        segments = OtplReader(self.otpl_file.name)
+        segments.separator = SPACES.pattern
+        segments.LOOKAHEAD_LINES = 7
+        self.assertEqual(2, len(list(segments.lookahead())))
+        self.assertEqual(4, len(list(segments)))
+
+    def testLookaheadKeepsLongSegment(self):
+        lines = OtplReader.LOOKAHEAD_LINES + 1
+        self.otpl_file.write(u"tok%d NN\n" * lines % tuple(range(lines)))
+        self.otpl_file.write(u"\nlast NN\n")
+        self.otpl_file.close()
+        lookahead = list(self.segments.lookahead())
+        self.assertEqual(1, len(lookahead))
+        self.assertEqual(lines, len(lookahead[0]))
+        self.assertIsNotNone(guess_colspec(self.segments))
+        self.assertEqual(2, len(list(self.segments)))
+
+    def testRandomAccess(self):
+        self.otpl_file.write(u"1 a\n2 b\n\n3 c\n\n\n4 d\n5\n\n6 f\n")
+        self.otpl_file.close()
+        self.assertEqual([[u'3', u'c']], self.segments.segment(1))
+        self.assertEqual([[[u'6', u'f']]], list(self.segments.slice(3)))
+        self.assertRaises(IndexError, self.segments.segment, 4)
+        self.assertRaisesRegexp(DataFormatError, u'line 8 has 1 columns, but expected 2',
+                                list, self.segments.slice(2, 3))
+
+    def testParallelReading(self):
+        self.otpl_file.write(u"".join(u"%d a%d\r\nb c\n\n\n" % (i, i) for i in range(50)))
+        self.otpl_file.close()
+        segments = ParallelOtplReader(self.otpl_file.name, jobs=2, chunk_size=16)
+        segments.separator = SPACES.pattern
+        self.assertEqual(list(self.segments), list(segments))
+
+    def testParallelVariableColumnNumbers(self):
+        self.otpl_file.write(u"a b\n\n% c\n\nd e\n\nf g\n\n% h\n\ni j k\n\n")
+        self.otpl_file.close()
+        segments = ParallelOtplReader(self.otpl_file.name, jobs=2, chunk_size=4)
+        segments.separator = SPACES.pattern
+        segments.filter = u'^%'
+        self.assertRaisesRegexp(DataFormatError, u'line 11 has 3 columns, but expected 2',
+                                list, segments)
+        self.otpl_file = open(self.otpl_file.name, 'w')
+        self.otpl_file.write(u"a b\n\nd e\n\nf g\nh i j\n")
+        self.otpl_file.close()
+        self.assertRaisesRegexp(DataFormatError, u'line 6 has 3 columns, but expected 2',
+                                list, segments)
+
+    def testParallelSegmentsBeforeError(self):
+        self.otpl_file.write(u"a b\n\n" * 20 + u"c d\ne\n\nf g\n")
+        self.otpl_file.close()
+        segments = ParallelOtplReader(self.otpl_file.name, jobs=2, chunk_size=64)
+        segments.separator = SPACES.pattern
+        result = []
+        self.assertRaisesRegexp(DataFormatError, u'line 42 has 1 columns, but expected 2',
+                                result.extend, segments)
+        self.assertEqual(20 * [[[u'a', u'b']]], result)
+
+    def testAsyncIteration(self):
+        self.otpl_file.write(u"tok1\tpos1\n\ntok2\tpos2\n\ntok3\tpos3\nfail\n")
+        self.otpl_file.close()
+        segments = OtplReader(self.otpl_file.name)
+        segments.separator = TAB.pattern
+
+        async def collect(reader, **kwargs):
+            return [s async for s in reader.aiter(**kwargs)]
+
+        self.assertRaisesRegex(DataFormatError, 'line 6 has 1 columns, but expected 2',
+                               asyncio.run, collect(segments, depth=1, block=1))
+
+        async def first(reader):
+            async for segment in reader:
+                return segment
+
+        self.assertEqual([[u'tok1', u'pos1']], asyncio.run(first(segments)))
+
+    def testReadingCompressedOtpl(self):
+        self.otpl_file.close()
+
+        with lzma.open(self.otpl_file.name, 'wt', encoding=Configuration.ENCODING) as stream:
+            stream.write(u"tök1\tpos1\ttag1\ntok2\tpos2\ttag2\n\ntok3\tpos3\ttag3\n")
+
+        segments = configure_reader(self.otpl_file.name, Configuration([__file__]))
+        self.assertEqual(TAB.pattern, segments.separator)
+        self.assertEqual([[[u'tök1', u'pos1', u'tag1'], [u'tok2', u'pos2', u'tag2']],
+                          [[u'tok3', u'pos3', u'tag3']]], list(segments))
+        self.assertRaises(IOError, getattr, segments, 'index')
+
+    def testReadingCompactSegments(self):
+        self.otpl_file.write(u"1 tok1 tag1\n2 tok2 tag2\n\n3 tok3 tag3\n\n")
+        self.otpl_file.close()
+        self.segments.compact = True
+        result = list(self.segments)
+        self.assertIsInstance(result[0], Segment)
+        self.assertEqual([[u'1', u'tok1', u'tag1'], [u'2', u'tok2', u'tag2']], result[0])
+        self.assertEqual(u'tok2', result[0][-1][1])
+        self.assertEqual((u'tag1', u'tag2'), result[0].column(2))
+        self.assertEqual([[u'2', u'tok2', u'tag2']], result[0][1:])
+        self.assertEqual(3, result[1].width)
+        self.assertRaises(IndexError, result[1].__getitem__, 1)
+
+    def testFollow(self):
+        self.otpl_file.write(u"1 a\n2 b\n\n3 c\n4")
+        self.otpl_file.flush()
+        follow = lambda: list(self.segments.follow(interval=0.01, timeout=0))
+        self.assertEqual([[[u'1', u'a'], [u'2', u'b']]], follow())
+        self.assertEqual((9, 4), self.segments.position)
+        self.assertEqual([], follow())
+        self.otpl_file.write(u" d\n\n\n5 e\n")
+        self.otpl_file.close()
+        self.assertEqual([[[u'3', u'c'], [u'4', u'd']]], follow())
+        self.assertEqual((19, 8), self.segments.position)
+
+        with open(self.otpl_file.name + '.new', 'w') as stream:
+            stream.write(u"6 f\n\n")
+
+        rotate = Timer(0.05, os.replace, (self.otpl_file.name + '.new', self.otpl_file.name))
+        rotate.start()
+        self.assertEqual([[[u'5', u'e']], [[u'6', u'f']]],
+                         list(self.segments.follow(interval=0.01, timeout=0.5)))
+        rotate.join()
+        self.assertEqual((5, 3), self.segments.position)
+
+        with open(self.otpl_file.name, 'w') as stream:
+            stream.write(u"g\n\n")
+
+        self.assertEqual([[[u'g']]], follow())
+
+    def testFollowStopsBeforeBadSegment(self):
+        self.otpl_file.write(u"1 a\n\n2 b\n3\n\n")
+        self.otpl_file.close()
+        segments = []
+        follow = lambda: segments.extend(self.segments.follow(interval=0.01, timeout=0))
+        self.assertRaisesRegexp(DataFormatError, u'line 4 has 1 columns, but expected 2', follow)
+        self.assertEqual([[[u'1', u'a']]], segments)
+        self.assertEqual((5, 3), self.segments.position)
+        self.assertRaises(DataFormatError, follow)
+
+    def testFollowedAndSlicedColumnCount(self):
+        self.otpl_file.write(u"1 a\n\n2 b c\n\n")
+        self.otpl_file.close()
+        message = u'line 3 has 3 columns, but expected 2'
+        self.assertRaisesRegexp(DataFormatError, message, list, self.segments.slice(1))
+        self.assertRaisesRegexp(DataFormatError, message,
+                                list, self.segments.follow(interval=0.01, timeout=0))
+
+    def testInternedColumns(self):
+        self.otpl_file.write(u"tok1 NULL O\ntok2 NULL O\n\n")
+        self.otpl_file.close()
+        first, second = list(self.segments)[0]
+        self.assertIsNot(first[1], second[1])
+        self.segments.interned = (2, 1)
+        self.assertEqual((1, 2), self.segments.interned)
+        first, second = list(self.segments)[0]
+        self.assertIs(first[1], second[1])
+        self.assertIs(first[2], second[2])
+        self.segments.columns = (0, 2)
+        first, second = list(self.segments)[0]
+        self.assertIs(first[2], second[2])
+        self.assertEqual([u'tok2', None, u'O'], second)
+
+    def testParallelInternedColumns(self):
+        self.otpl_file.write(u"".join(u"tok%d NULL O\n\n" % i for i in range(50)))
+        self.otpl_file.close()
+        segments = ParallelOtplReader(self.otpl_file.name, jobs=2, chunk_size=16)
+        segments.separator = SPACES.pattern
+        segments.interned = (1, 2)
+        result = list(segments)
+        self.assertEqual(50, len(result))
+        self.assertEqual(1, len(set(id(s[0][1]) for s in result)))
+        self.assertEqual(1, len(set(id(s[0][2]) for s in result)))
+
+    def testBatches(self):
+        self.otpl_file.write(u"a 1\n\nb 1\nb 2\nb 3\n\nc 1\n\nd 1\nd 2\n\ne 1\n")
+        self.otpl_file.close()
+        lengths = lambda batches: [[len(s) for s in b] for b in batches]
+        self.assertEqual([[1, 3], [1, 2], [1]], lengths(self.segments.batches(max_segments=2)))
+        self.assertEqual([[1], [3], [1, 2], [1]], lengths(self.segments.batches(max_tokens=3)))
+        self.assertEqual([[1], [3], [1], [2], [1]], lengths(self.segments.batches(max_bytes=8)))
+        self.assertEqual([[1, 1], [1], [2], [3]],
+                         lengths(self.segments.batches(max_segments=2, bucket_width=1)))
+        self.assertRaises(ValueError, list, self.segments.batches())
+
+    def testGuessColspecCompact(self):
+        self.segments.compact = True
+        self.testGuessColspecDefault()
+
+    def testReadingMappedOtpl(self):
+        self.otpl_file.write(u"1\ttok1\ttag1\n2\ttök2\ttag2\r\n\n\n3\ttok3\ttag3\n")
+        self.otpl_file.close()
+        config = Configuration([__file__])
+        config.mmap = True
+        segments = configure_reader(self.otpl_file.name, config)
+        self.assertIsInstance(segments, MappedOtplReader)
+        self.assertEqual(TAB.pattern, segments.separator)
+        result = list(segments)
+        self.assertEqual(2, len(result))
+        self.assertIsNone(result[1]._rows)
+        self.assertEqual(1, len(result[1]))
+        self.assertIsNone(result[1]._rows)
+        self.assertListEqual([u'2', u'tök2', u'tag2'], result[0][1])
+        self.assertEqual([[u'3', u'tok3', u'tag3']], result[1])
+
+    def testMappedVariableColumnNumbers(self):
+        self.otpl_file.write(u"% skip\n1\t2\t3\n\n1\t2\n")
+        self.otpl_file.close()
+        segments = MappedOtplReader(self.otpl_file.name)
+        segments.filter = u'^%'
+        segments.separator = TAB.pattern
+        self.assertRaisesRegexp(DataFormatError, u'line 4 has 2 columns, but expected 3',
+                                list, segments)
+
+    def testMappedChunks(self):
+        self.otpl_file.write(u"a\tb\n\n\n\nc\td\nü\tf\n\ng\th\n\n\ni\tj")
+        self.otpl_file.close()
+        plain = OtplReader(self.otpl_file.name)
+        plain.separator = TAB.pattern
+        segments = MappedOtplReader(self.otpl_file.name)
+        segments.separator = TAB.pattern
+        segments.CHUNK_SIZE = 3
+        self.assertEqual(list(plain), list(segments))
+        segments.separator = u'\\s+'
+        self.assertEqual(list(plain), list(segments))
+
+    def testMappedChunksErrorLine(self):
+        self.otpl_file.write(u"a\tb\nc\td\n\n" * 20 + u"e\n")
+        self.otpl_file.close()
+        plain = OtplReader(self.otpl_file.name)
+        plain.separator = TAB.pattern
+        segments = MappedOtplReader(self.otpl_file.name)
+        segments.separator = TAB.pattern
+        segments.CHUNK_SIZE = 8
+        message = u'line 61 has 1 columns, but expected 2'
+        self.assertRaisesRegex(DataFormatError, message, list, plain)
+        self.assertRaisesRegex(DataFormatError, message, list, segments)
+
+    def testLineParsers(self):
+        self.otpl_file.write(u" a b\n c d\n\n%x y\ne\u3000f \n\n")
+        self.otpl_file.close()
+        self.segments.filter = u'^%'
+        self.assertEqual([[[u'', u'a', u'b'], [u'', u'c', u'd']], [[u'e', u'f', u'']]],
+                         list(self.segments))
+        self.segments.separator = TAB.pattern
+        self.assertEqual([[[u' a b'], [u' c d']], [[u'e\u3000f ']]], list(self.segments))
+
+    def testColumnProjection(self):
+        self.otpl_file.write(u"s1\t1\ttok1\tNN\tO\ns1\t2\ttok2\tNN\tO\n\ns2\t1\ttok3\tNN\n\n")
+        self.otpl_file.close()
+        config = Configuration([__file__])
+        config.columns = [2, 1]
+        config.separator = TAB.pattern
+        self.assertIsNone(configure_reader(self.otpl_file.name, config).columns)
+        config.colspec = ColumnSpecification.from_string('SEGMENT_ID LOCAL_ENUM TOKEN POS_TAG ENTITY')
+        segments = configure_reader(self.otpl_file.name, config)
+        self.assertEqual((1, 2), segments.columns)
+        result = segments.segment(0)
+        self.assertEqual([[None, u'1', u'tok1', None, None], [None, u'2', u'tok2', None, None]],
+                         result)
+        self.assertRaisesRegexp(DataFormatError, u'line 4 has 4 columns, but expected 5',
+                                list, segments)
+        segments.separator = SPACES.pattern
+        self.assertEqual([None, u'1', u'tok1', None, None], segments.segment(0)[0])
+
     def testGuessSepSpaces(self):
         self.otpl_file.write((u"1 tok1\ttag1\n2 tok2\ttag2\n\n"
                               u"1 tok3\ttag3\n2 tok4\ttag4\n\n"))
@@ -64,6 +357,18 @@ class TestReader(OtplTestBase):
             u"4 seg2 2 tok4 pos4 I-tag4 ns:id4 1 rel2 0 0 null E-tag att4\n\n",
             header)
 
+    def testGuessColspecFromSample(self):
+        self.otpl_file.write(u"tok NN NULL\n\n" * 7 + u"tok NN negated\n\n")
+        self.otpl_file.close()
+        self.assertEqual(u'TOKEN POS_TAG NORMALIZATION', str(guess_colspec(self.segments)))
+        colspec, confidences = guess_colspec_with_confidence(self.segments, sample=100)
+        self.assertEqual(u'TOKEN POS_TAG ATTRIBUTE', str(colspec))
+        self.assertEqual([1.0, 1.0, 0.125], confidences)
+        self.assertEqual(colspec, guess_colspec(self.segments, sample=8, budget=10))
+        self.segments.columns = (0, 2)
+        colspec, confidences = guess_colspec_with_confidence(self.segments, sample=100)
+        self.assertEqual(3, len(confidences))
+
     def testColspecHeader(self):
         # note that normally, the first ENTITY would be guessed as a POS_TAG
         header = u"SEGMENT_ID TOKEN ENTITY ENTITY LOCAL_REF:4 LOCAL_REF:7 EVENT"
@@ -136,6 +441,36 @@ class TestReader(OtplTestBase):
             u"TOKEN POS_TAG LOCAL_REF RELATION"
         )
 
+    def testGuessLocalRefOutsideLocalEnum(self):
+        self.guessColspec(
+            u"0 tok1 pos1 2 rel1\n"
+            u"1 tok2 pos2 2 rel1\n\n"
+            u"0 tok3 pos3 1 rel1\n"
+            u"1 tok4 pos4 2 rel1\n\n",
+            u"LOCAL_ENUM TOKEN POS_TAG LOCAL_REF RELATION"
+        )
+
+    def testColumnProfile(self):
+        profile = ColumnProfile()
+        profile.add(('3', '1', '3'))
+        self.assertFalse(profile.out_of_segment)
+        profile.add(('B-X', 'O', 'NULL', '7', '7'), sizes=(2, 3))
+        self.assertEqual((8, 5, 2, 1, 1), (profile.rows, profile.digits, profile.bioe,
+                                           profile.norms, profile.nulls))
+        self.assertEqual((1, 7), (profile.min_int, profile.max_int))
+        self.assertEqual(6, profile.distinct)
+        self.assertTrue(profile.out_of_segment)
+        self.assertFalse(profile.constant)
+        constant = ColumnProfile()
+        constant.add(('a', 'a', 'b', 'b'), sizes=(2, 2))
+        self.assertTrue(constant.constant)
+        constant.merge(profile)
+        self.assertEqual((12, 5), (constant.rows, constant.digits))
+        self.assertFalse(constant.constant)
+        projected = ColumnProfile()
+        projected.add((None, None))
+        self.assertEqual((0, 0), (projected.rows, projected.distinct))
+
     def guessColspec(self, otpl_text, header):
         self.otpl_file.write(otpl_text)
         self.otpl_file.close()
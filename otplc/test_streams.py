@@ -0,0 +1,63 @@
+# coding=utf-8
+import gzip
+import os
+from io import BytesIO, StringIO
+from tempfile import NamedTemporaryFile
+from unittest import TestCase
+from mock import patch
+from otplc.streams import iter_lines, read_ahead
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestReadAhead(TestCase):
+
+    def testOrder(self):
+        self.assertEqual(list(range(100)), list(read_ahead(iter(range(100)), depth=2, block=7)))
+
+    def testError(self):
+        def failing():
+            yield 'line'
+            raise IOError('broken')
+
+        lines = read_ahead(failing(), block=10)
+        self.assertEqual('line', next(lines))
+        self.assertRaisesRegex(IOError, 'broken', next, lines)
+
+    def testEarlyStop(self):
+        lines = read_ahead(iter(range(10000)), depth=1, block=1)
+        self.assertEqual(0, next(lines))
+        lines.close()
+
+
+class TestIterLines(TestCase):
+
+    def setUp(self):
+        self.file = NamedTemporaryFile(suffix='.txt', delete=False)
+        self.file.close()
+
+    def tearDown(self):
+        os.remove(self.file.name)
+
+    def assertLines(self, data):
+        with open(self.file.name, 'wb') as stream:
+            stream.write(data)
+
+        with patch('builtins.open', wraps=open) as open_mock:
+            lines = list(iter_lines(self.file.name, encoding='utf-8'))
+
+        self.assertEqual(['tëxt\n', 'more\n'], lines)
+        open_mock.assert_called_once_with(self.file.name, 'rb')
+
+    def testPlainFileOpenedOnce(self):
+        self.assertLines('tëxt\nmore\n'.encode('utf-8'))
+
+    def testMagicBytesOpenedOnce(self):
+        self.assertLines(gzip.compress('tëxt\nmore\n'.encode('utf-8')))
+
+    def testStreamsNotClosedWhenAbandoned(self):
+        for stream in (StringIO('a\nb\n'), BytesIO(b'a\nb\n')):
+            lines = iter_lines(stream, encoding='utf-8')
+            self.assertEqual('a\n', next(lines))
+            lines.close()
+            self.assertFalse(stream.closed)
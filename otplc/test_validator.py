@@ -0,0 +1,84 @@
+# coding=utf-8
+from mock import patch
+from otplc import ColumnSpecification, Configuration, configure_reader
+from otplc.reader import OtplReader
+from otplc.test_base import OtplTestBase
+from otplc.validator import Problem, validate, validate_otpl
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+
+
+class TestValidator(OtplTestBase):
+
+    def setUp(self):
+        super(TestValidator, self).setUp()
+        self.colspec = ColumnSpecification.from_string(
+            'TOKEN ENTITY LOCAL_REF RELATION GLOBAL_REF RELATION'
+        )
+        self.otpl_file.write(
+            u"a B-X 0 NULL 0 NULL\n"
+            u"b E-X 1 rel 0 NULL\n"
+            u"c O 0 NULL 5 grel\n"
+            u"\n"
+            u"d I-Y 0 NULL 0 NULL\n"
+            u"e E-Z 4 rel 9 grel\n"
+            u"f O\n"
+            u"g K-Y x NULL 0 NULL\n"
+        )
+        self.otpl_file.close()
+        self.config = Configuration([self.text_file.name])
+        self.config.separator = r'\s+'
+        self.expected = [
+            Problem(3, 'column 6 has no target in column 2'),
+            Problem(6, '"E-Z" continues a "Y" run in column 2'),
+            Problem(6, 'unresolved reference 3->2 with number 4'),
+            Problem(6, 'unresolved reference 5->2 with number 9'),
+            Problem(7, 'has 2 columns, but expected 6'),
+            Problem(8, 'bad BIOE tag "K-Y" in column 2'),
+            Problem(8, 'reference column 3 has "x", but expected an integer'),
+        ]
+
+    def testValidateSinglePass(self):
+        segments = configure_reader(self.otpl_file.name, self.config)
+        self.assertEqual(self.expected, validate(segments, self.colspec, jobs=1))
+
+    def testValidateParallel(self):
+        segments = configure_reader(self.otpl_file.name, self.config)
+        self.assertEqual(self.expected,
+                         validate(segments, self.colspec, jobs=2, chunk_size=8))
+
+    def testValidateSingleChunk(self):
+        segments = configure_reader(self.otpl_file.name, self.config)
+
+        with patch('otplc.reader.ProcessPoolExecutor') as pool_mock:
+            self.assertEqual(self.expected, validate(segments, self.colspec, jobs=2))
+
+        self.assertFalse(pool_mock.called)
+
+    def testUndefinedSeparator(self):
+        segments = OtplReader(self.otpl_file.name)
+        self.assertRaises(AttributeError, validate, segments, self.colspec, jobs=1)
+        self.assertRaises(AttributeError, validate, segments, self.colspec, jobs=2, chunk_size=8)
+
+    def testValidateOtpl(self):
+        self.config = Configuration([self.otpl_file.name])  # same suffix
+        self.config.separator = r'\s+'
+        self.config.colspec = self.colspec
+        self.interceptLogs('otplc.validator')
+        self.assertEqual(1, validate_otpl(self.config))
+        self.test_log.assertMatches('"%s" %s', levelname='ERROR', count=7)
+        self.test_log.assertMatches('%d problems in "%s"', levelname='WARNING',
+                                    args=(7, self.otpl_file.name))
+        self.assertEqual('line 7: has 2 columns, but expected 6', str(self.expected[4]))
+
+    def testValidateOtplJobs(self):
+        self.config = Configuration([self.otpl_file.name])
+        self.config.separator = r'\s+'
+        self.config.colspec = self.colspec
+
+        with patch('otplc.validator.validate', return_value=[]) as validate_mock:
+            self.assertEqual(0, validate_otpl(self.config))
+            self.config.jobs = 0
+            self.assertEqual(0, validate_otpl(self.config))
+
+        self.assertEqual([1, 0], [args[2] for args, _ in validate_mock.call_args_list])
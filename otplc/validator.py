@@ -0,0 +1,386 @@
+"""
+A fast, streaming validation pass over whole OTPL files that collects *all*
+problems (with their line numbers) instead of failing at the first one.
+
+The validator checks, for a given column specification:
+
+* that every row has as many columns as the colspec,
+* that enumeration cells are non-zero integers (and local enumerations are
+  unique within their segment),
+* that reference cells are integers,
+* that local and global references resolve to an annotated target row,
+* that relations and properties have an annotated target in their own row,
+  and
+* that entity columns contain well-formed BIOE runs.
+
+Large files are validated in parallel over chunks (see
+:class:`otplc.reader.ParallelOtplReader`), which is far faster than a full
+conversion, as the text files are never aligned and nothing is written.
+"""
+import os
+from collections import defaultdict, namedtuple
+from functools import partial
+from logging import getLogger
+from os.path import exists
+
+from otplc.colspec import ColumnSpecification as Spec
+from otplc.converter import make_path_to
+from otplc.reader import ParallelOtplReader, configure_reader, guess_colspec
+from otplc.streams import detect_compression
+
+
+__author__ = 'Florian Leitner <florian.leitner@gmail.com>'
+L = getLogger('otplc.validator')
+
+UNANNOTATED = frozenset(('', 'NULL', 'O', '0'))
+"Cell values that do not represent an annotation (and thus a valid target)."
+
+
+class Problem(namedtuple('Problem', 'line message')):
+
+    """ A validation problem: its (one-based) line number and a message. """
+
+    __slots__ = ()
+
+    def __str__(self):
+        return 'line %d: %s' % self
+
+
+def validate(reader, colspec, jobs=None, chunk_size=None):
+    """
+    Validate all lines of the file or stream read by a (configured) `reader`
+    against a `colspec`.
+
+    Plain files are validated in parallel over chunks unless `jobs` is 1
+    or the file fits into a single chunk; streams and compressed files are
+    validated in a single pass.
+
+    :param reader: an :class:`otplc.reader.OtplReader` with a defined
+                   separator (and, optionally, filter)
+    :param colspec: the :class:`otplc.colspec.ColumnSpecification`
+    :param jobs: the number of worker processes (default: CPU count)
+    :param chunk_size: the approximate chunk size in bytes (see
+                       :class:`otplc.reader.ParallelOtplReader`)
+    :return: a list of :class:`Problem` instances ordered by line number
+    :raises IOError: when the I/O operation fails
+    :raises UnicodeDecodeError: when the input isn't in UTF-8 encoding
+    :raises AttributeError: if the reader's separator is undefined
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunk_size = chunk_size or ParallelOtplReader.CHUNK_SIZE
+    path = reader.path
+
+    if jobs == 1 or reader.is_stream or detect_compression(path) or \
+            os.path.getsize(path) <= chunk_size:
+        checker = OtplValidator(colspec)
+        split, skip = reader.line_parser()
+        checker.check(reader.lines(), split, skip)
+        checker.resolve_global_refs()
+        return sorted(checker.problems)
+
+    chunks = ParallelOtplReader.like(reader, jobs, chunk_size)
+    checker = OtplValidator(colspec)
+    line_offset = 0
+
+    for result in chunks.map_chunks(partial(_validate_chunk,
+                                            colspec=colspec)):
+        checker.merge(*result, line_offset=line_offset)
+        line_offset += result[1]
+
+    checker.resolve_global_refs()
+    return sorted(checker.problems)
+
+
+def validate_otpl(configuration):
+    """
+    For a list of `text_files` (paths), validate the associated OTPL files,
+    logging every problem found.
+
+    Each file is validated in :attr:`Configuration.jobs` worker processes
+    (0: one per CPU; see :func:`validate`).
+
+    :type configuration: Configuration
+    :return: the number of invalid (or missing) OTPL files
+    """
+    errors = 0
+
+    for text_file in configuration.input_files:
+        otpl_file = make_path_to(text_file, configuration.otpl_suffix)
+
+        if not exists(otpl_file):
+            L.error('could not locate OTPL file "%s" for "%s"',
+                    otpl_file, text_file)
+            errors += 1
+            continue
+
+        segments = configure_reader(otpl_file, configuration)
+
+        if segments is None:
+            errors += 1
+            continue
+
+        colspec = configuration.colspec or guess_colspec(segments)
+
+        if colspec is None:
+            L.error('no colspec for "%s" - specify one manually', otpl_file)
+            errors += 1
+            continue
+
+        problems = validate(segments, colspec, configuration.jobs)
+
+        for problem in problems:
+            L.error('"%s" %s', otpl_file, str(problem))
+
+        if problems:
+            L.warning('%d problems in "%s"', len(problems), otpl_file)
+            errors += 1
+
+    return errors
+
+
+def _validate_chunk(lines, reader, colspec=None):
+    """
+    Validate the `lines` of one chunk of a file split and filtered as by
+    the `reader` (in a worker process).
+
+    :return: a ``(problems, line count, row count, global targets, global
+             references)`` tuple, where line numbers and row numbers are
+             relative to the chunk
+    """
+    split, skip = reader.line_parser()
+    checker = OtplValidator(colspec)
+    checker.check(lines, split, skip)
+    return (checker.problems, len(lines), checker.rows,
+            dict(checker.global_targets), checker.global_refs)
+
+
+class OtplValidator(object):
+
+    """
+    Collects the problems found in the lines of an OTPL file for a given
+    column specification.
+
+    Global references can only be resolved once the whole file has been
+    checked; therefore, their targets and the references themselves are
+    collected, and resolved by :meth:`.resolve_global_refs`.
+    """
+
+    def __init__(self, colspec):
+        """
+        :param colspec: the :class:`otplc.colspec.ColumnSpecification`
+        """
+        self.width = colspec.width
+        self.problems = []
+        self.rows = 0  # the number of token rows checked so far
+        # the IDs of annotated rows in globally referenced target columns:
+        self.global_targets = defaultdict(set)  # {column: {id}}
+        self.global_refs = []  # [(line, column, value)]
+        self._global_enum = colspec.global_enum
+        self._local_enum = colspec.local_enum
+        self._enums = [c for c in (colspec.global_enum, colspec.local_enum)
+                       if c is not None]
+        self._entities = sorted(colspec.iter_entities())
+        self._local_refs = {}
+        self._global_refs = {}
+        self._sources = {}  # relation and property columns: target column
+
+        for col in range(self.width):
+            coltype = colspec.get_type(col)
+
+            if coltype == Spec.LOCAL_REF:
+                self._local_refs[col] = colspec.get_reference_target(col)
+            elif coltype == Spec.GLOBAL_REF:
+                self._global_refs[col] = colspec.get_reference_target(col)
+            elif coltype == Spec.RELATION:
+                self._sources[col] = colspec.get_relation_target(col)
+            elif coltype == Spec.NORMALIZATION:
+                self._sources[col] = colspec.get_normalization_target(col)
+            elif coltype == Spec.ATTRIBUTE:
+                self._sources[col] = colspec.get_attribute_target(col)
+
+        self._global_target_columns = set(self._global_refs.values())
+
+    def add(self, lno, message):
+        """ Record a problem at line `lno`. """
+        self.problems.append(Problem(lno, message))
+
+    def check(self, lines, split, skip=None, first_lno=1):
+        """
+        Check all `lines` (without line terminators).
+
+        :param lines: an iterable of lines
+        :param split: a function splitting a line into its fields
+        :param skip: a function returning a true value for filtered lines
+        :param first_lno: the line number of the first line
+        """
+        width = self.width
+        segment = []
+
+        for lno, line in enumerate(lines, first_lno):
+            if line:
+                if skip is not None and skip(line):
+                    continue
+
+                fields = split(line)
+
+                if len(fields) == width:
+                    segment.append((lno, fields))
+                else:
+                    self.add(lno, 'has %d columns, but expected %d' % (
+                        len(fields), width
+                    ))
+            elif segment:
+                self.check_segment(segment)
+                segment = []
+
+        if segment:
+            self.check_segment(segment)
+
+    def check_segment(self, segment):
+        """ Check a list of ``(line number, fields)`` rows. """
+        for lno, fields in segment:
+            self._check_integers(lno, fields)
+
+        local_ids = self._check_local_enum(segment)
+
+        for col in self._entities:
+            self._check_bioe(segment, col)
+
+        for col, target in self._sources.items():
+            for lno, fields in segment:
+                if fields[col] not in UNANNOTATED and \
+                        fields[target] in UNANNOTATED:
+                    self.add(lno, 'column %d has no target in column %d' % (
+                        col + 1, target + 1
+                    ))
+
+        for col, target in self._local_refs.items():
+            for lno, fields in segment:
+                value = fields[col]
+
+                if value != '0' and value.isdigit():
+                    row = local_ids.get(value)
+
+                    if row is None or row[target] in UNANNOTATED:
+                        self.add(lno, 'unresolved reference %d->%d with '
+                                      'number %s' % (col + 1, target + 1,
+                                                     value))
+
+        self._collect_global_refs(segment)
+        self.rows += len(segment)
+
+    def merge(self, problems, lines, rows, global_targets, global_refs,
+              line_offset=0):
+        """
+        Merge the results of a chunk (see :func:`_validate_chunk`) that
+        starts after `line_offset` lines and after all rows seen so far.
+        """
+        rebase_rows = self._global_enum is None
+
+        for lno, message in problems:
+            self.add(lno + line_offset, message)
+
+        for col, ids in global_targets.items():
+            if rebase_rows:
+                ids = {num + self.rows for num in ids}
+
+            self.global_targets[col].update(ids)
+
+        for lno, col, value in global_refs:
+            self.global_refs.append((lno + line_offset, col, value))
+
+        self.rows += rows
+
+    def resolve_global_refs(self):
+        """ Record a problem for each unresolved global reference. """
+        for lno, col, value in self.global_refs:
+            target = self._global_refs[col]
+
+            if value not in self.global_targets[target]:
+                self.add(lno, 'unresolved reference %d->%d with number %s' % (
+                    col + 1, target + 1, value
+                ))
+
+        self.global_refs = []
+
+    def _check_integers(self, lno, fields):
+        for col in self._enums:
+            value = fields[col]
+
+            if not value.isdigit() or value.strip('0') == '':
+                self.add(lno, 'enumeration column %d has "%s", but expected '
+                              'a non-zero integer' % (col + 1, value))
+
+        for col in self._local_refs:
+            self._check_reference(lno, fields, col)
+
+        for col in self._global_refs:
+            self._check_reference(lno, fields, col)
+
+    def _check_reference(self, lno, fields, col):
+        if not fields[col].isdigit():
+            self.add(lno, 'reference column %d has "%s", but expected an '
+                          'integer' % (col + 1, fields[col]))
+
+    def _check_local_enum(self, segment):
+        """ Return a mapping of local IDs to the segment's rows. """
+        if self._local_enum is None:
+            return {str(num): fields
+                    for num, (lno, fields) in enumerate(segment, 1)}
+
+        col = self._local_enum
+        local_ids = {}
+
+        for lno, fields in segment:
+            if fields[col] in local_ids:
+                self.add(lno, 'local enumeration %s in column %d is not '
+                              'unique' % (fields[col], col + 1))
+            else:
+                local_ids[fields[col]] = fields
+
+        return local_ids
+
+    def _check_bioe(self, segment, col):
+        """ Check the BIOE run structure of an entity column. """
+        run = None  # the name of the currently open entity run
+
+        for lno, fields in segment:
+            value = fields[col]
+
+            if value == 'O':
+                run = None
+            elif value[:2] in ('B-', 'I-', 'E-') and len(value) > 2:
+                prefix, name = value[:2], value[2:]
+
+                if prefix != 'B-' and run is not None and run != name:
+                    self.add(lno, '"%s" continues a "%s" run in column %d' % (
+                        value, run, col + 1
+                    ))
+
+                run = None if prefix == 'E-' else name
+            else:
+                self.add(lno, 'bad BIOE tag "%s" in column %d' % (
+                    value, col + 1
+                ))
+                run = None
+
+    def _collect_global_refs(self, segment):
+        if not self._global_refs:
+            return
+
+        for num, (lno, fields) in enumerate(segment, self.rows + 1):
+            ident = num if self._global_enum is None else \
+                fields[self._global_enum]
+
+            for target in self._global_target_columns:
+                if fields[target] not in UNANNOTATED:
+                    self.global_targets[target].add(ident)
+
+            for col in self._global_refs:
+                value = fields[col]
+
+                if value != '0' and value.isdigit():
+                    self.global_refs.append((
+                        lno, col, int(value) if self._global_enum is None
+                        else value
+                    ))
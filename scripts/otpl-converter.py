@@ -26,7 +26,8 @@ import os
 import sys
 from argparse import ArgumentParser
 
-from otplc import ColumnSpecification, otpl_to_brat, Configuration, __version__
+from otplc import ColumnSpecification, otpl_to_brat, validate_otpl, Configuration, \
+    __version__
 
 
 __author__ = 'Florian Leitner <florian.leitner@gmail.com>'
@@ -56,6 +57,17 @@ parser.add_argument('--separator', metavar='REGEX',
                          '/\\s+/ and /\\t/ are auto-detected)')
 parser.add_argument('--colspec', metavar='SPEC',
                     help='provide an OTPL colspec string [auto-detected]')
+parser.add_argument('--guess-sample', metavar='N', type=int,
+                    help='guess the colspec from N segments sampled from the whole file '
+                         '[first segments only]')
+parser.add_argument('--guess-cache', metavar='FILE',
+                    help='reuse colspecs guessed for files with the same layout, '
+                         'storing them in FILE [none]')
+parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                    help='convert N files (or validate N chunks) in parallel '
+                         '(0: one per CPU) [%(default)s]')
+parser.add_argument('--validate', action='store_true',
+                    help='only validate the OTPL files, reporting all problems found')
 
 # brat-specific options
 parser.add_argument('--brat-suffix', metavar='SUFFIX', default=Configuration.BRAT_SUFFIX,
@@ -106,8 +118,15 @@ config.otpl_suffix = args.otpl_suffix
 config.config = args.config
 config.filter = args.filter
 config.separator = args.separator
+config.guess_sample = args.guess_sample
+config.guess_cache = args.guess_cache
+config.jobs = args.jobs
 
-if args.format == 'brat':
+if args.validate:
+    # Validate the OTPL files only
+    # Exit value: number of invalid files
+    sys.exit(validate_otpl(config))
+elif args.format == 'brat':
     # Convert OTPL annotations into brat files
     # Exit value: number of failed conversions
     sys.exit(otpl_to_brat(config))